@@ -0,0 +1,263 @@
+'''
+anno_store.py
+
+Columnar store of the MOT ground truth annotations, built once from the gt.txt files
+and shared by the tools that read them (evaluate.py, tools/mot2yolo.py and
+tools/get_tiny_dataset.py), so they do not parse the text files again.
+
+Each location is stored as two files in store_dir:
+    {location}.npy: a structured NumPy array (see DTYPE) with one row per annotation,
+                    the rows of every clip one after the other, in clip name order
+    {location}.json: the index: for every clip, the [start, stop) rows of the clip,
+                     its number of columns, and the size and mtime of its gt.txt
+
+Within a clip, rows are sorted by frame, keeping file order within a frame, so the
+rows of a range of frames are found by binary search. For gt.txt files written in
+frame order (as every CFC annotation file is), AnnotationStore.rows returns exactly
+what nmae.parse_mot_file returns for the file.
+
+The .npy files are memory-mapped on load: opening a store reads only its index, and
+processes that open the same store (e.g. evaluate.py --workers) share its pages.
+
+Input:
+    - anno_dir: directory of ground truth annotations, {anno_dir}/{location}/{clip}/gt.txt
+    - store_dir: directory to write the store to
+    - location: (optional) locations to build (default: every location directory in anno_dir)
+    - force: (optional) rebuild locations whose annotations have not changed since they were stored
+
+Example command:
+python anno_store.py --anno_dir PATH/TO/annotations --store_dir PATH/TO/annotations-store
+'''
+
+import argparse
+import json
+import os
+import tempfile
+import numpy as np
+
+from nmae import parse_mot_file
+
+GT_FILE = "gt.txt"
+# part of every index, to be increased when DTYPE or the layout changes
+STORE_VERSION = 1
+# the columns of a MOT line: frame, id, box, confidence, and the rest (class, visibility, ...)
+# in extra, NaN for the columns a file does not have
+NUM_EXTRA_COLUMNS = 3
+DTYPE = np.dtype([
+    ('frame', np.int32),
+    ('id', np.int32),
+    ('x', np.float64),
+    ('y', np.float64),
+    ('w', np.float64),
+    ('h', np.float64),
+    ('conf', np.float64),
+    ('extra', np.float64, (NUM_EXTRA_COLUMNS,)),
+])
+MIN_COLUMNS = 6
+MAX_COLUMNS = 7 + NUM_EXTRA_COLUMNS
+
+
+def get_clip_dirs(loc_anno_dir):
+    '''
+    Sorted names of the clip directories of a location that have a gt.txt
+    '''
+    return sorted(clip for clip in os.listdir(loc_anno_dir) if os.path.isfile(os.path.join(loc_anno_dir, clip, GT_FILE)))
+
+def get_file_stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def rows_to_records(rows, path=""):
+    '''
+    (N, C) rows of a MOT file, as nmae.parse_mot_file, to a DTYPE array sorted by frame
+    '''
+    num_cols = rows.shape[1]
+    if len(rows) and not MIN_COLUMNS <= num_cols <= MAX_COLUMNS:
+        raise ValueError(f"{path} has {num_cols} columns, the store supports {MIN_COLUMNS} to {MAX_COLUMNS}")
+    if np.any(rows[:, :2] != np.round(rows[:, :2])):
+        raise ValueError(f"{path} has frames or ids that are not integers")
+    rows = rows[np.argsort(rows[:, 0], kind='stable')]
+    records = np.empty(len(rows), dtype=DTYPE)
+    for col, name in enumerate(DTYPE.names[:7]):
+        records[name] = rows[:, col] if col < num_cols else np.nan
+    records['extra'] = np.nan
+    records['extra'][:, :max(0, num_cols - 7)] = rows[:, 7:]
+    return records
+
+def records_to_rows(records, num_cols):
+    '''
+    Inverse of rows_to_records: (N, num_cols) float64 rows
+    '''
+    rows = np.empty((len(records), num_cols))
+    for col, name in enumerate(DTYPE.names[:min(7, num_cols)]):
+        rows[:, col] = records[name]
+    rows[:, 7:] = records['extra'][:, :max(0, num_cols - 7)]
+    return rows
+
+def format_mot_rows(rows):
+    '''
+    The lines of a MOT file of rows, in the CFC annotation format ("frame, id, x, y, w, h, ...").
+    Values are written with the fewest digits that read back as the same floats.
+    '''
+    return ["".join([", ".join("%d" % value if value.is_integer() else repr(value) for value in row), "\n"]) for row in rows.tolist()]
+
+def is_location_current(loc_anno_dir, store_dir, location):
+    '''
+    Whether the stored location has the same clips as loc_anno_dir, with unchanged gt.txt files
+    '''
+    try:
+        index = read_index(store_dir, location)
+    except (OSError, ValueError):
+        return False
+    clips = get_clip_dirs(loc_anno_dir)
+    return clips == list(index['clips']) and all(
+        index['clips'][clip]['stat'] == get_file_stat(os.path.join(loc_anno_dir, clip, GT_FILE)) for clip in clips)
+
+def build_location(loc_anno_dir, store_dir, location):
+    '''
+    Parse the gt.txt file of every clip of a location and write them to the store.
+    Returns:
+        tuple, (number of clips, number of rows)
+    '''
+    records = []
+    clips = {}
+    start = 0
+    for clip in get_clip_dirs(loc_anno_dir):
+        path = os.path.join(loc_anno_dir, clip, GT_FILE)
+        # the stat before parsing, so a file modified while it is parsed is seen as out of date
+        stat = get_file_stat(path)
+        rows = parse_mot_file(path)
+        records.append(rows_to_records(rows, path))
+        clips[clip] = { 'start': start, 'stop': start + len(rows), 'num_cols': rows.shape[1], 'stat': stat }
+        start += len(rows)
+    records = np.concatenate(records) if records else np.empty(0, dtype=DTYPE)
+    index = { 'version': STORE_VERSION, 'location': location, 'num_rows': len(records), 'clips': clips }
+
+    # the array is replaced before the index, and an index is only valid with an array of its num_rows
+    os.makedirs(store_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=store_dir, suffix=".npy.tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, records)
+    os.replace(tmp_path, os.path.join(store_dir, location + ".npy"))
+    fd, tmp_path = tempfile.mkstemp(dir=store_dir, suffix=".json.tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(store_dir, location + ".json"))
+    return len(clips), len(records)
+
+def build_store(anno_dir, store_dir, locations=None, force=False, quiet=False):
+    '''
+    Build the store of every location of anno_dir (or of locations), skipping the
+    locations that are already stored and unchanged, unless force.
+    Returns:
+        list of the locations that were built
+    '''
+    if locations is None:
+        locations = sorted(location for location in os.listdir(anno_dir) if os.path.isdir(os.path.join(anno_dir, location)))
+    built = []
+    for location in locations:
+        loc_anno_dir = os.path.join(anno_dir, location)
+        if not force and is_location_current(loc_anno_dir, store_dir, location):
+            if not quiet:
+                print(location, "is up to date")
+            continue
+        num_clips, num_rows = build_location(loc_anno_dir, store_dir, location)
+        built.append(location)
+        if not quiet:
+            print(f"{location}: {num_clips} clips, {num_rows} annotations")
+    return built
+
+def get_locations(store_dir):
+    '''
+    Sorted names of the locations in a store
+    '''
+    return sorted(name[:-len(".json")] for name in os.listdir(store_dir) if name.endswith(".json"))
+
+def read_index(store_dir, location):
+    with open(os.path.join(store_dir, location + ".json"), "r") as f:
+        index = json.load(f)
+    if index.get('version') != STORE_VERSION:
+        raise ValueError(f"{location} was stored by another version of anno_store.py, build the store again")
+    return index
+
+class AnnotationStore:
+    '''
+    The stored annotations of one location, memory-mapped (see the module docstring).
+    Every query returns a read-only DTYPE array, a view of the store.
+    '''
+
+    def __init__(self, store_dir, location):
+        self.location = location
+        self.index = read_index(store_dir, location)
+        self.records = np.load(os.path.join(store_dir, location + ".npy"), mmap_mode='r')
+        if len(self.records) != self.index['num_rows']:
+            raise ValueError(f"The store of {location} is incomplete, build it again")
+
+    def __contains__(self, clip):
+        return clip in self.index['clips']
+
+    def clips(self):
+        '''
+        Sorted names of the clips of the location
+        '''
+        return list(self.index['clips'])
+
+    def clip(self, clip):
+        '''
+        The annotations of a clip, sorted by frame
+        '''
+        info = self.index['clips'][clip]
+        return self.records[info['start']:info['stop']]
+
+    def frames(self, clip, start, stop=None):
+        '''
+        The annotations of a clip in frames start to stop - 1 (to the last frame if stop is None)
+        '''
+        records = self.clip(clip)
+        first = np.searchsorted(records['frame'], start, side='left')
+        last = len(records) if stop is None else np.searchsorted(records['frame'], stop, side='left')
+        return records[first:max(first, last)]
+
+    def track(self, clip, track_id):
+        '''
+        The annotations of one track of a clip, sorted by frame
+        '''
+        records = self.clip(clip)
+        return records[records['id'] == track_id]
+
+    def rows(self, clip):
+        '''
+        The annotations of a clip as a (N, C) float64 array of MOT rows, as nmae.parse_mot_file
+        returns them (C is the number of columns of the clip's gt.txt)
+        '''
+        return records_to_rows(self.clip(clip), self.index['clips'][clip]['num_cols'])
+
+    def is_current(self, clip, path):
+        '''
+        Whether the clip is stored, and the gt.txt file at path has not changed since
+        '''
+        info = self.index['clips'].get(clip)
+        try:
+            return info is not None and info['stat'] == get_file_stat(path)
+        except OSError:
+            return False
+
+def open_store(store_dir, location):
+    '''
+    The AnnotationStore of a location, or None if store_dir is None or does not have the location
+    '''
+    if store_dir is None or not os.path.isfile(os.path.join(store_dir, location + ".json")):
+        return None
+    return AnnotationStore(store_dir, location)
+
+def argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--anno_dir", default="annotations", help="Location of ground truth annotations in MOTChallenge format.")
+    parser.add_argument("--store_dir", required=True, help="Directory to write the annotation store to.")
+    parser.add_argument("--location", nargs="+", default=None, help="Locations to build (default: every location directory in --anno_dir).")
+    parser.add_argument("--force", action="store_true", help="Rebuild locations whose annotations have not changed.")
+    return parser
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
+    build_store(args.anno_dir, args.store_dir, args.location, args.force)
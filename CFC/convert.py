@@ -6,22 +6,99 @@ Converts a clip (sequence of frames) to its 3-channel Baseline++ version.
 The three channels will be: (1) The raw image, (2) A background-subtracted version, (3) Frame-to-frame difference
 
 Input: 
-    - in_dir: input directory of where the frames are (default: current_working_directory/frames/raw/ )
-    - out_dir: output directory of where you want the background-subtracted frames to live (default: current_working_directory/frames/3-channel/ )
+    - in_dir: input directory of where the frames are (default: current_working_directory/frames/raw/ ). Clips can
+              also be videos ({location}/{clip}.mp4, .avi, .mov or .mkv), or in_dir can be a single video file
+    - out_dir: output directory of where you want the background-subtracted frames to live (default: current_working_directory/frames/3-channel/ ).
+               For a single clip this can also be a .mp4 or .avi file to write
+    - chunk_size: (optional) number of frames to decode at a time. Bounds memory use for long clips; output is identical.
+    - workers: (optional) number of processes converting clips in parallel (default: 1)
+    - io_threads: (optional) decode and encode frames on background thread pools of this size (default: 0)
+    - format: (optional) jpg (default) for one JPEG per frame, or npy / jpack to pack each clip into a single
+              {clip}.npy or {clip}.jpack file, readable with convert.PackedClip, or mp4 / avi to encode each clip
+              as a (lossy) {clip}.mp4 or {clip}.avi video
+    - recipe: (optional, repeatable) output variants to produce from a single decode of every clip, each the name
+              of a preset (baseline++, baseline) or NAME=CHANNELS with three of raw, zero, bgsub[:K] (blurred with
+              a KxK kernel) and diff[N][:K] (difference to N frames later), e.g. nodiff=raw,bgsub,zero.
+              Default: baseline++. With several recipes each is written to out_dir/{name}/
+    - roi: (optional) auto, or a directory of {location}.png fan masks. Restricts the blur, mean, normalization and
+           frame differences to the active sonar fan of each clip; pixels outside it are written as constants.
+           Output is identical, clips with non-zero pixels outside their mask are converted on whole frames
+    - force: (optional) reconvert every clip. By default, clips already converted from the same input frames
+             with the same parameters are skipped, according to out_dir/manifest.jsonl
 
 
 Example command: 
 python convert.py --in_dir Elwha_2018_OM_ARIS_2018_07_19_2018-07-19_080000_14_214/ --out_dir elwha_bckground_sub
+python convert.py --in_dir frames/raw/ --out_dir frames/variants/ --recipe baseline++ --recipe baseline --recipe blur9=raw,bgsub:9,diff:9 --recipe diff3=raw,bgsub,diff3
+python convert.py --in_dir Elwha_2018_OM_ARIS_2018_07_19_2018-07-19_080000_14_214.mp4 --out_dir elwha_bckground_sub.mp4
 '''
 
 import argparse
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import functools
 import glob
+import hashlib
+from io import BytesIO
+import json
+import mmap
+import multiprocessing
 import os
+import signal
+import struct
+import sys
+import threading
+import time
 import numpy as np
 import cv2
 from PIL import Image
 from tqdm import tqdm
 
+BLUR_KSIZE = (5, 5)
+JPEG_QUALITY = 95
+
+# one JSON record per line, appended as clips start and finish; the last record for a clip wins
+MANIFEST_NAME = "manifest.jsonl"
+
+VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv']
+VIDEO_FOURCC = {'mp4': 'mp4v', 'avi': 'MJPG'}
+# used for video outputs when the input is not a video
+DEFAULT_VIDEO_FPS = 10
+
+OUTPUT_FORMATS = ['jpg', 'npy', 'jpack'] + list(VIDEO_FOURCC)
+JPACK_MAGIC = b'CFCJPACK'
+JPACK_FOOTER_SIZE = len(JPACK_MAGIC) + 8
+
+# Each output variant of a clip is a recipe of three channels, each one of
+#   raw          the raw frame
+#   zero         a constant 0 channel
+#   bgsub[:K]    the background-subtracted frame, blurred with a KxK Gaussian (default 5)
+#   diff[N][:K]  |bgsub[t + N] - bgsub[t]|, the difference to N frames later (default 1)
+# given as NAME=CHANNELS or the name of a preset
+RECIPE_PRESETS = OrderedDict([
+    ('baseline++', 'raw,bgsub,diff'),
+    ('baseline', 'raw,raw,raw'),
+])
+DEFAULT_RECIPE = 'baseline++'
+
+# ROI mode: rows per band of the active region, each processed on the span of columns it needs
+ROI_BAND_ROWS = 64
+# process whole frames instead if the bands would cover more than this fraction of them
+ROI_MAX_AREA = 0.9
+# when streaming, the mask is estimated from the first chunk and widened by this many
+# pixels, so JPEG ringing at the edge of the fan in later frames still falls inside it
+ROI_MASK_DILATION = 8
+
+# number of 3-channel frames built at once before they are written
+BUILD_BATCH_SIZE = 32
+
+# frames decoded at a time by the in-memory generator API
+DEFAULT_CHUNK_SIZE = 256
+
+# clip statistics kept for random access, least recently used first
+CLIP_STATISTICS_CACHE_SIZE = 32
+_clip_statistics_cache = OrderedDict()
 
 def get_frame_idx(path):
     return int(os.path.basename(path).replace(".jpg",""))
@@ -37,66 +114,1357 @@ def has_subdirectories(path):
             return True
     return False
 
-def background_subtract_frames(frames, seq_out_dir):    
-    frame_data = []
-    for frame in frames:
-        frame = cv2.imread(frame, cv2.IMREAD_GRAYSCALE)#[...,0] # grayscale; take just one channel
-        frame_data.append(frame)
-    frames = np.stack(frame_data)
-    
+def read_frame(frame):
+    return cv2.imread(frame, cv2.IMREAD_GRAYSCALE)#[...,0] # grayscale; take just one channel
+
+def read_frames(frames):
+    '''
+    Decode a list of frame paths (or VideoFrames) into a (T, H, W) uint8 array
+    '''
+    if isinstance(frames, VideoFrames):
+        return frames.read()
+    return np.stack([read_frame(frame) for frame in frames])
+
+def is_video(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+class VideoReader:
+    '''
+    Sequential grayscale decoding of a video file with cv2.VideoCapture.
+    Reading frames before the current position reopens the video, and reading
+    past it skips frames, so reads in order never seek.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Cannot open video {path}")
+        self.position = 0
+        self.num_frames = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or DEFAULT_VIDEO_FPS
+        self.shape = (int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)))
+
+    def read(self, start, stop):
+        if start >= stop:
+            return np.empty((0,) + self.shape, dtype=np.uint8)
+        with self.lock:
+            if start < self.position:
+                self.capture.release()
+                self.capture = cv2.VideoCapture(self.path)
+                self.position = 0
+            while self.position < start:
+                self.capture.grab()
+                self.position += 1
+            frames = []
+            for _ in range(start, stop):
+                ok, frame = self.capture.read()
+                if not ok:
+                    raise ValueError(f"{self.path} ended after {self.position} of {self.num_frames} frames")
+                self.position += 1
+                frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            return np.stack(frames)
+
+class VideoFrames:
+    '''
+    The frames [start, stop) of a video file. Stands in for the sorted list of
+    frame paths of a clip directory: it supports len() and slicing, and read()
+    decodes the frames into a (T, H, W) uint8 array.
+    '''
+    def __init__(self, path, start=0, stop=None, reader=None):
+        self.path = path
+        self.reader = reader or VideoReader(path)
+        self.fps = self.reader.fps
+        self.start = start
+        self.stop = self.reader.num_frames if stop is None else stop
+
+    def __len__(self):
+        return max(self.stop - self.start, 0)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            raise TypeError("VideoFrames only supports contiguous slices")
+        frame_range = range(self.start, self.stop)[index]
+        return VideoFrames(self.path, frame_range.start, frame_range.stop, self.reader)
+
+    def read(self):
+        return self.reader.read(self.start, self.stop)
+
+def get_input_files(frames):
+    '''
+    The files a clip is read from: its frames, or its video
+    '''
+    return [frames.path] if isinstance(frames, VideoFrames) else frames
+
+class FrameIO:
+    '''
+    Reads and writes the frames of a clip. With threads > 0, decoding and encoding
+    run on two thread pools (OpenCV and Pillow release the GIL) so they overlap
+    with the NumPy stage; at most max_pending encoded frames are queued.
+    Busy seconds of each stage are accumulated in self.times.
+    '''
+    def __init__(self, threads=0, max_pending=None):
+        self.threads = threads
+        self.decode_pool = ThreadPoolExecutor(threads) if threads else None
+        self.encode_pool = ThreadPoolExecutor(threads) if threads else None
+        # videos are decoded in order, on a single thread
+        self.video_pool = ThreadPoolExecutor(1) if threads else None
+        self.max_pending = max_pending or 4 * max(threads, 1)
+        self.pending = deque()
+        self.times = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def _add_time(self, stage, start):
+        with self.lock:
+            self.times[stage] += time.perf_counter() - start
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_time(stage, start)
+
+    def _read_frame(self, frame):
+        start = time.perf_counter()
+        try:
+            return read_frame(frame)
+        finally:
+            self._add_time('decode', start)
+
+    def _read_video(self, frames):
+        start = time.perf_counter()
+        try:
+            return frames.read()
+        finally:
+            self._add_time('decode', start)
+
+    def _write_frame(self, out_fp, frame_image):
+        start = time.perf_counter()
+        try:
+            Image.fromarray(frame_image).save(out_fp, quality=JPEG_QUALITY)
+        finally:
+            self._add_time('encode', start)
+
+    def _encode_frame(self, frame_image):
+        start = time.perf_counter()
+        try:
+            return encode_jpeg(frame_image)
+        finally:
+            self._add_time('encode', start)
+
+    def prefetch(self, frames):
+        '''
+        Start decoding frames. Returns a function which waits for them and returns
+        them stacked into a (T, H, W) array.
+        '''
+        if isinstance(frames, VideoFrames):
+            if self.video_pool is None:
+                return lambda: self._read_video(frames)
+            future = self.video_pool.submit(self._read_video, frames)
+            def result():
+                with self.timed('decode_wait'):
+                    return future.result()
+            return result
+
+        if self.decode_pool is None:
+            return lambda: np.stack([self._read_frame(frame) for frame in frames])
+        futures = [self.decode_pool.submit(self._read_frame, frame) for frame in frames]
+        def result():
+            with self.timed('decode_wait'):
+                return np.stack([future.result() for future in futures])
+        return result
+
+    def read_frames(self, frames):
+        return self.prefetch(frames)()
+
+    def iter_chunks(self, frames, chunk_size):
+        '''
+        Yields (start, decoded frames[start:start + chunk_size]), decoding the
+        next chunk while the caller works on the current one.
+        '''
+        next_chunk = self.prefetch(frames[:chunk_size])
+        for start in range(0, len(frames), chunk_size):
+            chunk = next_chunk
+            if start + chunk_size < len(frames):
+                next_chunk = self.prefetch(frames[start + chunk_size:start + 2 * chunk_size])
+            yield start, chunk()
+
+    def submit(self, fn, *args):
+        '''
+        Run fn(*args) on the encode pool, waiting first if max_pending tasks are
+        already queued. Returns a Future.
+        '''
+        if self.encode_pool is None:
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+        if len(self.pending) >= self.max_pending:
+            with self.timed('encode_wait'):
+                self.pending.popleft().result()
+        future = self.encode_pool.submit(fn, *args)
+        self.pending.append(future)
+        return future
+
+    def write(self, out_fp, frame_image):
+        self.submit(self._write_frame, out_fp, frame_image)
+
+    def encode(self, frame_image):
+        '''
+        JPEG-encode a frame. Returns a Future of the encoded bytes.
+        '''
+        return self.submit(self._encode_frame, frame_image)
+
+    def flush(self):
+        '''
+        Wait for all queued frames to be written, raising any error from the writers
+        '''
+        if not self.pending:
+            return
+        with self.timed('encode_wait'):
+            while self.pending:
+                self.pending.popleft().result()
+
+    def close(self):
+        self.flush()
+        for pool in (self.decode_pool, self.encode_pool, self.video_pool):
+            if pool is not None:
+                pool.shutdown()
+
+def encode_jpeg(frame_image):
+    buffer = BytesIO()
+    Image.fromarray(frame_image).save(buffer, format='JPEG', quality=JPEG_QUALITY)
+    return buffer.getvalue()
+
+def get_output_path(seq_out_dir, out_format):
+    '''
+    Where a clip converted to out_format is written: a directory of {i}.jpg
+    frames, or a single packed or video file next to where that directory would be.
+    '''
+    if out_format == 'jpg':
+        return seq_out_dir
+    return os.path.normpath(seq_out_dir) + '.' + out_format
+
+class JpegDirWriter:
+    '''
+    Writes each frame of a clip to {seq_out_dir}/{i}.jpg
+    '''
+    def __init__(self, seq_out_dir, io):
+        self.seq_out_dir = seq_out_dir
+        self.io = io
+        os.makedirs(seq_out_dir, exist_ok=True)
+
+    def write(self, start, frame_images):
+        for i, frame_image in enumerate(frame_images):
+            self.io.write(os.path.join(self.seq_out_dir, f'{start + i}.jpg'), frame_image)
+
+    def close(self):
+        self.io.flush()
+
+class NpyWriter:
+    '''
+    Writes a clip to a single uncompressed (T, H, W, 3) uint8 .npy file, which
+    can be memory-mapped for zero-copy frame access. The file is written under a
+    temporary name and only moved into place once complete. A clip without any
+    frames is written as a (0, 0, 0, 3) array.
+    '''
+    def __init__(self, path, num_frames):
+        self.path = path
+        self.num_frames = num_frames
+        self.array = None
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def write(self, start, frame_images):
+        if self.array is None:
+            self.array = np.lib.format.open_memmap(
+                self.path + '.tmp', mode='w+', dtype=np.uint8,
+                shape=(self.num_frames,) + frame_images.shape[1:]
+            )
+        self.array[start:start + len(frame_images)] = frame_images
+
+    def close(self):
+        if self.array is None:
+            with open(self.path + '.tmp', 'wb') as f:
+                np.save(f, np.empty((0, 0, 0, 3), dtype=np.uint8))
+        else:
+            self.array.flush()
+            del self.array
+        os.replace(self.path + '.tmp', self.path)
+
+class JpackWriter:
+    '''
+    Writes a clip to a single .jpack file: the JPEG-encoded frames back to back,
+    followed by an int64 index of T + 1 byte offsets and a footer of
+    JPACK_MAGIC and the index position. Frames are encoded on io's encode pool
+    and appended in order.
+    '''
+    def __init__(self, path, io):
+        self.path = path
+        self.io = io
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.f = open(path + '.tmp', 'wb')
+        self.offsets = [0]
+        self.pending = deque()
+
+    def _append_done(self, wait=False):
+        while self.pending and (wait or self.pending[0].done()):
+            encoded = self.pending.popleft().result()
+            self.f.write(encoded)
+            self.offsets.append(self.offsets[-1] + len(encoded))
+
+    def write(self, start, frame_images):
+        for frame_image in frame_images:
+            self.pending.append(self.io.encode(frame_image))
+        self._append_done()
+
+    def close(self):
+        self._append_done(wait=True)
+        index_offset = self.offsets[-1]
+        self.f.write(np.array(self.offsets, dtype=np.int64).tobytes())
+        self.f.write(JPACK_MAGIC + struct.pack('<q', index_offset))
+        self.f.close()
+        os.replace(self.path + '.tmp', self.path)
+
+class VideoWriter:
+    '''
+    Writes a clip as a video file (--format mp4 / avi), encoded in order with
+    cv2.VideoWriter. Unlike the other formats the encoding is lossy. A video cannot
+    hold zero frames, so nothing is written for a clip without any.
+    '''
+    def __init__(self, path, out_format, fps, io):
+        self.path = path
+        self.fourcc = cv2.VideoWriter_fourcc(*VIDEO_FOURCC[out_format])
+        self.fps = fps
+        self.io = io
+        self.writer = None
+        root, ext = os.path.splitext(path)
+        # keep the extension, which cv2 uses to pick the container
+        self.tmp_path = root + '.tmp' + ext
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def write(self, start, frame_images):
+        with self.io.timed('encode'):
+            if self.writer is None:
+                height, width = frame_images.shape[1:3]
+                self.writer = cv2.VideoWriter(self.tmp_path, self.fourcc, self.fps, (width, height))
+            for frame_image in frame_images:
+                self.writer.write(cv2.cvtColor(frame_image, cv2.COLOR_RGB2BGR))
+
+    def close(self):
+        if self.writer is None:
+            return
+        self.writer.release()
+        os.replace(self.tmp_path, self.path)
+
+def get_clip_writer(seq_out_dir, out_format, num_frames, io, fps=DEFAULT_VIDEO_FPS):
+    path = get_output_path(seq_out_dir, out_format)
+    if out_format == 'jpg':
+        return JpegDirWriter(path, io)
+    elif out_format in VIDEO_FOURCC:
+        return VideoWriter(path, out_format, fps, io)
+    elif out_format == 'npy':
+        return NpyWriter(path, num_frames)
+    elif out_format == 'jpack':
+        return JpackWriter(path, io)
+    raise ValueError(f"Unknown output format {out_format}")
+
+class PackedClip:
+    '''
+    Reads a clip written with --format npy or jpack. clip[i] is the (H, W, 3)
+    uint8 image of frame i, in the same channel order as the JPEG frames.
+
+    .npy files are memory-mapped, so clip[i] is a zero-copy view. For .jpack
+    files, clip.encoded(i) is a zero-copy view of the JPEG bytes of frame i,
+    and clip[i] decodes it. For .npy files, clip.encoded(i) encodes frame i the
+    way the JPEG frames are.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.is_npy = path.endswith('.npy')
+        if self.is_npy:
+            self.array = np.load(path, mmap_mode='r')
+            return
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        footer = self.buffer[-JPACK_FOOTER_SIZE:]
+        if footer[:len(JPACK_MAGIC)] != JPACK_MAGIC:
+            raise ValueError(f"{path} is not a .jpack file")
+        index_offset, = struct.unpack('<q', footer[len(JPACK_MAGIC):])
+        self.offsets = np.frombuffer(self.buffer, dtype=np.int64, offset=index_offset,
+                                     count=(len(self.buffer) - JPACK_FOOTER_SIZE - index_offset) // 8)
+
+    def __len__(self):
+        return len(self.array) if self.is_npy else len(self.offsets) - 1
+
+    def encoded(self, i):
+        if self.is_npy:
+            return memoryview(encode_jpeg(np.ascontiguousarray(self.array[i])))
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"frame {i} out of range for clip of {len(self)} frames")
+        return memoryview(self.buffer)[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i):
+        if self.is_npy:
+            return self.array[i]
+        frame_image = cv2.imdecode(np.frombuffer(self.encoded(i), dtype=np.uint8), cv2.IMREAD_COLOR)
+        return cv2.cvtColor(frame_image, cv2.COLOR_BGR2RGB)
+
+def parse_channel(spec):
+    '''
+    Parse one recipe channel: 'raw' -> ('raw',), 'bgsub:7' -> ('bgsub', (7, 7)),
+    'diff3' -> ('diff', (5, 5), 3)
+    '''
+    name, has_ksize, ksize = spec.strip().partition(':')
+    try:
+        ksize = (int(ksize), int(ksize)) if has_ksize else BLUR_KSIZE
+        step = int(name[4:] or 1) if name.startswith('diff') else None
+    except ValueError:
+        raise ValueError(f"Bad channel {spec!r}")
+    if ksize[0] < 1 or ksize[0] % 2 == 0:
+        raise ValueError(f"Blur kernel size must be odd and positive in {spec!r}")
+    if name in ('raw', 'zero') and not has_ksize:
+        return (name,)
+    elif name == 'bgsub':
+        return ('bgsub', ksize)
+    elif step is not None and step >= 1:
+        return ('diff', ksize, step)
+    raise ValueError(f"Unknown channel {spec!r}, expected raw, zero, bgsub[:K] or diff[N][:K]")
+
+def format_channel(channel):
+    if channel[0] == 'bgsub':
+        return f"bgsub:{channel[1][0]}"
+    elif channel[0] == 'diff':
+        return f"diff{channel[2]}:{channel[1][0]}"
+    return channel[0]
+
+def parse_recipes(specs=None):
+    '''
+    Parse recipes, each the name of a preset or NAME=CHANNELS (three comma-separated
+    channels), into an OrderedDict of { name -> channels }. By default only Baseline++.
+    '''
+    recipes = OrderedDict()
+    for spec in specs or [DEFAULT_RECIPE]:
+        name, _, channels = spec.partition('=')
+        if not channels:
+            if name not in RECIPE_PRESETS:
+                raise ValueError(f"Unknown recipe {name!r}, expected one of {', '.join(RECIPE_PRESETS)} or NAME=CHANNELS")
+            channels = RECIPE_PRESETS[name]
+        channels = tuple(parse_channel(channel) for channel in channels.split(','))
+        if len(channels) != 3:
+            raise ValueError(f"Recipe {spec!r} must have 3 channels")
+        if name in recipes:
+            raise ValueError(f"Recipe {name!r} given twice")
+        recipes[name] = channels
+    return recipes
+
+def get_recipe_ksizes(recipes):
+    '''
+    The blur kernel sizes a set of recipes needs. Each is blurred and normalized once per clip.
+    '''
+    return sorted({channel[1] for channels in recipes.values() for channel in channels if len(channel) > 1})
+
+def get_recipe_overlap(recipes):
+    '''
+    How many frames past a frame its recipe images need, i.e. the longest frame difference
+    '''
+    return max([channel[2] for channels in recipes.values() for channel in channels if channel[0] == 'diff'], default=1)
+
+def format_stage_times(times, wall_time, threads, processes=1):
+    '''
+    Summarize how busy each stage was, as a fraction of the wall time available to it.
+    times are summed over the clips of all processes, wall_time is the elapsed time.
+    '''
+    parts = []
+    for stage, workers in (('decode', threads or 1), ('compute', 1), ('encode', threads or 1)):
+        busy = times.get(stage, 0.0) / max(wall_time * workers * processes, 1e-9)
+        parts.append(f"{stage} {busy:.0%}" + (f" of {workers} threads" if workers > 1 else ""))
+    for stage in ('decode_wait', 'encode_wait'):
+        if stage in times:
+            parts.append(f"{stage.replace('_', ' ')} {times[stage]:.1f}s")
+    return "Stage busy: " + ", ".join(parts) + f" over {wall_time:.1f}s"
+
+def blur_frames(frames, ksize=BLUR_KSIZE):
+    '''
+    Returns a float32 copy of frames with each frame Gaussian blurred
+    '''
     blurred_frames = frames.astype(np.float32)
     for i in range(frames.shape[0]):
         blurred_frames[i] = cv2.GaussianBlur(
             blurred_frames[i],
-            (5,5),
+            ksize,
             0
         )
-    mean_blurred_frame = blurred_frames.mean(axis=0)
-    blurred_frames -= mean_blurred_frame
-    mean_normalization_value = np.max(np.abs(blurred_frames))
+    return blurred_frames
+
+def scale_blurred_frames(blurred_frames, mean_normalization_value):
+    '''
+    Rescale mean-subtracted blurred frames to [0, 1], in place
+    '''
     blurred_frames /= mean_normalization_value
     blurred_frames += 1
     blurred_frames /= 2
+    return blurred_frames
+
+def build_3channel_frames(frames, blurred_frames, out=None, scratch=None):
+    '''
+    Build the 3-channel images for frames[:-1] into out, a (T-1, H, W, 3) uint8
+    array, without per-frame temporaries. scratch is an optional (T-1, H, W)
+    float32 buffer for the frame difference.
+
+    Matches the float pipeline (x / 255 -> float32 -> * 255 -> uint8) exactly:
+    the raw channel round-trips unchanged for every uint8 value, and the other
+    two channels are computed in float32 and truncated to uint8 the same way.
+    '''
+    n = len(frames) - 1
+    if out is None:
+        out = np.empty((n,) + frames.shape[1:] + (3,), dtype=np.uint8)
+    if scratch is None:
+        scratch = np.empty((n,) + frames.shape[1:], dtype=np.float32)
 
-    # Because of the frame difference channel, we only go to end_frame - 1
-    for i, frame_offset in enumerate(range(len(frames) - 1)):
-        frame_image = np.dstack([
-                    frames[i] / 255,
-                    blurred_frames[i],
-                    np.abs(blurred_frames[i+1] - blurred_frames[i])
-                    ]).astype(np.float32)
-        frame_image = (frame_image * 255).astype(np.uint8)
-        out_fp = os.path.join(seq_out_dir, f'{i}.jpg')
-        Image.fromarray(frame_image).save(out_fp, quality=95)
-
-def convert(in_dir, out_dir):
-    if ( has_subdirectories ( in_dir ) ):
-        for location in os.listdir(in_dir):
-            loc_dir = os.path.join(in_dir, location)
-            if location.startswith(".") or not os.path.isdir(loc_dir): continue
-            print("Converting frames for", location)
-            
-            for seq in tqdm(os.listdir(loc_dir)):
-                seq_dir = os.path.join(loc_dir, seq)
-                if seq.startswith(".") or not os.path.isdir(seq_dir): continue
-                frames = sorted(glob.glob(seq_dir + "/*.jpg"), key=get_frame_idx)
-    
-                seq_out_dir = os.path.join(out_dir, location, seq)
-                os.makedirs(seq_out_dir, exist_ok=True)
-
-                background_subtract_frames (frames, seq_out_dir)
+    np.copyto(out[..., 0], frames[:n])
+    np.multiply(blurred_frames[:n], 255, out=out[..., 1], casting='unsafe', dtype=np.float32)
+    np.subtract(blurred_frames[1:n+1], blurred_frames[:n], out=scratch)
+    np.abs(scratch, out=scratch)
+    np.multiply(scratch, 255, out=out[..., 2], casting='unsafe', dtype=np.float32)
+    return out
+
+def iter_3channel_batches(frames, blurred_frames, io, batch_size=BUILD_BATCH_SIZE):
+    '''
+    Yields (offset, frame_images) for the 3-channel images of frames[:-1], built
+    batch_size at a time. Every batch is a fresh array, so images handed off to
+    other threads stay valid.
+    '''
+    scratch = None
+    for batch_start in range(0, len(frames) - 1, batch_size):
+        batch_end = min(batch_start + batch_size, len(frames) - 1)
+        with io.timed('compute'):
+            if scratch is None or len(scratch) != batch_end - batch_start:
+                scratch = np.empty((batch_end - batch_start,) + frames.shape[1:], dtype=np.float32)
+            frame_images = build_3channel_frames(
+                frames[batch_start:batch_end + 1],
+                blurred_frames[batch_start:batch_end + 1],
+                scratch=scratch
+            )
+        yield batch_start, frame_images
+
+def build_recipe_frames(frames, blurred_frames, recipes, scratch=None, out=None):
+    '''
+    Build the images of every recipe for frames, into fresh (T, H, W, 3) uint8 arrays
+    or the arrays in out.
+    blurred_frames is { ksize -> normalized blurred frames }, which must extend
+    get_recipe_overlap(recipes) frames past frames for the frame differences.
+    Each distinct channel is computed once and copied into the other recipes using it,
+    with the same float32 math as build_3channel_frames.
+    Returns { name -> images }.
+    '''
+    n = len(frames)
+    if scratch is None:
+        scratch = np.empty(frames.shape, dtype=np.float32)
+    if out is None:
+        out = OrderedDict((name, np.empty(frames.shape + (3,), dtype=np.uint8)) for name in recipes)
+    frame_images = out
+    computed = {}
+    for name, channels in recipes.items():
+        for c, channel in enumerate(channels):
+            channel_out = frame_images[name][..., c]
+            if channel in computed:
+                np.copyto(channel_out, computed[channel])
+                continue
+            computed[channel] = channel_out
+
+            if channel[0] == 'raw':
+                np.copyto(channel_out, frames)
+            elif channel[0] == 'zero':
+                channel_out.fill(0)
+            elif channel[0] == 'bgsub':
+                np.multiply(blurred_frames[channel[1]][:n], 255, out=channel_out, casting='unsafe', dtype=np.float32)
+            else:
+                _, ksize, step = channel
+                np.subtract(blurred_frames[ksize][step:n+step], blurred_frames[ksize][:n], out=scratch)
+                np.abs(scratch, out=scratch)
+                np.multiply(scratch, 255, out=channel_out, casting='unsafe', dtype=np.float32)
+    return frame_images
+
+class RoiMaskError(Exception):
+    '''
+    Raised when a clip has non-zero pixels outside its ROI mask
+    '''
+    pass
+
+class RoiLayout:
+    '''
+    Where in a clip's frames the Baseline++ math has to be done. ARIS frames are
+    a fan-shaped beam inside a rectangular image, and pixels outside the fan are
+    0 in every frame. Blurring, mean subtraction, normalization and differencing
+    leave those pixels at constants (see get_outside_values), except within the
+    blur radius of the fan.
+
+    The active region is split into bands of ROI_BAND_ROWS rows. Each band covers
+    the columns within margin (the blur radius) of active pixels in or near it,
+    and is blurred on a crop extending margin pixels further, so the values
+    inside it are exactly those of blurring the whole frame. Without a mask the
+    layout is a single band covering the whole frame.
+    '''
+    def __init__(self, shape, mask=None, margin=0):
+        self.shape = tuple(shape)
+        self.mask = mask
+        height, width = self.shape
+        if mask is None:
+            self.bands = [(slice(0, height), slice(0, width), slice(0, height), slice(0, width))]
+            return
+
+        self.bands = []
+        active_rows = np.flatnonzero(mask.any(axis=1))
+        if not len(active_rows):
+            return
+        first_row = max(active_rows[0] - margin, 0)
+        last_row = min(active_rows[-1] + margin + 1, height)
+        for top in range(first_row, last_row, ROI_BAND_ROWS):
+            bottom = min(top + ROI_BAND_ROWS, last_row)
+            active_cols = np.flatnonzero(mask[max(top - margin, 0):bottom + margin].any(axis=0))
+            if not len(active_cols):
+                continue
+            left = max(active_cols[0] - margin, 0)
+            right = min(active_cols[-1] + margin + 1, width)
+            self.bands.append((
+                slice(top, bottom), slice(left, right),
+                slice(max(top - margin, 0), min(bottom + margin, height)),
+                slice(max(left - margin, 0), min(right + margin, width)),
+            ))
+
+    @property
+    def is_full(self):
+        return self.mask is None
+
+    @property
+    def area(self):
+        '''
+        Fraction of the frame covered by the bands, including their crops
+        '''
+        crop_area = sum((crop_rows.stop - crop_rows.start) * (crop_cols.stop - crop_cols.start)
+                        for _, _, crop_rows, crop_cols in self.bands)
+        return crop_area / (self.shape[0] * self.shape[1])
+
+    def check(self, frames):
+        '''
+        Raise RoiMaskError unless every pixel outside the mask is 0 in every frame
+        '''
+        if self.mask is not None and np.any(frames.max(axis=0)[~self.mask]):
+            raise RoiMaskError("Clip has non-zero pixels outside its ROI mask")
+
+    def blur(self, frames, ksize):
+        '''
+        Blurred frames of every band, [(T, band height, band width) float32]
+        '''
+        blurred_bands = []
+        for rows, cols, crop_rows, crop_cols in self.bands:
+            blurred = blur_frames(frames[:, crop_rows, crop_cols], ksize)
+            blurred = blurred[:, rows.start - crop_rows.start:rows.stop - crop_rows.start,
+                              cols.start - crop_cols.start:cols.stop - crop_cols.start]
+            blurred_bands.append(np.ascontiguousarray(blurred))
+        return blurred_bands
+
+def derive_roi_mask(frames, dilation=0):
+    '''
+    (H, W) bool mask of the pixels which are non-zero in any of frames, or
+    within dilation pixels of one
+    '''
+    mask = frames.max(axis=0) > 0
+    if dilation:
+        kernel = np.ones((2 * dilation + 1, 2 * dilation + 1), dtype=np.uint8)
+        mask = cv2.dilate(mask.astype(np.uint8), kernel) > 0
+    return mask
+
+def load_roi_mask(path):
+    '''
+    A mask image, e.g. one per location, non-zero inside the fan
+    '''
+    mask = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if mask is None:
+        raise ValueError(f"Cannot read ROI mask {path}")
+    return mask > 0
+
+def get_roi_layout(mask, recipes):
+    '''
+    The RoiLayout of a mask for recipes, or the whole frame if the active region
+    is too large for the bands to save time
+    '''
+    margin = max([ksize[0] // 2 for ksize in get_recipe_ksizes(recipes)], default=0)
+    layout = RoiLayout(mask.shape, mask, margin)
+    if layout.area > ROI_MAX_AREA:
+        return RoiLayout(mask.shape)
+    return layout
+
+def get_outside_values(recipes, normalization_values):
+    '''
+    { name -> the 3 uint8 channel values of the recipe for pixels outside the
+    ROI }, where every frame is 0 and so are the blurred frames minus their mean
+    '''
+    outside_values = {}
+    for name, channels in recipes.items():
+        values = np.zeros(3, dtype=np.uint8)
+        for c, channel in enumerate(channels):
+            if channel[0] == 'bgsub':
+                scaled = scale_blurred_frames(np.zeros(1, dtype=np.float32), normalization_values[channel[1]])
+                np.multiply(scaled, 255, out=values[c:c+1], casting='unsafe', dtype=np.float32)
+        outside_values[name] = values
+    return outside_values
+
+def iter_recipe_batches(frames, blurred_frames, recipes, num_outputs, io, layout=None, outside_values=None,
+                        batch_size=BUILD_BATCH_SIZE):
+    '''
+    Yields (offset, { name -> frame_images }) for the recipe images of frames[:num_outputs],
+    built batch_size at a time. blurred_frames is { ksize -> [blurred frames of every band
+    of layout] }. Frame differences which would reach past the last frame are taken to the
+    last frame instead, so every recipe has the same frames.
+
+    With a ROI layout, pixels outside its bands are filled with outside_values.
+    '''
+    layout = layout or RoiLayout(frames.shape[1:])
+    overlap = get_recipe_overlap(recipes)
+    outside_frames = None
+    for batch_start in range(0, num_outputs, batch_size):
+        batch_end = min(batch_start + batch_size, num_outputs)
+        with io.timed('compute'):
+            if not layout.is_full:
+                if outside_frames is None:
+                    # whole frames copy much faster than broadcasting 3 values
+                    outside_frames = {name: np.empty(frames.shape[1:] + (3,), dtype=np.uint8) for name in recipes}
+                    for name in recipes:
+                        outside_frames[name][...] = outside_values[name]
+                frame_images = OrderedDict()
+                for name in recipes:
+                    frame_images[name] = np.empty((batch_end - batch_start,) + frames.shape[1:] + (3,), dtype=np.uint8)
+                    frame_images[name][...] = outside_frames[name]
+            for i, (rows, cols, _, _) in enumerate(layout.bands):
+                batch_blurred = {}
+                for ksize, blurred_bands in blurred_frames.items():
+                    blurred = blurred_bands[i][batch_start:batch_end + overlap]
+                    missing = batch_end + overlap - batch_start - len(blurred)
+                    if missing > 0:
+                        blurred = np.concatenate([blurred, np.repeat(blurred[-1:], missing, axis=0)])
+                    batch_blurred[ksize] = blurred
+                if layout.is_full:
+                    frame_images = build_recipe_frames(frames[batch_start:batch_end], batch_blurred, recipes)
+                else:
+                    band_images = OrderedDict((name, frame_images[name][:, rows, cols]) for name in recipes)
+                    build_recipe_frames(frames[batch_start:batch_end, rows, cols], batch_blurred, recipes, out=band_images)
+        yield batch_start, frame_images
+
+def write_recipe_frames(frames, blurred_frames, recipes, num_outputs, writers, io, start=0, layout=None, outside_values=None):
+    '''
+    Write frames [start, start + num_outputs) of every recipe of a clip to its writer
+    '''
+    for batch_start, frame_images in iter_recipe_batches(
+            frames, blurred_frames, recipes, num_outputs, io, layout, outside_values):
+        for name, writer in writers.items():
+            writer.write(start + batch_start, frame_images[name])
+
+def clip_statistics(frames, chunk_size, io, ksizes=(BLUR_KSIZE,), layout=None):
+    '''
+    First pass of the streaming conversion: { ksize -> (mean_blurred_frames,
+    mean_normalization_value) } of a clip blurred with each kernel size,
+    decoding chunk_size frames at a time. mean_blurred_frames has the mean
+    of every band of layout (by default, the whole frame).
+
+    Blurred frames are summed one at a time in float32, which is the same
+    accumulation order np.mean uses over axis 0, so the mean is bit-identical.
+    Rounding is monotonic, so max |b - mean| over all frames is reached at the
+    per-pixel min or max of b and only those two frames need to be kept.
+    '''
+    totals, min_blurred, max_blurred = {}, {}, {}
+    for _, frames_chunk in io.iter_chunks(frames, chunk_size):
+        with io.timed('compute'):
+            if layout is None:
+                layout = RoiLayout(frames_chunk.shape[1:])
+            layout.check(frames_chunk)
+            for ksize in ksizes:
+                for i, blurred_frames in enumerate(layout.blur(frames_chunk, ksize)):
+                    key = ksize, i
+                    if key not in totals:
+                        totals[key] = np.zeros(blurred_frames.shape[1:], dtype=np.float32)
+                        min_blurred[key] = blurred_frames[0].copy()
+                        max_blurred[key] = blurred_frames[0].copy()
+                    for blurred_frame in blurred_frames:
+                        totals[key] += blurred_frame
+                    np.minimum(min_blurred[key], blurred_frames.min(axis=0), out=min_blurred[key])
+                    np.maximum(max_blurred[key], blurred_frames.max(axis=0), out=max_blurred[key])
+
+    statistics = {}
+    for ksize in ksizes:
+        mean_blurred_frames = []
+        mean_normalization_value = np.float32(0)
+        for i in range(len(layout.bands)):
+            mean_blurred_frame = totals[ksize, i] / len(frames)
+            mean_blurred_frames.append(mean_blurred_frame)
+            mean_normalization_value = max(
+                mean_normalization_value,
+                np.max(np.abs(max_blurred[ksize, i] - mean_blurred_frame)),
+                np.max(np.abs(min_blurred[ksize, i] - mean_blurred_frame))
+            )
+        statistics[ksize] = mean_blurred_frames, mean_normalization_value
+    return statistics
+
+def iter_normalized_chunks(frames, statistics, chunk_size, io, overlap=1, layout=None):
+    '''
+    Second pass of the streaming conversion. Yields (start, frames_chunk, blurred_chunks,
+    num_outputs), with the frames blurred with every kernel size in statistics and
+    normalized to [0, 1] ({ ksize -> [blurred_chunk of every band of layout] }). Chunks
+    overlap by overlap frames, so the images of frames_chunk[:num_outputs] can be built
+    from each chunk.
+    '''
+    # The overlapping frames are carried over rather than decoded twice
+    prev_frames = prev_blurred = None
+    for start, frames_chunk in io.iter_chunks(frames, chunk_size):
+        is_last = start + len(frames_chunk) == len(frames)
+        with io.timed('compute'):
+            if layout is None:
+                layout = RoiLayout(frames_chunk.shape[1:])
+            blurred_chunks = {}
+            for ksize, (mean_blurred_frames, mean_normalization_value) in statistics.items():
+                blurred_bands = layout.blur(frames_chunk, ksize)
+                for i, blurred_chunk in enumerate(blurred_bands):
+                    blurred_chunk -= mean_blurred_frames[i]
+                    scale_blurred_frames(blurred_chunk, mean_normalization_value)
+                    if prev_frames is not None:
+                        blurred_bands[i] = np.concatenate([prev_blurred[ksize][i], blurred_chunk])
+                blurred_chunks[ksize] = blurred_bands
+
+            first = start
+            if prev_frames is not None:
+                frames_chunk = np.concatenate([prev_frames, frames_chunk])
+                first -= len(prev_frames)
+        num_outputs = len(frames_chunk) - (1 if is_last else overlap)
+        if num_outputs > 0:
+            yield first, frames_chunk, blurred_chunks, num_outputs
+        carried = max(num_outputs, 0)
+        prev_frames = frames_chunk[carried:]
+        prev_blurred = {ksize: [blurred_chunk[carried:] for blurred_chunk in blurred_bands]
+                        for ksize, blurred_bands in blurred_chunks.items()}
+
+def background_subtract_frames_streaming(frames, recipes, writers, chunk_size, io, layout=None):
+    '''
+    Two-pass version of preprocess_frames which holds at most chunk_size plus
+    get_recipe_overlap(recipes) frames in memory, plus one prefetched chunk when
+    io is threaded. Output is byte-identical.
+    '''
+    ksizes = get_recipe_ksizes(recipes)
+    if ksizes:
+        statistics = clip_statistics(frames, chunk_size, io, ksizes, layout)
     else:
-        frames = sorted(glob.glob(in_dir + "/*.jpg"), key=get_frame_idx)
-        os.makedirs(out_dir, exist_ok=True)
-        background_subtract_frames (frames, out_dir)
+        statistics = {}
+        if layout is not None:
+            for _, frames_chunk in io.iter_chunks(frames, chunk_size):
+                layout.check(frames_chunk)
+    outside_values = get_outside_values(recipes, {ksize: norm for ksize, (_, norm) in statistics.items()})
+    for start, frames_chunk, blurred_chunks, num_outputs in iter_normalized_chunks(
+            frames, statistics, chunk_size, io, get_recipe_overlap(recipes), layout):
+        write_recipe_frames(frames_chunk, blurred_chunks, recipes, num_outputs, writers, io, start,
+                            layout, outside_values)
+
+def preprocess_frames(frames, seq_out_dirs, recipes, chunk_size=None, io=None, out_format='jpg', roi=None):
+    '''
+    Convert a clip to every recipe in recipes (see parse_recipes), writing each to
+    seq_out_dirs[name] (see get_output_path). The clip is decoded once, and blurred
+    and normalized once per blur kernel size, however many recipes use it.
+    If chunk_size is given, the clip is streamed in two passes instead of being
+    decoded into memory at once.
+    Frames are read and written through io (a FrameIO), by default on this thread.
+
+    With roi, the math is restricted to the sonar fan (see RoiLayout): roi is
+    'auto' to use the pixels which are non-zero in any frame (with chunk_size,
+    of the first chunk), or an (H, W) bool mask. Output is byte-identical; a clip
+    with non-zero pixels outside the mask is converted on whole frames instead.
+    '''
+    owns_io = io is None
+    if owns_io:
+        io = FrameIO()
+    try:
+        fps = getattr(frames, 'fps', DEFAULT_VIDEO_FPS)
+        writers = OrderedDict(
+            (name, get_clip_writer(seq_out_dirs[name], out_format, max(len(frames) - 1, 0), io, fps)) for name in recipes)
+        if len(frames) < 2:
+            # no outputs: only write the empty clips
+            pass
+        elif chunk_size:
+            layout = None
+            if roi is not None:
+                if isinstance(roi, str):
+                    mask = derive_roi_mask(io.read_frames(frames[:chunk_size]), ROI_MASK_DILATION)
+                else:
+                    mask = roi
+                layout = get_roi_layout(mask, recipes)
+            try:
+                background_subtract_frames_streaming(frames, recipes, writers, chunk_size, io, layout)
+            except RoiMaskError:
+                # raised during the first pass, before anything is written
+                background_subtract_frames_streaming(frames, recipes, writers, chunk_size, io)
+        else:
+            frames = io.read_frames(frames)
+            layout = RoiLayout(frames.shape[1:])
+            if roi is not None:
+                roi_layout = get_roi_layout(derive_roi_mask(frames) if isinstance(roi, str) else roi, recipes)
+                try:
+                    roi_layout.check(frames)
+                    layout = roi_layout
+                except RoiMaskError:
+                    pass
+
+            blurred_frames = {}
+            normalization_values = {}
+            with io.timed('compute'):
+                for ksize in get_recipe_ksizes(recipes):
+                    blurred_bands = layout.blur(frames, ksize)
+                    for blurred in blurred_bands:
+                        mean_blurred_frame = blurred.mean(axis=0)
+                        blurred -= mean_blurred_frame
+                    mean_normalization_value = max([np.max(np.abs(blurred)) for blurred in blurred_bands], default=np.float32(0))
+                    for blurred in blurred_bands:
+                        scale_blurred_frames(blurred, mean_normalization_value)
+                    blurred_frames[ksize] = blurred_bands
+                    normalization_values[ksize] = mean_normalization_value
+                outside_values = get_outside_values(recipes, normalization_values)
+
+            # Because of the frame difference channel, we only go to end_frame - 1
+            write_recipe_frames(frames, blurred_frames, recipes, len(frames) - 1, writers, io,
+                                layout=layout, outside_values=outside_values)
+        for writer in writers.values():
+            writer.close()
+        io.flush()
+    finally:
+        if owns_io:
+            io.close()
+
+def background_subtract_frames(frames, seq_out_dir, chunk_size=None, io=None, out_format='jpg', roi=None):
+    '''
+    Convert a clip to Baseline++ frames in seq_out_dir, or a single packed file
+    next to it (see get_output_path). If chunk_size is given, the clip is streamed
+    in two passes instead of being decoded into memory at once.
+    '''
+    recipes = parse_recipes()
+    preprocess_frames(frames, {DEFAULT_RECIPE: seq_out_dir}, recipes, chunk_size, io, out_format, roi)
+
+def get_clip_statistics(frames, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    (mean_blurred_frame, mean_normalization_value) of a clip, cached in memory for
+    the most recently used clips. Frames modified since are recomputed.
+    '''
+    key = tuple((f, os.stat(f).st_mtime_ns) for f in get_input_files(frames)) + (len(frames),)
+    if key in _clip_statistics_cache:
+        _clip_statistics_cache.move_to_end(key)
+        return _clip_statistics_cache[key]
+
+    mean_blurred_frames, mean_normalization_value = clip_statistics(frames, chunk_size, FrameIO())[BLUR_KSIZE]
+    stats = mean_blurred_frames[0], mean_normalization_value
+    _clip_statistics_cache[key] = stats
+    if len(_clip_statistics_cache) > CLIP_STATISTICS_CACHE_SIZE:
+        _clip_statistics_cache.popitem(last=False)
+    return stats
+
+def iter_baseline_pp(clip_dir, chunk=DEFAULT_CHUNK_SIZE):
+    '''
+    Yields the (H, W, 3) uint8 Baseline++ image of every frame of a clip directory
+    (except the last), without writing anything to disk. Uses the same math as
+    background_subtract_frames, so images are identical to what convert.py encodes.
+    At most chunk + 1 raw frames are held in memory.
+    '''
+    frames = get_frames(clip_dir)
+    io = FrameIO()
+    mean_blurred_frame, mean_normalization_value = get_clip_statistics(frames, chunk)
+    statistics = {BLUR_KSIZE: ([mean_blurred_frame], mean_normalization_value)}
+    for _, frames_chunk, blurred_chunks, _ in iter_normalized_chunks(frames, statistics, chunk, io):
+        for _, frame_images in iter_3channel_batches(frames_chunk, blurred_chunks[BLUR_KSIZE][0], io):
+            yield from frame_images
+
+class BaselinePPClip:
+    '''
+    Random access to the Baseline++ images of a clip directory, e.g. for a
+    dataloader. clip[i] decodes only frames i and i + 1; the clip statistics are
+    looked up once, on first access (see get_clip_statistics), and kept with the
+    clip, so frames modified after that are not noticed.
+    '''
+    def __init__(self, clip_dir, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.clip_dir = clip_dir
+        self.frames = get_frames(clip_dir)
+        self.chunk_size = chunk_size
+        self.statistics = None
+
+    def __len__(self):
+        return max(len(self.frames) - 1, 0)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"frame {i} out of range for clip of {len(self)} frames")
+        if self.statistics is None:
+            self.statistics = get_clip_statistics(self.frames, self.chunk_size)
+        mean_blurred_frame, mean_normalization_value = self.statistics
+        frames = read_frames(self.frames[i:i + 2])
+        blurred_frames = blur_frames(frames)
+        blurred_frames -= mean_blurred_frame
+        scale_blurred_frames(blurred_frames, mean_normalization_value)
+        return build_3channel_frames(frames, blurred_frames)[0]
+
+    def __iter__(self):
+        return iter_baseline_pp(self.clip_dir, self.chunk_size)
+
+class OnlineBackgroundSubtractor:
+    '''
+    Incremental Baseline++ for live sonar feeds, where the whole clip's mean and
+    max-abs normalizer are not available. The background is a running estimate
+    of the mean blurred frame, either exponential (alpha) or over the last
+    `window` frames, and the normalizer is the running max of |blurred - background|,
+    decayed by norm_decay every frame (1.0 keeps the running max).
+
+    Frames are pushed one at a time. Because of the frame difference channel,
+    the 3-channel image for a frame is returned by the push of the next one.
+
+    Usage:
+        subtractor = OnlineBackgroundSubtractor()
+        for frame in feed:
+            frame_image = subtractor.push(frame)
+            if frame_image is not None:
+                ...
+    '''
+    def __init__(self, alpha=0.01, window=None, norm_decay=1.0):
+        self.alpha = alpha
+        self.window = window
+        self.norm_decay = norm_decay
+        self.reset()
+
+    def reset(self):
+        self.num_frames = 0
+        self.background = None
+        self.normalization_value = 0.0
+        self.prev_frame = None
+        self.prev_scaled = None
+        self._window_frames = deque()
+        self._window_sum = None
+
+    def _update_background(self, blurred_frame):
+        if self.window:
+            self._window_frames.append(blurred_frame.copy())
+            if self._window_sum is None:
+                self._window_sum = np.zeros(blurred_frame.shape, dtype=np.float64)
+            self._window_sum += blurred_frame
+            if len(self._window_frames) > self.window:
+                self._window_sum -= self._window_frames.popleft()
+            self.background = (self._window_sum / len(self._window_frames)).astype(np.float32)
+        elif self.background is None:
+            self.background = blurred_frame.copy()
+        else:
+            self.background += self.alpha * (blurred_frame - self.background)
+
+    def push(self, frame):
+        '''
+        Add a (H, W) uint8 grayscale frame. Returns the (H, W, 3) uint8 image of
+        the previous frame, or None for the first frame.
+        '''
+        blurred_frame = blur_frames(frame[np.newaxis])[0]
+        self._update_background(blurred_frame)
+        self.num_frames += 1
+
+        blurred_frame -= self.background
+        self.normalization_value = max(
+            self.normalization_value * self.norm_decay,
+            float(np.max(np.abs(blurred_frame)))
+        )
+        if self.normalization_value > 0:
+            scale_blurred_frames(blurred_frame, np.float32(self.normalization_value))
+        else:
+            blurred_frame[:] = 0.5
+
+        frame_image = None
+        if self.prev_frame is not None:
+            frame_image = build_3channel_frames(
+                np.stack([self.prev_frame, frame]),
+                np.stack([self.prev_scaled, blurred_frame])
+            )[0]
+        self.prev_frame, self.prev_scaled = frame.copy(), blurred_frame
+        return frame_image
+
+def get_clips(in_dir, out_dir):
+    '''
+    List (seq_dir, seq_out_dir) pairs for every clip to convert. in_dir is either
+    a single clip (a directory of frames or a video), or a tree of {location}/{clip}
+    directories of frames or {location}/{clip}.mp4 (.avi, ...) videos.
+    '''
+    if os.path.isfile(in_dir) or not has_subdirectories(in_dir):
+        return [(in_dir, out_dir)]
+
+    clips = []
+    for location in sorted(os.listdir(in_dir)):
+        loc_dir = os.path.join(in_dir, location)
+        if location.startswith(".") or not os.path.isdir(loc_dir): continue
+        for seq in sorted(os.listdir(loc_dir)):
+            seq_dir = os.path.join(loc_dir, seq)
+            if seq.startswith("."): continue
+            if os.path.isdir(seq_dir):
+                clips.append((seq_dir, os.path.join(out_dir, location, seq)))
+            elif is_video(seq_dir):
+                clips.append((seq_dir, os.path.join(out_dir, location, os.path.splitext(seq)[0])))
+    return clips
+
+def get_frames(seq_dir):
+    if is_video(seq_dir):
+        return VideoFrames(seq_dir)
+    return sorted(glob.glob(seq_dir + "/*.jpg"), key=get_frame_idx)
+
+def get_conversion_params(out_format='jpg', recipes=None):
+    '''
+    Everything that changes the converted output. Clips converted with
+    different parameters are redone.
+    '''
+    params = {'blur_ksize': list(BLUR_KSIZE), 'jpeg_quality': JPEG_QUALITY, 'format': out_format}
+    # only recorded for other recipes, so manifests of Baseline++ conversions stay valid
+    if recipes is not None and list(recipes.values()) != list(parse_recipes().values()):
+        params['recipes'] = {name: ','.join(format_channel(c) for c in channels) for name, channels in recipes.items()}
+    return params
+
+def get_recipe_out_dirs(seq_out_dir, out_dir, recipes):
+    '''
+    { name -> where that recipe of a clip is written }. A single recipe is written
+    to out_dir itself, several each to their own tree, out_dir/{name}/...
+    '''
+    if len(recipes) == 1:
+        return OrderedDict((name, seq_out_dir) for name in recipes)
+    clip = os.path.relpath(seq_out_dir, out_dir)
+    return OrderedDict((name, os.path.join(out_dir, name, clip)) for name in recipes)
+
+def file_sha1(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def get_frame_listing(frames):
+    '''
+    [name, size, mtime_ns, sha1] for every input file (frame or video) of a clip
+    '''
+    listing = []
+    for frame in get_input_files(frames):
+        st = os.stat(frame)
+        listing.append([os.path.basename(frame), st.st_size, st.st_mtime_ns, file_sha1(frame)])
+    return listing
+
+def load_manifest(out_dir):
+    '''
+    Returns { clip -> latest manifest record } for an output tree. A truncated
+    last line (e.g. after a crash) is ignored.
+    '''
+    manifest = {}
+    manifest_fp = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_fp):
+        return manifest
+    with open(manifest_fp, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            manifest[record['clip']] = record
+    return manifest
+
+def write_manifest(out_dir, manifest):
+    '''
+    Rewrite the manifest with only the latest record per clip
+    '''
+    manifest_fp = os.path.join(out_dir, MANIFEST_NAME)
+    with open(manifest_fp + ".tmp", "w") as f:
+        for record in manifest.values():
+            f.write(json.dumps(record) + "\n")
+    os.replace(manifest_fp + ".tmp", manifest_fp)
+
+def is_output_complete(out_path, out_format, num_outputs):
+    if out_format in VIDEO_FOURCC:
+        # no video is written for a clip without outputs (see VideoWriter)
+        return num_outputs == 0 or (os.path.isfile(out_path) and len(VideoFrames(out_path)) == num_outputs)
+    if out_format != 'jpg':
+        return os.path.isfile(out_path) and len(PackedClip(out_path)) == num_outputs
+    if not os.path.isdir(out_path):
+        return False
+    outputs = set(os.listdir(out_path))
+    return all(f'{i}.jpg' in outputs for i in range(num_outputs))
+
+def is_clip_current(record, frames, seq_out_dirs, params):
+    '''
+    True if a clip was fully converted, to every directory in seq_out_dirs, from the
+    same input frames with the same parameters. Frames whose size or mtime changed
+    are compared by content hash.
+    '''
+    if record is None or record['status'] != 'done' or record['params'] != params:
+        return False
+    input_files = get_input_files(frames)
+    if len(record['frames']) != len(input_files):
+        return False
+    for (name, size, mtime_ns, sha1), frame in zip(record['frames'], input_files):
+        if os.path.basename(frame) != name:
+            return False
+        st = os.stat(frame)
+        if (st.st_size, st.st_mtime_ns) != (size, mtime_ns) and file_sha1(frame) != sha1:
+            return False
+
+    # catch outputs deleted after the clip was converted
+    return all(is_output_complete(get_output_path(seq_out_dir, params['format']), params['format'], record['outputs'])
+               for seq_out_dir in seq_out_dirs)
+
+def get_disk_usage(path):
+    if not os.path.exists(path):
+        return 0
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+def convert_clip(seq_dir, seq_out_dirs, recipes, chunk_size=None, io=None, out_format='jpg', roi=None):
+    '''
+    Convert one clip to every recipe, and return its manifest record. roi is None,
+    'auto' or the path of a mask image (see preprocess_frames).
+    '''
+    frames = get_frames(seq_dir)
+    if roi is not None and roi != 'auto':
+        roi = load_roi_mask(roi)
+    preprocess_frames(frames, seq_out_dirs, recipes, chunk_size, io, out_format, roi)
+    return {
+        'status': 'done',
+        'params': get_conversion_params(out_format, recipes),
+        'frames': get_frame_listing(frames),
+        'outputs': max(len(frames) - 1, 0),
+        'output_bytes': sum(get_disk_usage(get_output_path(seq_out_dir, out_format)) for seq_out_dir in seq_out_dirs.values()),
+    }
+
+def _convert_clip_job(job, recipes, chunk_size=None, io_threads=0, out_format='jpg'):
+    '''
+    Returns the clip's manifest record and its stage times
+    '''
+    clip, seq_dir, seq_out_dirs, roi = job
+    io = FrameIO(io_threads)
+    try:
+        record = convert_clip(seq_dir, seq_out_dirs, recipes, chunk_size, io, out_format, roi)
+    finally:
+        io.close()
+    record['clip'] = clip
+    return record, dict(io.times)
+
+def _init_worker():
+    # the parent handles Ctrl-C and terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # one OpenCV thread per process, otherwise workers oversubscribe the cores
+    cv2.setNumThreads(1)
+
+def get_roi(roi, clip):
+    '''
+    The roi argument of convert_clip for a clip: roi itself (None or 'auto'), or
+    the mask {location}.png in the directory roi if there is one, 'auto' otherwise
+    '''
+    if roi is None or roi == 'auto':
+        return roi
+    mask_fp = os.path.join(roi, clip.split(os.sep)[0] + ".png")
+    return mask_fp if os.path.exists(mask_fp) else 'auto'
+
+def convert(in_dir, out_dir, chunk_size=None, workers=1, force=False, io_threads=0, out_format='jpg', recipes=None,
+            roi=None):
+    '''
+    Convert every clip under in_dir to every recipe (see parse_recipes; by default
+    Baseline++). Clips already converted from unchanged inputs, according to the
+    manifest in out_dir, are skipped unless force is set.
+    A single clip can also be written straight to a video file, e.g. out_dir=clip.mp4.
+    roi restricts the math to the sonar fan without changing the output: 'auto',
+    or a directory of per-location {location}.png masks.
+    '''
+    recipes = parse_recipes(recipes)
+    if is_video(out_dir):
+        out_format = os.path.splitext(out_dir)[1][1:].lower()
+        if out_format not in VIDEO_FOURCC:
+            raise ValueError(f"Can only write {', '.join(VIDEO_FOURCC)} videos, not {out_dir}")
+        clips = [(in_dir, os.path.splitext(out_dir)[0])]
+        out_dir = os.path.dirname(out_dir) or '.'
+    else:
+        clips = get_clips(in_dir, out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    write_manifest(out_dir, manifest)
+    params = get_conversion_params(out_format, recipes)
+
+    jobs = []
+    num_current = 0
+    for seq_dir, seq_out_dir in clips:
+        clip = os.path.relpath(seq_out_dir, out_dir)
+        seq_out_dirs = get_recipe_out_dirs(seq_out_dir, out_dir, recipes)
+        if not force and is_clip_current(manifest.get(clip), get_frames(seq_dir), seq_out_dirs.values(), params):
+            num_current += 1
+            continue
+        jobs.append((clip, seq_dir, seq_out_dirs, get_roi(roi, clip)))
+    print("Converting", len(jobs), "clip(s),", num_current, "already up to date")
+
+    convert_job = functools.partial(_convert_clip_job, recipes=recipes, chunk_size=chunk_size, io_threads=io_threads, out_format=out_format)
+    times = defaultdict(float)
+    num_outputs = 0
+    output_bytes = 0
+    # elapsed time of all the clips: with several workers, clip times overlap
+    start = time.perf_counter()
+    with open(os.path.join(out_dir, MANIFEST_NAME), "a") as manifest_f:
+        def log(result):
+            nonlocal num_outputs, output_bytes
+            record, clip_times = result
+            num_outputs += record['outputs'] * len(recipes)
+            output_bytes += record['output_bytes']
+            manifest_f.write(json.dumps(record) + "\n")
+            manifest_f.flush()
+            for stage, t in clip_times.items():
+                times[stage] += t
+
+        # mark clips as started first, so one interrupted mid-write is redone next time
+        for clip, _, _, _ in jobs:
+            manifest_f.write(json.dumps({'clip': clip, 'status': 'started'}) + "\n")
+        manifest_f.flush()
+
+        if workers <= 1:
+            for job in tqdm(jobs):
+                log(convert_job(job))
+        else:
+            # every clip writes to its own directory, so completion order doesn't matter
+            pool = multiprocessing.Pool(workers, initializer=_init_worker)
+            try:
+                for result in tqdm(pool.imap_unordered(convert_job, jobs), total=len(jobs)):
+                    log(result)
+                pool.close()
+            except KeyboardInterrupt:
+                print("Interrupted, stopping workers")
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+    wall_time = time.perf_counter() - start
+    if jobs:
+        print(format_stage_times(times, wall_time, io_threads, min(max(workers, 1), len(jobs))))
+        print(f"Wrote {num_outputs} frames, {output_bytes / 2**20:.1f} MB ({output_bytes / max(num_outputs, 1) / 1024:.1f} KB/frame), "
+              f"{num_outputs / max(wall_time, 1e-9):.1f} frames/sec")
 
 
 def argument_parser():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--in_dir", default="frames/raw/", help="Location of frames base directory.")
-    parser.add_argument("--out_dir", default="frames/3-channel/", help="Output location for converted frames.")
+    parser.add_argument("--in_dir", default="frames/raw/", help="Location of frames base directory, or a single clip's frame directory or video.")
+    parser.add_argument("--out_dir", default="frames/3-channel/", help="Output location for converted frames, or a .mp4 / .avi file for a single clip.")
+    parser.add_argument("--chunk_size", type=int, default=None, help="Stream each clip in two passes of this many frames to bound memory use. By default the whole clip is decoded at once.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes to convert clips in parallel.")
+    parser.add_argument("--io_threads", type=int, default=0, help="Decode and encode frames on two pools of this many threads, overlapped with the NumPy stage. By default everything runs on one thread.")
+    parser.add_argument("--format", default="jpg", choices=OUTPUT_FORMATS, help="Write each clip as a directory of JPEGs (jpg), a single memory-mappable uint8 array (npy), or a single file of JPEGs with an offset index (jpack), or a video (mp4, avi).")
+    parser.add_argument("--recipe", action="append", default=None, help="Output variant to produce, repeatable: a preset (baseline++, baseline) or NAME=CHANNELS with three of raw, zero, bgsub[:K], diff[N][:K]. Every variant is built from one decode of each clip. Default: baseline++.")
+    parser.add_argument("--roi", default=None, help="Only blur, normalize and difference the sonar fan: 'auto' to find the pixels which are non-zero in any frame of each clip, or a directory of {location}.png masks (white inside the fan). Output is unchanged.")
+    parser.add_argument("--force", action="store_true", help="Reconvert clips even if the manifest in out_dir says they are up to date.")
     return parser
 
 if __name__ == "__main__":
-    args = argument_parser().parse_args()
-    convert(args.in_dir, args.out_dir)
\ No newline at end of file
+    parser = argument_parser()
+    args = parser.parse_args()
+    try:
+        parse_recipes(args.recipe)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        convert(args.in_dir, args.out_dir, args.chunk_size, args.workers, args.force, args.io_threads, args.format, args.recipe, args.roi)
+    except KeyboardInterrupt:
+        sys.exit(130)
\ No newline at end of file
@@ -0,0 +1,116 @@
+'''
+eval_client.py
+
+Thin client of eval_server.py: sends an evaluation request to the running server
+over its Unix socket and prints the combined results. It only uses the standard
+library, so it starts in a fraction of the time of evaluate.py, and the server
+already holds the ground truth of every location.
+
+Input:
+    - results_dir, tracker: as for evaluate.py
+    - iou_thresh: (optional) IoU threshold of the CLEAR and Identity metrics (default: 0.5)
+    - per_sequence: (optional) also return the results of every clip
+    - no_output: (optional) do not write the summary and detailed results and the plots
+                 to {results_dir}/{location}/{tracker}, as evaluate.py does
+    - json_out: (optional) file to write the returned results to, as JSON
+    - status, reload, shutdown: (optional) query the server, make it read the ground truth again,
+                                or stop it, instead of evaluating
+    - socket: (optional) path of the server's socket
+
+Example command:
+python eval_client.py --results_dir PATH/TO/results --tracker baseline --no_output
+
+From Python, eval_client.evaluate(...) returns the results without printing them.
+'''
+
+import argparse
+import json
+import os
+import socket
+import tempfile
+import time
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), f"caltech-fish-counting-eval-{os.getuid()}.sock")
+# summary fields printed for every location and tracker
+PRINT_FIELDS = [('HOTA', 'HOTA'), ('CLEAR', 'MOTA'), ('Identity', 'IDF1'), ('nMAE', 'nMAE_numer'), ('nMAE', 'nMAE_denom'), ('nMAE', 'nMAE')]
+
+
+def send_request(message, socket_path=DEFAULT_SOCKET):
+    '''
+    Send a request (a JSON-serializable dict) to the server and return its response.
+    Raises RuntimeError with the server's message if the request failed.
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile("rwb") as f:
+            f.write(json.dumps(message).encode() + b"\n")
+            f.flush()
+            response = json.loads(f.readline())
+    if not response['ok']:
+        raise RuntimeError(response['error'])
+    return response
+
+def evaluate(results_dir, tracker_name, iou_thresh=0.5, per_sequence=False, output=True, socket_path=DEFAULT_SOCKET):
+    '''
+    Evaluate one or more trackers on the server.
+    Returns:
+        tuple, (results, response) where results is { location -> { tracker -> res } } as returned
+        by evaluate.evaluate, with only res['COMBINED_SEQ'] unless per_sequence, and response has
+        the server's 'latency' and the number of work items it evaluated ('num_work_items')
+    '''
+    response = send_request({
+        'command': 'evaluate',
+        'results_dir': os.path.abspath(results_dir),
+        'tracker': [tracker_name] if isinstance(tracker_name, str) else list(tracker_name),
+        'iou_thresh': iou_thresh,
+        'per_sequence': per_sequence,
+        'output': output,
+    }, socket_path)
+    return response.pop('results'), response
+
+def print_results(results):
+    print(f"{'':<40}" + "".join(f"{field:>12}" for _, field in PRINT_FIELDS))
+    for location, loc_res in results.items():
+        for tracker, res in loc_res.items():
+            # MotChallenge2DBox has a single class
+            cls_res = next(iter(res['COMBINED_SEQ'].values()))
+            values = []
+            for metric, field in PRINT_FIELDS:
+                value = cls_res[metric][field]
+                # HOTA's array fields are summarized by their mean over alphas, as in its summary
+                if isinstance(value, list):
+                    value = sum(value) / len(value)
+                values.append(f"{value:>12}" if isinstance(value, int) else f"{value:>12.4f}")
+            print(f"{location + ' ' + tracker:<40}" + "".join(values))
+
+def argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results_dir", default="results", help="Location of results directory. Should contain subdirectories kenai-val, kenai-rightbank, etc.")
+    parser.add_argument("--tracker", default=["baseline"], nargs="+", help="Name of tracker(s) to evaluate. MOT results for each location should be in {results_dir}/{location_name}/{tracker}/data")
+    parser.add_argument("--iou_thresh", type=float, default=0.5, help="IoU threshold of the CLEAR and Identity metrics.")
+    parser.add_argument("--per_sequence", action="store_true", help="Also return the results of every clip.")
+    parser.add_argument("--no_output", action="store_true", help="Do not write the results and plots to {results_dir}/{location_name}/{tracker}.")
+    parser.add_argument("--json_out", default=None, help="File to write the results to, as JSON.")
+    parser.add_argument("--status", action="store_true", help="Print the status of the server.")
+    parser.add_argument("--reload", action="store_true", help="Make the server read the metadata and ground truth again.")
+    parser.add_argument("--shutdown", action="store_true", help="Stop the server.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Path of the server's Unix socket.")
+    parser.add_argument("--quiet", action="store_true")
+    return parser
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
+    commands = [command for command in ['status', 'reload', 'shutdown'] if getattr(args, command)]
+    if commands:
+        response = send_request({'command': commands[0]}, args.socket)
+        print(json.dumps(response, indent=2))
+    else:
+        start = time.perf_counter()
+        results, response = evaluate(args.results_dir, args.tracker, args.iou_thresh, args.per_sequence, not args.no_output, args.socket)
+        round_trip = time.perf_counter() - start
+        if args.json_out:
+            with open(args.json_out, "w") as f:
+                json.dump(results, f)
+        if not args.quiet:
+            print_results(results)
+        print(f"{response['num_work_items']} work items, server latency {response['latency']:.3f} s, round trip {round_trip:.3f} s")
@@ -0,0 +1,203 @@
+'''
+eval_server.py
+
+Long-running evaluation server, for when evaluate.py would be run many times on
+the same ground truth, e.g. in a tracker hyperparameter search. It imports TrackEval,
+reads the metadata and parses the ground truth of every location once, keeps them in
+memory with the metric objects, and then evaluates requests from eval_client.py on a
+local Unix socket, returning JSON results. Each request's latency is logged and
+returned to the client.
+
+Requests are evaluated one at a time, in the order they arrive. The ground truth is
+not re-read when it changes on disk: send a reload request (eval_client.py --reload)
+or restart the server.
+
+Protocol: one JSON object per line in each direction, one request per connection.
+A request has a 'command':
+    - evaluate: results_dir, tracker (list), iou_thresh, per_sequence, output, as eval_client.evaluate
+    - status: locations, number of clips and requests served so far
+    - reload: read the metadata and ground truth again
+    - shutdown: stop the server
+and the response has 'ok', and 'error' if it is False.
+
+Input:
+    - anno_dir, metadata_dir: as for evaluate.py
+    - workers: (optional) number of processes to evaluate the work items of each request on
+    - socket: (optional) path of the Unix socket to listen on
+    - cache_dir, cache_size, no_cache: (optional) cache of parsed files and results, see mot_cache.py
+
+Example command:
+python eval_server.py --anno_dir PATH/TO/annotations --metadata_dir PATH/TO/metadata --workers 4
+'''
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import time
+import traceback
+import numpy as np
+
+from eval_client import DEFAULT_SOCKET
+from evaluate import (combine_results, get_default_eval_config, get_location_dataset, get_location_metrics, get_meta,
+                      read_meta, run_work_items, _eval_work_item)
+from mot_cache import add_cache_arguments, get_cache
+
+
+def to_json(res):
+    '''
+    TrackEval results (nested dicts of NumPy arrays and scalars) as JSON-serializable values
+    '''
+    if isinstance(res, dict):
+        return { key: to_json(value) for key, value in res.items() }
+    if isinstance(res, (np.ndarray, np.generic)):
+        return res.tolist()
+    return res
+
+class EvaluationServer:
+    '''
+    The ground truth, metadata and metrics of every location, kept between evaluation requests.
+    '''
+
+    def __init__(self, anno_dir, metadata_dir, workers=1, cache=None, quiet=False):
+        self.anno_dir = anno_dir
+        self.metadata_dir = metadata_dir
+        self.workers = workers
+        self.cache = cache
+        self.quiet = quiet
+        self.num_requests = 0
+        self.started = time.time()
+        self.load()
+
+    def load(self):
+        # { location -> { 'seq_info', 'seq_dims', 'gt_data' } }
+        self.locations = {}
+        # { (location, iou_thresh) -> get_location_metrics }
+        self.metrics = {}
+        for meta_f in get_meta(self.metadata_dir):
+            if 'train' in meta_f: continue
+            location = os.path.basename(meta_f).replace(".json","")
+            print("Loading ground truth for", location)
+            seq_info, seq_dims = read_meta(meta_f)
+            # a dataset without trackers, to parse the ground truth into its gt_data
+            dataset = get_location_dataset(location, self.anno_dir, "", seq_info, [], self.cache)
+            dataset.load_gt()
+            self.locations[location] = { 'seq_info': seq_info, 'seq_dims': seq_dims, 'gt_data': dataset.gt_data }
+
+    def get_metrics(self, location, iou_thresh):
+        if (location, iou_thresh) not in self.metrics:
+            self.metrics[location, iou_thresh] = get_location_metrics(self.locations[location]['seq_dims'], iou_thresh)
+        return self.metrics[location, iou_thresh]
+
+    def evaluate(self, results_dir, tracker_names, iou_thresh=0.5, per_sequence=False, output=True):
+        '''
+        evaluate.evaluate with the resident ground truth.
+        Returns:
+            tuple, (results as to_json of evaluate.evaluate's, with only 'COMBINED_SEQ' unless per_sequence, number of work items)
+        '''
+        evaluations = {}
+        work_items = []
+        for location, loc_info in self.locations.items():
+            dataset = get_location_dataset(location, self.anno_dir, results_dir, loc_info['seq_info'], tracker_names, self.cache)
+            dataset.gt_data = loc_info['gt_data']
+            evaluations[location] = { 'dataset': dataset, 'class_list': dataset.get_eval_info()[2], **self.get_metrics(location, iou_thresh) }
+            work_items += [(location, tracker, seq) for tracker in tracker_names for seq in sorted(dataset.seq_list)]
+        seq_results = run_work_items(_eval_work_item, work_items, evaluations, self.workers)
+
+        eval_config = get_default_eval_config(quiet=self.quiet)
+        if not output:
+            eval_config['OUTPUT_SUMMARY'] = eval_config['OUTPUT_DETAILED'] = eval_config['PLOT_CURVES'] = False
+        results = {}
+        for location, evaluation in evaluations.items():
+            results[location] = {}
+            for tracker in tracker_names:
+                if not self.quiet:
+                    print("\nMOT results on", location, "for", tracker)
+                res = {seq: seq_results[location, tracker, seq] for seq in sorted(evaluation['dataset'].seq_list)}
+                res = combine_results(res, evaluation, tracker, eval_config, evaluation['dataset'].get_output_fol(tracker))
+                results[location][tracker] = to_json(res if per_sequence else { 'COMBINED_SEQ': res['COMBINED_SEQ'] })
+        return results, len(work_items)
+
+    def handle(self, request):
+        '''
+        The response to a request (see the module docstring)
+        '''
+        command = request.get('command')
+        if command == 'evaluate':
+            results, num_work_items = self.evaluate(request['results_dir'], request['tracker'], request.get('iou_thresh', 0.5),
+                                                    request.get('per_sequence', False), request.get('output', True))
+            return { 'ok': True, 'results': results, 'num_work_items': num_work_items }
+        if command == 'status':
+            return {
+                'ok': True,
+                'anno_dir': self.anno_dir,
+                'metadata_dir': self.metadata_dir,
+                'locations': { location: len(loc_info['seq_info']) for location, loc_info in self.locations.items() },
+                'num_requests': self.num_requests,
+                'uptime': time.time() - self.started,
+            }
+        if command == 'reload':
+            self.load()
+            return { 'ok': True }
+        if command == 'shutdown':
+            return { 'ok': True }
+        return { 'ok': False, 'error': f"Unknown command {command!r}" }
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server.evaluation_server
+        start = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.readline())
+            response = server.handle(request)
+        except Exception as e:
+            traceback.print_exc()
+            request = {}
+            response = { 'ok': False, 'error': f"{type(e).__name__}: {e}" }
+        response['latency'] = time.perf_counter() - start
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+        server.num_requests += 1
+        print(f"Request {server.num_requests}: {request.get('command')} {request.get('results_dir', '')} "
+              f"{' '.join(request.get('tracker', []))} in {response['latency']:.3f} s", flush=True)
+        if request.get('command') == 'shutdown' and response['ok']:
+            self.server.stopped = True
+
+def serve(evaluation_server, socket_path=DEFAULT_SOCKET):
+    '''
+    Answer requests on socket_path until a shutdown request.
+    '''
+    if os.path.exists(socket_path):
+        # remove the socket of a server that did not shut down, but not of a running one
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_path)
+                raise RuntimeError(f"A server is already listening on {socket_path}")
+            except ConnectionRefusedError:
+                os.remove(socket_path)
+    with socketserver.UnixStreamServer(socket_path, RequestHandler) as server:
+        server.evaluation_server = evaluation_server
+        server.stopped = False
+        print("Listening on", socket_path, flush=True)
+        try:
+            while not server.stopped:
+                server.handle_request()
+        finally:
+            os.remove(socket_path)
+
+def argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--anno_dir", default="annotations", help="Location of ground truth annotations in MOTChallenge format.")
+    parser.add_argument("--metadata_dir", default="metadata", help="Location of the metadata JSON file of every location.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes to evaluate the (location, tracker, sequence) work items of each request in parallel.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Path of the Unix socket to listen on.")
+    parser.add_argument("--quiet", action="store_true", help="Do not print the results of every request.")
+    add_cache_arguments(parser)
+    return parser
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
+    evaluation_server = EvaluationServer(args.anno_dir, args.metadata_dir, args.workers, get_cache(args), args.quiet)
+    serve(evaluation_server, args.socket)
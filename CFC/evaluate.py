@@ -1,17 +1,56 @@
 import argparse
-from collections import defaultdict
+import csv
+import functools
+import hashlib
 import json
-import math
+import multiprocessing
 import os
+import pickle
 import sys
+import numpy as np
+
+from anno_store import open_store
+from mot_cache import add_cache_arguments, flatten_timesteps, get_cache, unflatten_timesteps
+from nmae import count_displacements, count_normalized, get_track_displacements
+import nmae
+import profiling
+
+def is_count_only_flag(arg):
+    # --count_only, or an abbreviation of it as argparse accepts
+    return len(arg) >= 4 and "--count_only".startswith(arg)
+
+# --count_only is nmae.py's evaluation, run before TrackEval is imported so it does not need it
+if __name__ == "__main__" and any(is_count_only_flag(arg) for arg in sys.argv[1:]):
+    nmae.main([arg for arg in sys.argv[1:] if not is_count_only_flag(arg)])
+    sys.exit(0)
 
 # TrackEval imports - make sure the repo is correctly cloned at lib/TrackEval
 current_dir = os.path.dirname(os.path.realpath(__file__))
 trackeval_dir = os.path.join(current_dir, "lib/TrackEval/")
 if not trackeval_dir in sys.path: sys.path.append(trackeval_dir)
 import trackeval
-from trackeval import _timing
+from trackeval import _timing, utils
 from trackeval.metrics._base_metric import _BaseMetric
+from scipy.optimize import linear_sum_assignment
+
+@functools.lru_cache(maxsize=None)
+def get_trackeval_version():
+    """
+    A hash of the source files of the imported trackeval package, for the cache keys of parsed
+    files and results. The TrackEval submodule has no __version__, so this is what changes when
+    it is updated or patched locally.
+    """
+    package_dir = os.path.dirname(os.path.realpath(trackeval.__file__))
+    sha1 = hashlib.sha1()
+    for root, dirs, files in os.walk(package_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith(".py"): continue
+            path = os.path.join(root, name)
+            sha1.update(os.path.relpath(path, package_dir).encode())
+            with open(path, "rb") as f:
+                sha1.update(hashlib.sha1(f.read()).digest())
+    return sha1.hexdigest()
 
 
 def norm(bbox, w, h):
@@ -53,53 +92,37 @@ class nMAE(_BaseMetric):
         Return:
             tuple, (right_count, left_count)
         """
-        left = 0
-        right = 0
-        for track in tracks.values():
-            start = track[0]
-            end = track[-1]
-            
-            # get centers (dets are [x,y,w,h])
-            x0 = start[0] + (start[2]/2.0)
-            x1 = end[0] + (end[2]/2.0)
-            
-            # filter out stationary fish
-            if filter_dist > 0:
-                y0 = start[1] + (start[3]/2.0)
-                y1 = end[1] + (end[3]/2.0)
-                dist = math.sqrt((x1-x0)**2 + (y1-y0)**2)
-                if dist < filter_dist:
-                    continue
-            
-            if x0 < 0.5 and x1 >= 0.5:
-                right += 1
-            elif x0 >= 0.5 and x1 < 0.5:
-                left += 1
-                
-        return (right, left)
+        if not tracks:
+            return (0, 0)
+        start = np.array([track[0] for track in tracks.values()], dtype=float)
+        end = np.array([track[-1] for track in tracks.values()], dtype=float)
+        return count_normalized(start, end, filter_dist)
     
     @_timing.time
     def eval_sequence(self, data):
+        return self.eval_sequence_sweep(data, [self.filter_dist])[self.filter_dist]
+
+    def eval_sequence_sweep(self, data, filter_dists):
+        """
+        Results of the sequence for every filter_dist in filter_dists, as { filter_dist -> res }.
+        The tracks and their displacements are only computed once.
+        """
         w, h = self.seq_dims[data['seq']]
-        # map track IDs -> all dets in track
-        gt_tracks = defaultdict(list)
-        pred_tracks = defaultdict(list)
-        
-        # sort all ground truth & predicted into tracks
-        for gt_ids, tracker_ids, gt_dets, tracker_dets in zip (data['gt_ids'], data['tracker_ids'], data['gt_dets'], data['tracker_dets']):
-            for gti, gtd in zip(gt_ids, gt_dets):
-                gt_tracks[gti].append(norm(gtd, w, h))
-            for predi, predd in zip(tracker_ids, tracker_dets):
-                pred_tracks[predi].append(norm(predd, w, h))
-            
-        gt_right, gt_left = self.count(gt_tracks, self.filter_dist)
-        pred_right, pred_left = self.count(pred_tracks, self.filter_dist)
-            
-        return {
-            'nMAE_numer': abs(pred_right - gt_right) + abs(pred_left - gt_left),
-            'nMAE_denom': gt_right + gt_left,
-            'nMAE': -1 # no per-sequence nMAE
-        }
+        # timesteps are in order, so the first and last detection of each
+        # track ID are its first and last occurrence in the concatenated dets
+        gt_tracks = get_track_displacements(np.concatenate(data['gt_ids']), np.concatenate(data['gt_dets']), w, h)
+        pred_tracks = get_track_displacements(np.concatenate(data['tracker_ids']), np.concatenate(data['tracker_dets']), w, h)
+
+        results = {}
+        for filter_dist in filter_dists:
+            gt_right, gt_left = count_displacements(*gt_tracks, filter_dist)
+            pred_right, pred_left = count_displacements(*pred_tracks, filter_dist)
+            results[filter_dist] = {
+                'nMAE_numer': abs(pred_right - gt_right) + abs(pred_left - gt_left),
+                'nMAE_denom': gt_right + gt_left,
+                'nMAE': -1 # no per-sequence nMAE
+            }
+        return results
     
     def combine_sequences(self, all_res):
         nmae_top = sum([res['nMAE_numer'] for res in all_res.values()])
@@ -116,18 +139,481 @@ class nMAE(_BaseMetric):
     def combine_classes_det_averaged(self, all_res):
         pass
     
+def get_frame_pairs(num_gt, num_tracker):
+    """
+    Every (gt det, tracker det) pair of every timestep of a sequence, in timestep order, and
+    in row-major order within a timestep, like the flattened per-timestep similarity matrices.
+
+    Args:
+        num_gt, num_tracker: (T,) arrays, number of gt and tracker dets in each timestep
+    Returns:
+        tuple, (pair_gt, pair_tracker, pair_offsets): the (P,) indices of each pair's dets in
+        the concatenated dets of all timesteps, and the (T + 1,) offsets of each timestep's pairs
+    """
+    num_pairs = num_gt * num_tracker
+    pair_offsets = np.r_[0, np.cumsum(num_pairs)]
+    frame = np.repeat(np.arange(len(num_pairs)), num_pairs)
+    within = np.arange(pair_offsets[-1]) - pair_offsets[frame]
+    pair_gt = np.r_[0, np.cumsum(num_gt)][frame] + within // num_tracker[frame]
+    pair_tracker = np.r_[0, np.cumsum(num_tracker)][frame] + within % num_tracker[frame]
+    return pair_gt, pair_tracker, pair_offsets
+
+def batch_box_ious(gt_dets, tracker_dets):
+    """
+    IoU of the gt and tracker [x,y,w,h] boxes of every timestep, computed for all timesteps at once.
+    Identical to MotChallenge2DBox._calculate_similarities on each timestep.
+
+    Args:
+        gt_dets, tracker_dets: list (for each timestep) of (N, 4) arrays
+    Returns:
+        list (for each timestep) of (N_gt, N_tracker) arrays
+    """
+    num_gt = np.array([len(dets) for dets in gt_dets])
+    num_tracker = np.array([len(dets) for dets in tracker_dets])
+    pair_gt, pair_tracker, pair_offsets = get_frame_pairs(num_gt, num_tracker)
+    # layout: (x0, y0, x1, y1)
+    boxes1 = np.concatenate(gt_dets).astype(float)
+    boxes2 = np.concatenate(tracker_dets).astype(float)
+    for boxes in (boxes1, boxes2):
+        boxes[:, 2] = boxes[:, 0] + boxes[:, 2]
+        boxes[:, 3] = boxes[:, 1] + boxes[:, 3]
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+
+    min_ = np.minimum(boxes1[pair_gt], boxes2[pair_tracker])
+    max_ = np.maximum(boxes1[pair_gt], boxes2[pair_tracker])
+    intersection = np.maximum(min_[:, 2] - max_[:, 0], 0) * np.maximum(min_[:, 3] - max_[:, 1], 0)
+    union = area1[pair_gt] + area2[pair_tracker] - intersection
+    intersection[area1[pair_gt] <= 0 + np.finfo('float').eps] = 0
+    intersection[area2[pair_tracker] <= 0 + np.finfo('float').eps] = 0
+    intersection[union <= 0 + np.finfo('float').eps] = 0
+    union[union <= 0 + np.finfo('float').eps] = 1
+    ious = intersection / union
+    return [ious[pair_offsets[t]:pair_offsets[t + 1]].reshape(num_gt[t], num_tracker[t]) for t in range(len(num_gt))]
+
+def get_sequence_pairs(data):
+    """
+    The ids and similarity scores of a preprocessed sequence as flat arrays over all
+    timesteps (see get_frame_pairs), for the Fast* metrics.
+    Returns:
+        dict with num_gt, num_tracker (per timestep), gt_ids, tracker_ids (per det),
+        pair_gt_ids, pair_tracker_ids, similarity (per pair) and pair_offsets
+    """
+    num_gt = np.array([len(ids) for ids in data['gt_ids']])
+    num_tracker = np.array([len(ids) for ids in data['tracker_ids']])
+    gt_ids = np.concatenate(data['gt_ids']).astype(int)
+    tracker_ids = np.concatenate(data['tracker_ids']).astype(int)
+    pair_gt, pair_tracker, pair_offsets = get_frame_pairs(num_gt, num_tracker)
+    return {
+        'num_gt': num_gt,
+        'num_tracker': num_tracker,
+        'gt_ids': gt_ids,
+        'tracker_ids': tracker_ids,
+        'pair_gt_ids': gt_ids[pair_gt],
+        'pair_tracker_ids': tracker_ids[pair_tracker],
+        'pair_offsets': pair_offsets,
+        'similarity': np.concatenate([similarity.ravel() for similarity in data['similarity_scores']]),
+    }
+
+def get_pair_timesteps(pairs, pair_index):
+    """
+    The timestep of each of pair_index, indices of pairs (see get_sequence_pairs)
+    """
+    return np.searchsorted(pairs['pair_offsets'], pair_index, side='right') - 1
+
+def assign_timesteps(pairs, score, timesteps):
+    """
+    The Hungarian matching of each of timesteps, maximizing the flat per-pair score.
+    Timesteps with one gt and one tracker det are matched without linear_sum_assignment.
+    Returns:
+        sorted (M,) array of the matched pairs, in timestep and then gt det order, as
+        linear_sum_assignment returns them in each timestep
+    """
+    num_gt, num_tracker, pair_offsets = pairs['num_gt'], pairs['num_tracker'], pairs['pair_offsets']
+    single = (num_gt[timesteps] == 1) & (num_tracker[timesteps] == 1)
+    matches = [pair_offsets[timesteps[single]]]
+    for t in timesteps[~single]:
+        n, m = num_gt[t], num_tracker[t]
+        match_rows, match_cols = linear_sum_assignment(-score[pair_offsets[t]:pair_offsets[t + 1]].reshape(n, m))
+        matches.append(pair_offsets[t] + match_rows * m + match_cols)
+    return np.sort(np.concatenate(matches))
+
+class FastHOTA(trackeval.metrics.HOTA):
+    """
+    trackeval.metrics.HOTA, computed for all timesteps of a sequence at once with NumPy.
+    Only the Hungarian matching is still done per timestep, once for all the alphas,
+    which then only threshold the matched similarities. Floating point sums are done
+    in the same order as TrackEval's, so results are identical.
+    """
+
+    @classmethod
+    def get_name(cls):
+        return 'HOTA'
+
+    @_timing.time
+    def eval_sequence(self, data):
+        if data['num_tracker_dets'] == 0 or data['num_gt_dets'] == 0:
+            return super().eval_sequence(data)
+
+        # Initialise results
+        res = {}
+        for field in self.float_array_fields + self.integer_array_fields:
+            res[field] = np.zeros((len(self.array_labels)), dtype=float)
+        for field in self.float_fields:
+            res[field] = 0
+
+        pairs = get_sequence_pairs(data)
+        num_gt, num_tracker, pair_offsets, similarity = pairs['num_gt'], pairs['num_tracker'], pairs['pair_offsets'], pairs['similarity']
+        pair_gt_ids, pair_tracker_ids = pairs['pair_gt_ids'], pairs['pair_tracker_ids']
+
+        # Normalised potential matches of each timestep. Timesteps of the same shape are stacked,
+        # which sums each timestep's rows and columns exactly as TrackEval does one at a time
+        sim_iou = np.zeros_like(similarity)
+        matched_timesteps = np.flatnonzero((num_gt > 0) & (num_tracker > 0))
+        shapes = num_gt[matched_timesteps] * (num_tracker.max() + 1) + num_tracker[matched_timesteps]
+        for shape in np.unique(shapes):
+            timesteps = matched_timesteps[shapes == shape]
+            n, m = num_gt[timesteps[0]], num_tracker[timesteps[0]]
+            index = pair_offsets[timesteps][:, np.newaxis] + np.arange(n * m)
+            stacked = similarity[index].reshape(len(timesteps), n, m)
+            sim_iou_denom = stacked.sum(1)[:, np.newaxis, :] + stacked.sum(2)[:, :, np.newaxis] - stacked
+            stacked_iou = np.zeros_like(stacked)
+            sim_iou_mask = sim_iou_denom > 0 + np.finfo('float').eps
+            stacked_iou[sim_iou_mask] = stacked[sim_iou_mask] / sim_iou_denom[sim_iou_mask]
+            sim_iou[index] = stacked_iou.reshape(len(timesteps), n * m)
+
+        # accumulated in timestep order, as in TrackEval
+        potential_matches_count = np.zeros((data['num_gt_ids'], data['num_tracker_ids']))
+        np.add.at(potential_matches_count, (pair_gt_ids, pair_tracker_ids), sim_iou)
+        gt_id_count = np.bincount(pairs['gt_ids'], minlength=data['num_gt_ids']).astype(float)[:, np.newaxis]
+        tracker_id_count = np.bincount(pairs['tracker_ids'], minlength=data['num_tracker_ids']).astype(float)[np.newaxis, :]
+
+        # Calculate overall jaccard alignment score (before unique matching) between IDs
+        global_alignment_score = potential_matches_count / (gt_id_count + tracker_id_count - potential_matches_count)
+        score = global_alignment_score[pair_gt_ids, pair_tracker_ids] * similarity
+        matches = assign_timesteps(pairs, score, matched_timesteps)
+        match_similarity = similarity[matches]
+
+        # the matches of every alpha
+        alphas = len(self.array_labels)
+        alpha_mask = match_similarity[np.newaxis, :] >= self.array_labels[:, np.newaxis] - np.finfo('float').eps
+        res['HOTA_TP'] = alpha_mask.sum(1).astype(float)
+        res['HOTA_FN'] = data['num_gt_dets'] - res['HOTA_TP']
+        res['HOTA_FP'] = data['num_tracker_dets'] - res['HOTA_TP']
+
+        # LocA sums each timestep's matched similarities, then adds them up over timesteps
+        if len(matches):
+            match_timesteps = get_pair_timesteps(pairs, matches)
+            first = np.r_[True, match_timesteps[1:] != match_timesteps[:-1]]
+            slot = np.cumsum(first) - 1
+            position = np.arange(len(matches)) - np.flatnonzero(first)[slot]
+            timestep_similarity = np.zeros((alphas, slot[-1] + 1, position.max() + 1))
+            timestep_similarity[:, slot, position] = np.where(alpha_mask, match_similarity, 0)
+            timestep_sums = timestep_similarity[:, :, 0]
+            for i in range(1, timestep_similarity.shape[2]):
+                timestep_sums = timestep_sums + timestep_similarity[:, :, i]
+            res['LocA'] = np.cumsum(timestep_sums, axis=1)[:, -1]
+
+        num_ids = data['num_gt_ids'] * data['num_tracker_ids']
+        alpha_index, match_index = np.nonzero(alpha_mask)
+        id_pairs = pair_gt_ids[matches] * data['num_tracker_ids'] + pair_tracker_ids[matches]
+        matches_counts = np.bincount(alpha_index * num_ids + id_pairs[match_index], minlength=alphas * num_ids)
+        matches_counts = matches_counts.astype(float).reshape(alphas, data['num_gt_ids'], data['num_tracker_ids'])
+
+        # Calculate association scores (AssA, AssRe, AssPr) for the alpha value.
+        # First calculate scores per gt_id/tracker_id combo and then average over the number of detections.
+        for a, alpha in enumerate(self.array_labels):
+            matches_count = matches_counts[a]
+            ass_a = matches_count / np.maximum(1, gt_id_count + tracker_id_count - matches_count)
+            res['AssA'][a] = np.sum(matches_count * ass_a) / np.maximum(1, res['HOTA_TP'][a])
+            ass_re = matches_count / np.maximum(1, gt_id_count)
+            res['AssRe'][a] = np.sum(matches_count * ass_re) / np.maximum(1, res['HOTA_TP'][a])
+            ass_pr = matches_count / np.maximum(1, tracker_id_count)
+            res['AssPr'][a] = np.sum(matches_count * ass_pr) / np.maximum(1, res['HOTA_TP'][a])
+
+        # Calculate final scores
+        res['LocA'] = np.maximum(1e-10, res['LocA']) / np.maximum(1e-10, res['HOTA_TP'])
+        res = self._compute_final_fields(res)
+        return res
+
+class FastCLEAR(trackeval.metrics.CLEAR):
+    """
+    trackeval.metrics.CLEAR, with fewer NumPy operations per timestep. Matching depends on
+    the previous timestep's matches, so timesteps are still matched one at a time, but
+    timesteps without any possible match, or with a single gt and tracker det, are not
+    matched with linear_sum_assignment, and MT/PT/ML and Frag are counted after the loop.
+    Results are identical to TrackEval's.
+    """
+
+    @classmethod
+    def get_name(cls):
+        return 'CLEAR'
+
+    @_timing.time
+    def eval_sequence(self, data):
+        if data['num_tracker_dets'] == 0 or data['num_gt_dets'] == 0:
+            return super().eval_sequence(data)
+
+        # Initialise results
+        res = {}
+        for field in self.fields:
+            res[field] = 0
+
+        pairs = get_sequence_pairs(data)
+        num_gt, num_tracker, pair_offsets = pairs['num_gt'], pairs['num_tracker'], pairs['pair_offsets']
+        can_match = pairs['similarity'] >= self.threshold - np.finfo('float').eps
+        # whether each timestep has any pair above the threshold (reduceat needs non-empty timesteps)
+        has_pairs = pair_offsets[1:] > pair_offsets[:-1]
+        timestep_can_match = np.zeros(len(num_gt), dtype=bool)
+        timestep_can_match[has_pairs] = np.logical_or.reduceat(can_match, pair_offsets[:-1][has_pairs])
+
+        num_gt_ids = data['num_gt_ids']
+        # Note that IDSWs are counted based on the last time each gt_id was present (any number of frames previously),
+        # but are only used in matching to continue current tracks based on the gt_id in the single previous timestep.
+        prev_tracker_id = np.nan * np.zeros(num_gt_ids)  # For scoring IDSW
+        prev_timestep_tracker_id = np.nan * np.zeros(num_gt_ids)  # For matching IDSW
+        prev_timestep_gt_ids = np.zeros(0, dtype=int)
+        num_idsw = 0
+        # gt ids matched in each timestep that has gt and tracker dets, for MT/PT/ML and Frag
+        matched_gt_ids_list = []
+
+        for t, (gt_ids_t, tracker_ids_t) in enumerate(zip(data['gt_ids'], data['tracker_ids'])):
+            # Deal with the case that there are no gt_det/tracker_det in a timestep.
+            if len(gt_ids_t) == 0:
+                res['CLR_FP'] += len(tracker_ids_t)
+                continue
+            if len(tracker_ids_t) == 0:
+                res['CLR_FN'] += len(gt_ids_t)
+                continue
+
+            if not timestep_can_match[t]:
+                match_rows = match_cols = np.zeros(0, dtype=int)
+            else:
+                similarity = data['similarity_scores'][t]
+                if num_gt[t] == 1 and num_tracker[t] == 1:
+                    # as below, without linear_sum_assignment
+                    score = 1000 * (tracker_ids_t[0] == prev_timestep_tracker_id[gt_ids_t[0]]) + similarity[0, 0]
+                    match_rows = match_cols = np.zeros(int(score > 0 + np.finfo('float').eps), dtype=int)
+                else:
+                    # Calc score matrix to first minimise IDSWs from previous frame, and then maximise MOTP secondarily
+                    score_mat = (tracker_ids_t[np.newaxis, :] == prev_timestep_tracker_id[gt_ids_t[:, np.newaxis]])
+                    score_mat = 1000 * score_mat + similarity
+                    score_mat[similarity < self.threshold - np.finfo('float').eps] = 0
+
+                    # Hungarian algorithm to find best matches
+                    match_rows, match_cols = linear_sum_assignment(-score_mat)
+                    actually_matched_mask = score_mat[match_rows, match_cols] > 0 + np.finfo('float').eps
+                    match_rows = match_rows[actually_matched_mask]
+                    match_cols = match_cols[actually_matched_mask]
+
+            matched_gt_ids = gt_ids_t[match_rows]
+            matched_tracker_ids = tracker_ids_t[match_cols]
+
+            # Calc IDSW for MOTA
+            prev_matched_tracker_ids = prev_tracker_id[matched_gt_ids]
+            num_idsw += np.count_nonzero(~np.isnan(prev_matched_tracker_ids) & (matched_tracker_ids != prev_matched_tracker_ids))
+
+            # Record for IDSW/Frag for next timestep
+            prev_tracker_id[matched_gt_ids] = matched_tracker_ids
+            prev_timestep_tracker_id[prev_timestep_gt_ids] = np.nan
+            prev_timestep_tracker_id[matched_gt_ids] = matched_tracker_ids
+            prev_timestep_gt_ids = matched_gt_ids
+            matched_gt_ids_list.append(matched_gt_ids)
+
+            # Calculate and accumulate basic statistics
+            num_matches = len(matched_gt_ids)
+            res['CLR_TP'] += num_matches
+            res['CLR_FN'] += len(gt_ids_t) - num_matches
+            res['CLR_FP'] += len(tracker_ids_t) - num_matches
+            if num_matches > 0:
+                res['MOTP_sum'] += sum(similarity[match_rows, match_cols])
+
+        if matched_gt_ids_list:
+            # TrackEval adds np.sum(is_idsw) in every such timestep
+            res['IDSW'] = np.int64(num_idsw)
+        # MT/PT/ML: the gt ids are counted in every timestep. Frag: a gt id starts a fragment in each
+        # timestep (with gt and tracker dets) it is matched in, if it was not in the previous one
+        gt_id_count = np.bincount(pairs['gt_ids'], minlength=num_gt_ids).astype(float)
+        matched_timesteps = np.repeat(np.arange(len(matched_gt_ids_list)), [len(ids) for ids in matched_gt_ids_list])
+        matched_gt_ids = np.concatenate(matched_gt_ids_list).astype(int) if matched_gt_ids_list else np.zeros(0, dtype=int)
+        gt_matched_count = np.bincount(matched_gt_ids, minlength=num_gt_ids).astype(float)
+        matched_keys = matched_timesteps * num_gt_ids + matched_gt_ids
+        starts = ~np.isin(matched_keys - num_gt_ids, matched_keys)
+        gt_frag_count = np.bincount(matched_gt_ids[starts], minlength=num_gt_ids).astype(float)
+
+        # Calculate MT/ML/PT/Frag/MOTP
+        tracked_ratio = gt_matched_count[gt_id_count > 0] / gt_id_count[gt_id_count > 0]
+        res['MT'] = np.sum(np.greater(tracked_ratio, 0.8))
+        res['PT'] = np.sum(np.greater_equal(tracked_ratio, 0.2)) - res['MT']
+        res['ML'] = num_gt_ids - res['MT'] - res['PT']
+        res['Frag'] = np.sum(np.subtract(gt_frag_count[gt_frag_count > 0], 1))
+        res['MOTP'] = res['MOTP_sum'] / np.maximum(1.0, res['CLR_TP'])
+
+        res['CLR_Frames'] = data['num_timesteps']
+
+        # Calculate final CLEAR scores
+        res = self._compute_final_fields(res)
+        return res
+
+class FastIdentity(trackeval.metrics.Identity):
+    """
+    trackeval.metrics.Identity, with the potential matches counted, and the assignment
+    cost matrices built, for all timesteps at once. Results are identical to TrackEval's.
+    """
+
+    @classmethod
+    def get_name(cls):
+        return 'Identity'
+
+    @_timing.time
+    def eval_sequence(self, data):
+        if data['num_tracker_dets'] == 0 or data['num_gt_dets'] == 0:
+            return super().eval_sequence(data)
+
+        # Initialise results
+        res = {}
+        for field in self.fields:
+            res[field] = 0
+
+        pairs = get_sequence_pairs(data)
+        num_gt_ids = data['num_gt_ids']
+        num_tracker_ids = data['num_tracker_ids']
+        matches_mask = np.greater_equal(pairs['similarity'], self.threshold)
+        potential_matches_count = np.bincount(pairs['pair_gt_ids'][matches_mask] * num_tracker_ids + pairs['pair_tracker_ids'][matches_mask],
+                                              minlength=num_gt_ids * num_tracker_ids).astype(float).reshape(num_gt_ids, num_tracker_ids)
+        gt_id_count = np.bincount(pairs['gt_ids'], minlength=num_gt_ids).astype(float)
+        tracker_id_count = np.bincount(pairs['tracker_ids'], minlength=num_tracker_ids).astype(float)
+
+        # Calculate optimal assignment cost matrix for ID metrics
+        fp_mat = np.zeros((num_gt_ids + num_tracker_ids, num_gt_ids + num_tracker_ids))
+        fn_mat = np.zeros((num_gt_ids + num_tracker_ids, num_gt_ids + num_tracker_ids))
+        fp_mat[num_gt_ids:, :num_tracker_ids] = 1e10
+        fn_mat[:num_gt_ids, num_tracker_ids:] = 1e10
+        fn_mat[:num_gt_ids, :num_tracker_ids] = gt_id_count[:, np.newaxis]
+        fn_mat[np.arange(num_gt_ids), num_tracker_ids + np.arange(num_gt_ids)] = gt_id_count
+        fp_mat[:num_gt_ids, :num_tracker_ids] = tracker_id_count[np.newaxis, :]
+        fp_mat[num_gt_ids + np.arange(num_tracker_ids), np.arange(num_tracker_ids)] = tracker_id_count
+        fn_mat[:num_gt_ids, :num_tracker_ids] -= potential_matches_count
+        fp_mat[:num_gt_ids, :num_tracker_ids] -= potential_matches_count
+
+        # Hungarian algorithm
+        match_rows, match_cols = linear_sum_assignment(fn_mat + fp_mat)
+
+        # Accumulate basic statistics
+        res['IDFN'] = fn_mat[match_rows, match_cols].sum().astype(int)
+        res['IDFP'] = fp_mat[match_rows, match_cols].sum().astype(int)
+        res['IDTP'] = (gt_id_count.sum() - res['IDFN']).astype(int)
+
+        # Calculate final ID scores
+        res = self._compute_final_fields(res)
+        return res
+
+# TrackEval's metrics, or the same metrics computed faster in this file
+METRIC_ENGINES = {
+    'trackeval': {'HOTA': trackeval.metrics.HOTA, 'CLEAR': trackeval.metrics.CLEAR, 'Identity': trackeval.metrics.Identity},
+    'fast': {'HOTA': FastHOTA, 'CLEAR': FastCLEAR, 'Identity': FastIdentity},
+}
+
+class SharedGTDataset(trackeval.datasets.MotChallenge2DBox):
+    """
+    A MotChallenge2DBox dataset which parses each sequence's gt.txt only once,
+    and shares it between all the trackers evaluated on the location.
+    With a mot_cache.ParseCache, parsed gt and tracker files are also kept
+    on disk between runs. With an anno_store.AnnotationStore, gt files are
+    read from the store instead of parsed, unless they changed since it was built.
+    Similarities are computed for all timesteps at once (batch_box_ious).
+    """
+
+    def __init__(self, config=None, cache=None, store=None):
+        super().__init__(config)
+        self.gt_data = {}
+        self.cache = cache
+        self.store = store
+
+    def _load_raw_file(self, tracker, seq, is_gt):
+        if not is_gt:
+            return self._load_cached_raw_file(tracker, seq, is_gt)
+        # preprocessing only reads the raw gt data, so it is safe to share
+        if seq not in self.gt_data:
+            self.gt_data[seq] = self._load_cached_raw_file(tracker, seq, is_gt)
+        return self.gt_data[seq]
+
+    def get_file(self, tracker, seq, is_gt):
+        if is_gt:
+            return self.config["GT_LOC_FORMAT"].format(gt_folder=self.gt_fol, seq=seq)
+        return os.path.join(self.tracker_fol, tracker, self.tracker_sub_fol, seq + '.txt')
+
+    def _load_cached_raw_file(self, tracker, seq, is_gt):
+        with profiling.span("load_gt" if is_gt else "load_tracker", seq=seq):
+            return self._load_parsed_raw_file(tracker, seq, is_gt)
+
+    def _load_parsed_raw_file(self, tracker, seq, is_gt):
+        if is_gt and self.store is not None and not self.data_is_zipped:
+            if self.store.is_current(seq, self.get_file(tracker, seq, is_gt)):
+                return self._load_stored_raw_file(seq)
+            print("The annotation store is out of date for", seq, "- parsing its gt file")
+        load_raw_file = super()._load_raw_file
+        if self.cache is None or self.data_is_zipped:
+            return load_raw_file(tracker, seq, is_gt)
+        file = self.get_file(tracker, seq, is_gt)
+        # the parsed data depends on the sequence length and on the TrackEval source
+        num_timesteps = self.seq_lengths[seq]
+        kind = "trackeval-{}-{}-{}".format("gt" if is_gt else "tracker", num_timesteps, get_trackeval_version())
+        arrays = self.cache.get(file, kind, lambda _: flatten_timesteps(load_raw_file(tracker, seq, is_gt)))
+        raw_data = unflatten_timesteps(arrays)
+        raw_data['num_timesteps'] = num_timesteps
+        raw_data['seq'] = seq
+        return raw_data
+
+    def _load_stored_raw_file(self, seq):
+        # as MotChallenge2DBox._load_raw_file for a gt file, from its rows in the store
+        num_timesteps = self.seq_lengths[seq]
+        rows = self.store.rows(seq)
+        frames = rows[:, 0].astype(int)
+        if len(rows) and (frames[0] < 1 or frames[-1] > num_timesteps):
+            raise utils.TrackEvalException('Ground-truth data contains the following invalid timesteps in seq %s: ' % seq + ', '.join(
+                str(frame) + ', ' for frame in np.unique(frames[(frames < 1) | (frames > num_timesteps)])))
+        if len(rows) and rows.shape[1] < 8:
+            raise utils.TrackEvalException('GT data is not in a valid format, there is not enough rows in seq %s, timestep %i.' % (seq, frames[0] - 1))
+        # rows are sorted by frame, so each timestep's detections are contiguous, in file order
+        lengths = np.bincount(frames - 1, minlength=num_timesteps).astype(np.int64)
+        arrays = {}
+        for key, data, empty in [('gt_ids', rows[:, 1].astype(int), np.empty(0).astype(int)),
+                                 ('gt_classes', rows[:, 7].astype(int), np.empty(0).astype(int)),
+                                 ('gt_dets', rows[:, 2:6], np.empty((0, 4))),
+                                 ('gt_extras.zero_marked', rows[:, 6].astype(int), np.empty(0))]:
+            arrays[key + ":data"], arrays[key + ":lengths"], arrays[key + ":empty"] = data, lengths, empty
+        raw_data = unflatten_timesteps(arrays)
+        raw_data['gt_crowd_ignore_regions'] = [np.empty((0, 4)) for _ in range(num_timesteps)]
+        raw_data['num_timesteps'] = num_timesteps
+        raw_data['seq'] = seq
+        return raw_data
+
+    def load_gt(self, seq_list=None):
+        for seq in self.seq_list if seq_list is None else seq_list:
+            self._load_raw_file(None, seq, is_gt=True)
+
+    @_timing.time
+    def get_raw_seq_data(self, tracker, seq):
+        # as MotChallenge2DBox, with the IoUs of all timesteps computed at once
+        raw_gt_data = self._load_raw_file(tracker, seq, is_gt=True)
+        raw_tracker_data = self._load_raw_file(tracker, seq, is_gt=False)
+        raw_data = {**raw_tracker_data, **raw_gt_data}
+        raw_data['similarity_scores'] = batch_box_ious(raw_data['gt_dets'], raw_data['tracker_dets'])
+        return raw_data
+
 def get_default_ds_config(anno_dir, trackers_dir, tracker_name='baseline'):
     """
     Get a TrackEval dataset config for MOT tracking predictions.
     Args:
         anno_dir: Directory of ground truth MOT annotations for this location. E.g. 'annotations/kenai-val/'
         trackers_dir: Directory of trackers for this location. E.g. 'results/kenai-val/baseline/'
-        tracker_name: The tracker to evaluate. There should exist a directory with the same name within trackers_dir.
+        tracker_name: The tracker to evaluate, or a list of trackers. There should exist a directory with the same name within trackers_dir.
     """
     dataset_config = trackeval.datasets.MotChallenge2DBox.get_default_dataset_config()
     dataset_config['GT_FOLDER'] = anno_dir
     dataset_config['TRACKERS_FOLDER'] = trackers_dir
-    dataset_config['TRACKERS_TO_EVAL'] = [tracker_name,]
+    dataset_config['TRACKERS_TO_EVAL'] = [tracker_name,] if isinstance(tracker_name, str) else list(tracker_name)
     dataset_config['SKIP_SPLIT_FOL'] = True
     
     dataset_config['GT_LOC_FORMAT'] = '{gt_folder}/{seq}/gt.txt'
@@ -142,7 +628,8 @@ def get_default_eval_config(quiet=False):
     
     # parallelization in TrackEval is only within clips
     # this offers speedup on MOTChallenge dataset; not really on ours
-    # because our clips are much shorter
+    # because our clips are much shorter. evaluate() instead runs
+    # (location, tracker, sequence) work items on its own process pool
     eval_config['USE_PARALLEL'] = False
     eval_config['NUM_PARALLEL_CORES'] = 1
     
@@ -152,7 +639,8 @@ def get_default_eval_config(quiet=False):
     return eval_config
 
 def get_default_metrics_config():
-    return {'METRICS': ['CLEAR', 'Identity', 'HOTA', 'nMAE'], 'THRESHOLD': 0.5}
+    # ENGINE: which implementation of HOTA, CLEAR and Identity to run, see METRIC_ENGINES
+    return {'METRICS': ['CLEAR', 'Identity', 'HOTA', 'nMAE'], 'THRESHOLD': 0.5, 'ENGINE': 'trackeval'}
 
 def get_meta(metadata_dir='metadata'):
     """
@@ -167,52 +655,542 @@ def get_meta(metadata_dir='metadata'):
             os.path.join(metadata_dir, 'elwha.json'),
         ]
 
-def evaluate(results_dir, anno_dir, metadata_dir, tracker_name, quiet, iou_thresh=0.5):
-    meta = get_meta(metadata_dir)
-    
-    results = {}
-    for meta_f in meta:
+def get_metrics_list(metrics_config):
+    metrics_list = []
+    engine = METRIC_ENGINES[metrics_config.get('ENGINE', 'trackeval')]
+    for metric in [engine['HOTA'], engine['CLEAR'], engine['Identity'], trackeval.metrics.VACE, nMAE]:
+        if metric.get_name() in metrics_config['METRICS']:
+            metrics_list.append(metric(metrics_config))
+    # Count metrics are always run
+    return metrics_list + [trackeval.metrics.Count()]
+
+def read_meta(meta_f):
+    """
+    Number of frames and (width, height) of every clip of a location, from its metadata file.
+    Returns: tuple, (SEQ_INFO, SEQ_DIMS) as the dataset and metrics configs take them
+    """
+    with open(meta_f, "r") as f:
+        js = json.load(f)
+    return { c['clip_name'] : c['num_frames'] for c in js }, { c['clip_name'] : (c['width'], c['height']) for c in js}
+
+def get_location_metrics(seq_dims, iou_thresh=0.5, engine='trackeval'):
+    """
+    The metrics of a location. They do not depend on the trackers, so can be reused between evaluations.
+    Returns: dict with metrics_config, metrics_list and metric_names.
+    """
+    metrics_config = get_default_metrics_config()
+    metrics_config['THRESHOLD'] = iou_thresh
+    metrics_config['ENGINE'] = engine
+    metrics_config['PRINT_CONFIG'] = False
+    metrics_config['SEQ_DIMS'] = seq_dims
+    metrics_list = get_metrics_list(metrics_config)
+    return {
+        'metrics_config': metrics_config,
+        'metrics_list': metrics_list,
+        'metric_names': utils.validate_metrics_list(metrics_list),
+    }
+
+def get_location_dataset(location, anno_dir, results_dir, seq_info, tracker_names, cache=None, store_dir=None):
+    loc_anno_dir = os.path.join(anno_dir, location)
+    loc_trackers_dir = os.path.join(results_dir, location)
+    dataset_config = get_default_ds_config(loc_anno_dir, loc_trackers_dir, tracker_names)
+    dataset_config['SEQ_INFO'] = seq_info
+    return SharedGTDataset(dataset_config, cache, open_store(store_dir, location))
+
+def get_location_evaluation(location, anno_dir, results_dir, meta_f, tracker_names, iou_thresh=0.5, cache=None, engine='trackeval', store_dir=None):
+    """
+    Set up the evaluation of trackers on one location.
+    Returns: dict with the location's dataset, class_list, metrics_config, metrics_list and metric_names.
+    """
+    seq_info, seq_dims = read_meta(meta_f)
+    dataset = get_location_dataset(location, anno_dir, results_dir, seq_info, tracker_names, cache, store_dir)
+    return {
+        'dataset': dataset,
+        'class_list': dataset.get_eval_info()[2],
+        **get_location_metrics(seq_dims, iou_thresh, engine),
+    }
+
+# part of every result key, to be increased when a metric defined here changes its results
+RESULTS_VERSION = 1
+
+def get_metrics_settings(metrics_list):
+    """
+    The settings of metrics that their results depend on, as a JSON-serializable list.
+    """
+    return [[metric.get_name(), getattr(metric, 'threshold', None), getattr(metric, 'filter_dist', None)] for metric in metrics_list]
+
+def get_result_key(evaluation, tracker, seq, settings):
+    """
+    Key of the results of tracker on seq in the dataset's cache: a hash of the contents of the
+    sequence's gt and tracker files and of everything else the results depend on, including settings.
+    Returns None if the dataset has no cache.
+    """
+    dataset = evaluation['dataset']
+    if dataset.cache is None or dataset.data_is_zipped:
+        return None
+    digests = [dataset.cache.get_digest(dataset.get_file(tracker, seq, is_gt)) for is_gt in (True, False)]
+    key = [RESULTS_VERSION, get_trackeval_version(), digests, dataset.seq_lengths[seq],
+           list(evaluation['metrics_config']['SEQ_DIMS'][seq]), dataset.config['DO_PREPROC'], dataset.class_list, settings,
+           evaluation['metrics_config'].get('ENGINE', 'trackeval')]
+    return hashlib.sha1(json.dumps(key).encode()).hexdigest()
+
+def get_cached_result(evaluation, tracker, seq, settings, compute):
+    """
+    The results of tracker on seq from the dataset's cache, or compute() if they are not cached.
+    Returns: (results, whether they were cached)
+    """
+    cache = evaluation['dataset'].cache
+    key = get_result_key(evaluation, tracker, seq, settings)
+    seq_res = cache.get_result(key) if key else None
+    if seq_res is not None:
+        return seq_res, True
+    seq_res = compute()
+    if key:
+        cache.put_result(key, seq_res)
+    return seq_res, False
+
+# evaluations of every location, set by _init_eval_worker in pool processes
+_evaluations = None
+
+def _init_eval_worker(evaluations, profiler=None):
+    global _evaluations
+    _evaluations = evaluations
+    if profiler is not None:
+        profiling.enable(profiler.fork())
+
+def _profiled_work_item(work):
+    """
+    Run work_fn on a work item in a pool process, and return its profiling spans with its results.
+    """
+    work_fn, item = work
+    return work_fn(item), profiling.get_profiler().pop_events()
+
+def _eval_work_item(item):
+    """
+    Evaluate one (location, tracker, sequence) work item, or reuse its cached results.
+    Returns: (item, seq_res, whether seq_res was cached)
+    """
+    location, tracker, seq = item
+    evaluation = _evaluations[location]
+    dataset = evaluation['dataset']
+    compute = lambda: eval_sequence(seq, dataset, tracker, evaluation['class_list'],
+                                    evaluation['metrics_list'], evaluation['metric_names'])
+    settings = get_metrics_settings(evaluation['metrics_list'])
+    with profiling.span("work_item", location=location, tracker=tracker, seq=seq) as span_args:
+        seq_res, span_args['cached'] = get_cached_result(evaluation, tracker, seq, settings, compute)
+    return item, seq_res, span_args['cached']
+
+def eval_sequence(seq, dataset, tracker, class_list, metrics_list, metric_names):
+    """
+    trackeval.eval.eval_sequence, with a profiling span around each stage.
+    """
+    with profiling.span("raw_data"):
+        raw_data = dataset.get_raw_seq_data(tracker, seq)
+    seq_res = {}
+    for cls in class_list:
+        seq_res[cls] = {}
+        with profiling.span("preprocess"):
+            data = dataset.get_preprocessed_seq_data(raw_data, cls)
+        for metric, met_name in zip(metrics_list, metric_names):
+            with profiling.span(met_name + ".eval_sequence", metric=met_name):
+                seq_res[cls][met_name] = metric.eval_sequence(data)
+    return seq_res
+
+def combine_results(res, evaluation, tracker, eval_config, output_fol):
+    """
+    Combine the per-sequence results of a tracker on a location into res['COMBINED_SEQ'],
+    then print them and write them to output_fol, the same way as trackeval.Evaluator.
+    """
+    metrics_list, metric_names = evaluation['metrics_list'], evaluation['metric_names']
+    class_list = evaluation['class_list']
+
+    res['COMBINED_SEQ'] = {}
+    for c_cls in class_list:
+        res['COMBINED_SEQ'][c_cls] = {}
+        for metric, metric_name in zip(metrics_list, metric_names):
+            curr_res = {seq_key: seq_value[c_cls][metric_name] for seq_key, seq_value in res.items() if
+                        seq_key != 'COMBINED_SEQ'}
+            with profiling.span(metric_name + ".combine_sequences", metric=metric_name):
+                res['COMBINED_SEQ'][c_cls][metric_name] = metric.combine_sequences(curr_res)
+
+    # MotChallenge2DBox has a single class, so there are no combined classes to output.
+    # Trackers have no display names in our dataset config
+    tracker_display_name = tracker
+    for c_cls in class_list:
+        summaries = []
+        details = []
+        num_dets = res['COMBINED_SEQ'][c_cls]['Count']['Dets']
+        if not (eval_config['OUTPUT_EMPTY_CLASSES'] or num_dets > 0):
+            continue
+        with profiling.span("output"):
+            for metric, metric_name in zip(metrics_list, metric_names):
+                table_res = {seq_key: seq_value[c_cls][metric_name] for seq_key, seq_value in res.items()}
+                if eval_config['PRINT_RESULTS'] and eval_config['PRINT_ONLY_COMBINED']:
+                    metric.print_table({'COMBINED_SEQ': table_res['COMBINED_SEQ']}, tracker_display_name, c_cls)
+                elif eval_config['PRINT_RESULTS']:
+                    metric.print_table(table_res, tracker_display_name, c_cls)
+                if eval_config['OUTPUT_SUMMARY']:
+                    summaries.append(metric.summary_results(table_res))
+                if eval_config['OUTPUT_DETAILED']:
+                    details.append(metric.detailed_results(table_res))
+                if eval_config['PLOT_CURVES']:
+                    metric.plot_single_tracker_results(table_res, tracker_display_name, c_cls, output_fol)
+            if eval_config['OUTPUT_SUMMARY']:
+                utils.write_summary_results(summaries, c_cls, output_fol)
+            if eval_config['OUTPUT_DETAILED']:
+                utils.write_detailed_results(details, c_cls, output_fol)
+    return res
+
+def get_shard(work_items, shard):
+    """
+    Work items of shard (i, N): every N-th work item, starting from the i-th (0-indexed).
+    """
+    i, num_shards = shard
+    return work_items[i::num_shards]
+
+def load_evaluations(results_dir, anno_dir, metadata_dir, tracker_names, iou_thresh=0.5, cache=None, shard=None, engine='trackeval', store_dir=None):
+    """
+    Set up the evaluation of every location except kenai-train, and load the ground truth of its work items.
+    Args:
+        shard: (optional) (i, N), to only keep the work items of shard i of N (see get_shard).
+        engine: (optional) implementation of HOTA, CLEAR and Identity, 'fast' or 'trackeval' (see METRIC_ENGINES).
+        store_dir: (optional) anno_store.py store of anno_dir to read the ground truth from.
+    Returns:
+        tuple, ({ location -> evaluation }, [(location, tracker, sequence) work items])
+    """
+    evaluations = {}
+    work_items = []
+    for meta_f in get_meta(metadata_dir):
         if 'train' in meta_f: continue
         location = os.path.basename(meta_f).replace(".json","")
-        print("Evaluating MOT results on", location)
-        
-        # construct one 'dataset' per location, containing all sequences
-        dataset_list = []
-        loc_anno_dir = os.path.join(anno_dir, location)
-        loc_trackers_dir = os.path.join(results_dir, location)
-        dataset_config = get_default_ds_config(loc_anno_dir, loc_trackers_dir, tracker_name)
-        eval_config = get_default_eval_config(quiet=quiet)
-        metrics_config = get_default_metrics_config()
-        metrics_config['THRESHOLD'] = iou_thresh
-        metrics_config['PRINT_CONFIG'] = False
-        
-        with open(meta_f, "r") as f: 
-            js = json.load(f)
-            dataset_config['SEQ_INFO'] = { c['clip_name'] : c['num_frames'] for c in js }
-            metrics_config['SEQ_DIMS'] = { c['clip_name'] : (c['width'], c['height']) for c in js}
-        
-        dataset_list.append(trackeval.datasets.MotChallenge2DBox(dataset_config))
-        evaluator = trackeval.Evaluator(eval_config)
-        metrics_list = []
-        for metric in [trackeval.metrics.HOTA, trackeval.metrics.CLEAR, trackeval.metrics.Identity, trackeval.metrics.VACE, nMAE]:
-            if metric.get_name() in metrics_config['METRICS']:
-                metrics_list.append(metric(metrics_config))
-                
-        # run evaluation
-        output_res, output_msg = evaluator.evaluate(dataset_list, metrics_list)
-        results[meta_f] = output_res
-        
-    return output_res
-    
+        evaluations[location] = get_location_evaluation(location, anno_dir, results_dir, meta_f, tracker_names, iou_thresh, cache, engine, store_dir)
+        seq_list = sorted(evaluations[location]['dataset'].seq_list)
+        work_items += [(location, tracker, seq) for tracker in tracker_names for seq in seq_list]
+    if shard is not None:
+        work_items = get_shard(work_items, shard)
+
+    for location, evaluation in evaluations.items():
+        print("Loading ground truth for", location)
+        with profiling.span("ground_truth", location=location):
+            evaluation['dataset'].load_gt(sorted(set(seq for item_location, _, seq in work_items if item_location == location)))
+    return evaluations, work_items
+
+def run_work_items(work_fn, work_items, evaluations, workers=1):
+    """
+    Run work_fn on every work item, on a pool of workers processes if workers > 1.
+    work_fn returns (item, result, whether result was cached).
+    Returns:
+        dict, { work item -> result }
+    """
+    print("Evaluating", len(set(item[1] for item in work_items)), "tracker(s) on", len(evaluations), "location(s),", len(work_items), "work items")
+    seq_results = {}
+    num_cached = 0
+    if workers <= 1:
+        _init_eval_worker(evaluations)
+        for item in work_items:
+            _, seq_results[item], cached = work_fn(item)
+            num_cached += cached
+    else:
+        # the pool inherits the loaded ground truth once per process, not per work item
+        chunksize = max(1, len(work_items) // (workers * 4))
+        profiler = profiling.get_profiler()
+        with multiprocessing.Pool(workers, initializer=_init_eval_worker, initargs=(evaluations, profiler)) as pool:
+            if profiler is None:
+                outputs = pool.imap_unordered(work_fn, work_items, chunksize=chunksize)
+            else:
+                outputs = pool.imap_unordered(_profiled_work_item, [(work_fn, item) for item in work_items], chunksize=chunksize)
+            for output in outputs:
+                if profiler is not None:
+                    output, events = output
+                    profiler.events += events
+                item, seq_res, cached = output
+                seq_results[item] = seq_res
+                num_cached += cached
+    if num_cached:
+        print("Reused the cached results of", num_cached, "of", len(work_items), "work items")
+    return seq_results
+
+def evaluate(results_dir, anno_dir, metadata_dir, tracker_name, quiet, iou_thresh=0.5, workers=1, cache=None, engine='trackeval', store_dir=None):
+    """
+    Evaluate one or more trackers on every location except kenai-train.
+
+    Ground truth is loaded once per location and shared between trackers. Every
+    (location, tracker, sequence) is a separate work item, run on a pool of
+    workers processes if workers > 1.
+
+    Args:
+        tracker_name: name of the tracker to evaluate, or a list of names.
+        cache: (optional) mot_cache.ParseCache to keep parsed gt and tracker files, and the
+               results of every sequence, in. Sequences whose gt and tracker files, and
+               evaluation settings, have not changed since they were cached are not evaluated again.
+        engine: 'trackeval' (default) for TrackEval's HOTA, CLEAR and Identity metrics, or 'fast' for
+                the vectorized ones of this file. Both give the same results.
+        store_dir: (optional) directory of an anno_store.py store of anno_dir. The ground truth of the
+                   locations it has is read from it instead of parsed, unless a gt file changed since.
+    Returns:
+        dict, { location -> { tracker -> res } }, where res is indexed like
+        TrackEval's results, res[seq][class][metric][field], including res['COMBINED_SEQ'].
+    """
+    tracker_names = [tracker_name] if isinstance(tracker_name, str) else list(tracker_name)
+    eval_config = get_default_eval_config(quiet=quiet)
+    evaluations, work_items = load_evaluations(results_dir, anno_dir, metadata_dir, tracker_names, iou_thresh, cache, engine=engine, store_dir=store_dir)
+    seq_results = run_work_items(_eval_work_item, work_items, evaluations, workers)
+
+    results = {}
+    for location, evaluation in evaluations.items():
+        results[location] = {}
+        for tracker in tracker_names:
+            if not quiet:
+                print("\nMOT results on", location, "for", tracker)
+            res = {seq: seq_results[location, tracker, seq] for seq in sorted(evaluation['dataset'].seq_list)}
+            with profiling.span("combine", location=location, tracker=tracker):
+                results[location][tracker] = combine_results(res, evaluation, tracker, eval_config,
+                                                             evaluation['dataset'].get_output_fol(tracker))
+    return results
+
+def evaluate_shard(results_dir, anno_dir, metadata_dir, tracker_name, shard, shard_out, iou_thresh=0.5, workers=1, cache=None, engine='trackeval', store_dir=None):
+    """
+    Evaluate shard (i, N) of the work items of evaluate() (see get_shard), and write their
+    per-sequence results, with what merge() needs to combine them, to the pickle file shard_out.
+    """
+    tracker_names = [tracker_name] if isinstance(tracker_name, str) else list(tracker_name)
+    evaluations, work_items = load_evaluations(results_dir, anno_dir, metadata_dir, tracker_names, iou_thresh, cache, shard, engine, store_dir)
+    seq_results = run_work_items(_eval_work_item, work_items, evaluations, workers)
+
+    shard_results = {
+        'version': RESULTS_VERSION,
+        'shard': tuple(shard),
+        'trackers': tracker_names,
+        'locations': {
+            location : {
+                'seq_list': sorted(evaluation['dataset'].seq_list),
+                'class_list': evaluation['class_list'],
+                'metrics_config': evaluation['metrics_config'],
+            } for location, evaluation in evaluations.items() },
+        'seq_results': seq_results,
+    }
+    with open(shard_out, "wb") as f:
+        pickle.dump(shard_results, f, protocol=pickle.HIGHEST_PROTOCOL)
+    print("Wrote the results of", len(seq_results), "work items to", shard_out)
+
+def merge(shard_files, results_dir, quiet):
+    """
+    Combine the per-sequence results of all the shards written by evaluate_shard() into the
+    same results as evaluate(), printed and written to {results_dir}/{location}/{tracker}/.
+    Returns:
+        dict, { location -> { tracker -> res } }, as evaluate()
+    """
+    shards = []
+    for shard_file in shard_files:
+        with open(shard_file, "rb") as f:
+            shards.append(pickle.load(f))
+    first = shards[0]
+    num_shards = first['shard'][1]
+    for shard_file, shard in zip(shard_files, shards):
+        if shard['version'] != RESULTS_VERSION:
+            raise ValueError(f"{shard_file} was written by a different version of evaluate.py")
+        for key in ['trackers', 'locations']:
+            if shard[key] != first[key]:
+                raise ValueError(f"{shard_file} and {shard_files[0]} do not evaluate the same {key}")
+    shard_ids = sorted(shard['shard'] for shard in shards)
+    if shard_ids != [(i, num_shards) for i in range(num_shards)]:
+        raise ValueError(f"Expected each of the {num_shards} shards once, got " + ", ".join(f"{i}/{n}" for i, n in shard_ids))
+
+    seq_results = {}
+    for shard in shards:
+        seq_results.update(shard['seq_results'])
+    tracker_names = first['trackers']
+    eval_config = get_default_eval_config(quiet=quiet)
+    results = {}
+    for location, loc_info in first['locations'].items():
+        metrics_list = get_metrics_list(loc_info['metrics_config'])
+        evaluation = {
+            'class_list': loc_info['class_list'],
+            'metrics_list': metrics_list,
+            'metric_names': utils.validate_metrics_list(metrics_list),
+        }
+        results[location] = {}
+        for tracker in tracker_names:
+            if not quiet:
+                print("\nMOT results on", location, "for", tracker)
+            missing = [seq for seq in loc_info['seq_list'] if (location, tracker, seq) not in seq_results]
+            if missing:
+                raise ValueError(f"No results for {tracker} on {len(missing)} sequences of {location}, e.g. {missing[0]}")
+            res = {seq: seq_results[location, tracker, seq] for seq in loc_info['seq_list']}
+            with profiling.span("combine", location=location, tracker=tracker):
+                results[location][tracker] = combine_results(res, evaluation, tracker, eval_config,
+                                                             os.path.join(results_dir, location, tracker))
+    return results
+
+SWEEP_COLUMNS = ['location', 'tracker', 'metric', 'iou_thresh', 'filter_dist', 'field', 'value']
+# field of each metric printed by print_sweep
+SWEEP_HEADLINE_FIELDS = {'HOTA': 'HOTA', 'CLEAR': 'MOTA', 'Identity': 'IDF1', 'nMAE': 'nMAE'}
+
+def get_sweep_metrics(metrics_config, iou_threshs):
+    """
+    The TrackEval metrics of a sweep, as (metric, iou_thresh) pairs. CLEAR and Identity
+    are run once per IoU threshold. HOTA already integrates over IoU thresholds, so it
+    is run once, with iou_thresh None.
+    """
+    sweep_metrics = []
+    engine = METRIC_ENGINES[metrics_config.get('ENGINE', 'trackeval')]
+    if 'HOTA' in metrics_config['METRICS']:
+        sweep_metrics.append((engine['HOTA'](metrics_config), None))
+    for metric in [engine['CLEAR'], engine['Identity']]:
+        if metric.get_name() in metrics_config['METRICS']:
+            for iou_thresh in iou_threshs:
+                sweep_metrics.append((metric(dict(metrics_config, THRESHOLD=iou_thresh)), iou_thresh))
+    return sweep_metrics
+
+def _sweep_work_item(item):
+    """
+    Evaluate one (location, tracker, sequence) work item at every point of a sweep.
+    The sequence is loaded, and its similarity scores and track displacements computed, only once.
+    Returns: (item, { (metric_name, iou_thresh, filter_dist) -> res }, whether the results were cached)
+    """
+    location, tracker, seq = item
+    evaluation = _evaluations[location]
+    settings = ['sweep', get_metrics_settings([metric for metric, _ in evaluation['sweep_metrics']]), evaluation['filter_dists']]
+    with profiling.span("work_item", location=location, tracker=tracker, seq=seq) as span_args:
+        seq_res, span_args['cached'] = get_cached_result(evaluation, tracker, seq, settings, lambda: sweep_sequence(evaluation, tracker, seq))
+    return item, seq_res, span_args['cached']
+
+def sweep_sequence(evaluation, tracker, seq):
+    dataset = evaluation['dataset']
+    with profiling.span("raw_data"):
+        raw_data = dataset.get_raw_seq_data(tracker, seq)
+    # MotChallenge2DBox has a single class
+    with profiling.span("preprocess"):
+        data = dataset.get_preprocessed_seq_data(raw_data, evaluation['class_list'][0])
+
+    seq_res = {}
+    for metric, iou_thresh in evaluation['sweep_metrics']:
+        with profiling.span(metric.get_name() + ".eval_sequence", metric=metric.get_name(), iou_thresh=iou_thresh):
+            seq_res[metric.get_name(), iou_thresh, None] = metric.eval_sequence(data)
+    with profiling.span("nMAE.eval_sequence", metric="nMAE"):
+        for filter_dist, res in evaluation['nmae'].eval_sequence_sweep(data, evaluation['filter_dists']).items():
+            seq_res['nMAE', None, filter_dist] = res
+    return seq_res
+
+def sweep(results_dir, anno_dir, metadata_dir, tracker_name, iou_threshs=(0.5,), filter_dists=(0.05,), quiet=False, workers=1, cache=None, engine='trackeval', store_dir=None):
+    """
+    Evaluate one or more trackers at every IoU threshold in iou_threshs (CLEAR and Identity)
+    and every nMAE filter_dist in filter_dists, in a single pass over the sequences.
+    Returns:
+        list of dicts, a tidy table of the combined results with a row (see SWEEP_COLUMNS) per
+        location, tracker, metric, grid point and summary field. iou_thresh and filter_dist
+        are None for the metrics that do not use them.
+    """
+    tracker_names = [tracker_name] if isinstance(tracker_name, str) else list(tracker_name)
+    evaluations, work_items = load_evaluations(results_dir, anno_dir, metadata_dir, tracker_names, cache=cache, engine=engine, store_dir=store_dir)
+    for evaluation in evaluations.values():
+        evaluation['sweep_metrics'] = get_sweep_metrics(evaluation['metrics_config'], iou_threshs)
+        evaluation['nmae'] = nMAE(evaluation['metrics_config'])
+        evaluation['filter_dists'] = list(filter_dists)
+    seq_results = run_work_items(_sweep_work_item, work_items, evaluations, workers)
+
+    rows = []
+    for location, evaluation in evaluations.items():
+        metrics = {(metric.get_name(), iou_thresh, None): metric for metric, iou_thresh in evaluation['sweep_metrics']}
+        metrics.update({('nMAE', None, filter_dist): evaluation['nmae'] for filter_dist in evaluation['filter_dists']})
+        seq_list = sorted(evaluation['dataset'].seq_list)
+        for tracker in tracker_names:
+            for (metric_name, iou_thresh, filter_dist), metric in metrics.items():
+                key = (metric_name, iou_thresh, filter_dist)
+                combined = metric.combine_sequences({seq: seq_results[location, tracker, seq][key] for seq in seq_list})
+                for field in metric.summary_fields:
+                    # HOTA's array fields are summarized by their mean over alphas, as in its summary
+                    value = np.mean(combined[field]) if field in getattr(metric, 'float_array_fields', []) else combined[field]
+                    rows.append(dict(zip(SWEEP_COLUMNS, [location, tracker, metric_name, iou_thresh, filter_dist, field, value.item() if isinstance(value, np.generic) else value])))
+    if not quiet:
+        print_sweep(rows)
+    return rows
+
+def print_sweep(rows):
+    current = None
+    for row in rows:
+        if SWEEP_HEADLINE_FIELDS[row['metric']] != row['field']:
+            continue
+        if current != (row['location'], row['tracker']):
+            current = (row['location'], row['tracker'])
+            print(f"\n{row['location']}: {row['tracker']}")
+        param = f"iou_thresh={row['iou_thresh']}" if row['iou_thresh'] is not None else \
+                f"filter_dist={row['filter_dist']}" if row['filter_dist'] is not None else ""
+        print(f"{row['metric']:<10}{param:<20}{row['field']:<6}{row['value']:10.4f}")
+
+def write_sweep_table(rows, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SWEEP_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: "" if v is None else v for k, v in row.items()})
+
+def parse_shard(value):
+    """
+    Parse "i/N" into (i, N), for --shard
+    """
+    try:
+        i, num_shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if not 0 <= i < num_shards:
+        raise argparse.ArgumentTypeError(f"expected 0 <= i < N, got {value!r}")
+    return (i, num_shards)
+
+def merge_argument_parser():
+    parser = argparse.ArgumentParser(prog="evaluate.py merge", description="Combine the results of evaluate.py --shard i/N for every i.")
+    parser.add_argument("shards", nargs="+", help="Shard files written by evaluate.py --shard.")
+    parser.add_argument("--results_dir", default="results", help="Location of results directory. The combined results of each tracker are written to {results_dir}/{location_name}/{tracker}")
+    parser.add_argument("--quiet", action="store_true")
+    return parser
+
 def eval_argument_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("--results_dir", default="results", help="Location of results directory. Should contain subdirectories kenai-val, kenai-rightbank, etc.")
     parser.add_argument("--anno_dir", default="annotations", help="Location of ground truth annotations in MOTChallenge format.")
     parser.add_argument("--metadata_dir", default="metadata", help="Location of ground truth annotations in MOTChallenge format.")
-    parser.add_argument("--tracker", default="baseline", help="Name of tracker to evaluate. MOT results for each location should be in {results_dir}/{location_name}/{tracker}/data")
+    parser.add_argument("--tracker", default=["baseline"], nargs="+", help="Name of tracker(s) to evaluate. MOT results for each location should be in {results_dir}/{location_name}/{tracker}/data")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes to evaluate (location, tracker, sequence) work items in parallel.")
+    parser.add_argument("--count_only", action="store_true", help="Only compute counts and nMAE, with nmae.py and without importing TrackEval. Takes nmae.py's arguments instead of the ones below.")
+    parser.add_argument("--sweep_iou", type=float, nargs="+", default=None, help="Sweep: IoU thresholds of the CLEAR and Identity metrics.")
+    parser.add_argument("--sweep_filter_dist", type=float, nargs="+", default=None, help="Sweep: nMAE minimum track distances.")
+    parser.add_argument("--sweep_out", default="sweep.csv", help="Sweep: CSV file of the results, one row per location, tracker, metric, threshold and field.")
+    parser.add_argument("--shard", type=parse_shard, default=None, help="Only evaluate shard i/N (0-indexed) of the work items, and write their per-sequence results to --shard_out. Combine all N shards with 'evaluate.py merge'.")
+    parser.add_argument("--shard_out", default=None, help="Shard: file of the per-sequence results (default: shard_{i}_of_{N}.pkl).")
+    parser.add_argument("--profile", default=None, help="Record the time and peak memory of every stage of the evaluation, and write them to this JSON file (see profiling.py).")
+    parser.add_argument("--profile_trace", default=None, help="Also write the recorded stages to this file in the Chrome trace event format.")
+    parser.add_argument("--profile_memory", action="store_true", help="Also record the peak memory of every stage, with tracemalloc. This slows the evaluation down many times over.")
+    parser.add_argument("--engine", choices=sorted(METRIC_ENGINES), default="trackeval", help="Implementation of the HOTA, CLEAR and Identity metrics: TrackEval's (default), or this file's vectorized one ('fast'). Both give the same results.")
+    parser.add_argument("--anno_store", default=None, help="Directory of an annotation store of --anno_dir built by anno_store.py, to read the ground truth from instead of parsing it.")
     parser.add_argument("--quiet", action="store_true")
+    add_cache_arguments(parser)
     return parser
 
 if __name__ == "__main__":
-    args = eval_argument_parser().parse_args()
-    evaluate(args.results_dir, args.anno_dir, args.metadata_dir, args.tracker, args.quiet)
+    if sys.argv[1:2] == ["merge"]:
+        args = merge_argument_parser().parse_args(sys.argv[2:])
+        merge(args.shards, args.results_dir, args.quiet)
+        sys.exit(0)
+    parser = eval_argument_parser()
+    args = parser.parse_args()
+    if args.shard and (args.sweep_iou or args.sweep_filter_dist):
+        parser.error("--shard does not support sweeps")
+    if args.profile_memory and not (args.profile or args.profile_trace):
+        parser.error("--profile_memory needs --profile or --profile_trace")
+    cache = get_cache(args)
+    if args.profile or args.profile_trace:
+        profiling.enable(trace_memory=args.profile_memory)
+    if args.shard:
+        shard_out = args.shard_out or "shard_{}_of_{}.pkl".format(*args.shard)
+        evaluate_shard(args.results_dir, args.anno_dir, args.metadata_dir, args.tracker, args.shard, shard_out,
+                       workers=args.workers, cache=cache, engine=args.engine, store_dir=args.anno_store)
+    elif args.sweep_iou or args.sweep_filter_dist:
+        rows = sweep(args.results_dir, args.anno_dir, args.metadata_dir, args.tracker, args.sweep_iou or [0.5],
+                     args.sweep_filter_dist or [0.05], args.quiet, args.workers, cache, args.engine, args.anno_store)
+        write_sweep_table(rows, args.sweep_out)
+        print("Wrote", len(rows), "rows to", args.sweep_out)
+    else:
+        evaluate(args.results_dir, args.anno_dir, args.metadata_dir, args.tracker, args.quiet, workers=args.workers, cache=cache,
+                 engine=args.engine, store_dir=args.anno_store)
+    if args.profile or args.profile_trace:
+        profiling.write_report(args.profile, args.profile_trace)
@@ -0,0 +1,223 @@
+'''
+mot_cache.py
+
+Persistent on-disk cache of parsed MOT files, and of per-sequence evaluation results,
+for evaluate.py and nmae.py.
+
+Every parsed file is stored as an uncompressed .npz of NumPy arrays, named by the SHA-1
+of the file's contents and by what it was parsed into (its kind), so a file that is
+touched, copied or moved is not parsed again. A small stat record per path remembers
+the size, mtime and content hash of each file, so unchanged files are found without
+reading them. The cache is capped in size, and the least recently used entries are
+evicted first.
+
+Evaluation results are pickled under a key computed by the caller from the content
+hashes of the files and the evaluation settings (see evaluate.get_result_key).
+
+Entries and stat records are written atomically and never modified, so several
+processes (e.g. evaluate.py --workers) can share a cache directory.
+'''
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "caltech-fish-counting", "mot")
+DEFAULT_MAX_BYTES = 1024 * 2**20
+# part of every entry name, to be increased when the stored arrays change
+CACHE_VERSION = 1
+# stat records of files modified this recently are not saved, since a second
+# modification within the mtime resolution would go unnoticed
+RACY_SECONDS = 2
+
+
+def add_cache_arguments(parser):
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR, help="Directory of the cache of parsed MOT files.")
+    parser.add_argument("--cache_size", type=int, default=DEFAULT_MAX_BYTES // 2**20, help="Maximum size of the cache of parsed MOT files, in MB.")
+    parser.add_argument("--no_cache", action="store_true", help="Parse every MOT file, without the cache.")
+
+def get_cache(args):
+    '''
+    The ParseCache given by the add_cache_arguments arguments, or None
+    '''
+    if args.no_cache:
+        return None
+    return ParseCache(args.cache_dir, args.cache_size * 2**20)
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class ParseCache:
+    '''
+    Cache of { name -> array } dicts parsed from files, and of results, in cache_dir, of at most max_bytes.
+    '''
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # size of the entries, counted on the first write and updated by this process after that
+        self.total_bytes = None
+        self.entry_dir = os.path.join(cache_dir, "entries")
+        self.stat_dir = os.path.join(cache_dir, "stat")
+        os.makedirs(self.entry_dir, exist_ok=True)
+        os.makedirs(self.stat_dir, exist_ok=True)
+
+    def _stat_path(self, path):
+        return os.path.join(self.stat_dir, hashlib.sha1(os.path.abspath(path).encode()).hexdigest() + ".json")
+
+    def _entry_path(self, digest, kind):
+        return os.path.join(self.entry_dir, f"{digest}-{kind}-v{CACHE_VERSION}.npz")
+
+    def get_digest(self, path):
+        '''
+        The content hash of path, from its stat record if its size and mtime have not changed
+        '''
+        st = os.stat(path)
+        stat_path = self._stat_path(path)
+        try:
+            with open(stat_path, "r") as f:
+                record = json.load(f)
+            if record['size'] == st.st_size and record['mtime_ns'] == st.st_mtime_ns:
+                return record['sha1']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        digest = file_digest(path)
+        if time.time() - st.st_mtime > RACY_SECONDS:
+            self._write_atomic(stat_path, lambda f: f.write(json.dumps(
+                { 'path': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': digest }).encode()))
+        return digest
+
+    def get(self, path, kind, parse):
+        '''
+        The arrays parsed from path, from the cache, or by parse(path) if they are not cached yet.
+        Args:
+            path: file to parse
+            kind: name of what parse returns, e.g. "rows". Include anything else its output depends on.
+            parse: function of path, returning a dict of { name -> np.ndarray }
+        '''
+        entry_path = self._entry_path(self.get_digest(path), kind)
+        try:
+            with np.load(entry_path, allow_pickle=False) as entry:
+                arrays = { name: entry[name] for name in entry.files }
+            # the entry's mtime is its last use, for LRU eviction
+            os.utime(entry_path)
+            return arrays
+        except (OSError, ValueError):
+            pass
+
+        arrays = parse(path)
+        self._write_atomic(entry_path, lambda f: np.savez(f, **arrays))
+        self._added(entry_path)
+        return arrays
+
+    def _result_path(self, key):
+        return os.path.join(self.entry_dir, f"{key}-result-v{CACHE_VERSION}.pkl")
+
+    def get_result(self, key):
+        '''
+        The result stored under key by put_result, or None
+        '''
+        result_path = self._result_path(key)
+        try:
+            with open(result_path, "rb") as f:
+                result = pickle.load(f)
+            os.utime(result_path)
+            return result
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put_result(self, key, result):
+        result_path = self._result_path(key)
+        self._write_atomic(result_path, lambda f: pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL))
+        self._added(result_path)
+
+    def _added(self, path):
+        if self.total_bytes is None:
+            self.evict()
+        else:
+            self.total_bytes += os.path.getsize(path)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        '''
+        Delete the least recently used entries until the cache is at most max_bytes
+        '''
+        entries = []
+        for entry in os.scandir(self.entry_dir):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.total_bytes = total
+
+    def _write_atomic(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+def flatten_timesteps(raw_data):
+    '''
+    Pack the per-timestep lists of arrays (or of dicts of arrays) of raw_data into a dict of
+    flat arrays: for each key, the concatenation of its non-empty arrays, their lengths, and
+    an empty template. Other values (e.g. 'seq') are not kept.
+    '''
+    arrays = {}
+    for key, values in raw_data.items():
+        if not isinstance(values, list):
+            continue
+        if isinstance(values[0], dict):
+            arrays.update(flatten_timesteps({ f"{key}.{name}" : [value[name] for value in values] for name in values[0] }))
+            continue
+        lengths = np.array([len(value) for value in values], dtype=np.int64)
+        non_empty = [value for value in values if len(value)]
+        empty = next((value for value in values if not len(value)), np.empty((0,) + values[0].shape[1:], values[0].dtype))
+        arrays[f"{key}:data"] = np.concatenate(non_empty) if non_empty else empty
+        arrays[f"{key}:lengths"] = lengths
+        arrays[f"{key}:empty"] = empty
+    return arrays
+
+def unflatten_timesteps(arrays):
+    '''
+    Inverse of flatten_timesteps
+    '''
+    raw_data = {}
+    for name in arrays:
+        if not name.endswith(":lengths"):
+            continue
+        key = name[:-len(":lengths")]
+        data, lengths, empty = arrays[f"{key}:data"], arrays[name], arrays[f"{key}:empty"]
+        values = []
+        start = 0
+        for length in lengths:
+            values.append(data[start:start + length] if length else empty.copy())
+            start += length
+        if "." in key:
+            key, sub_key = key.split(".", 1)
+            raw_data.setdefault(key, [{} for _ in values])
+            for value_dict, value in zip(raw_data[key], values):
+                value_dict[sub_key] = value
+        else:
+            raw_data[key] = values
+    return raw_data
@@ -0,0 +1,233 @@
+'''
+nmae.py
+
+Count-only evaluation: left/right fish counts and nMAE for every clip and location,
+from the same MOT files as evaluate.py but without TrackEval. Files are parsed with
+NumPy and every track's first and last box is found with one sort, so this is much
+faster than running the full evaluation when only nMAE is needed. Counts and nMAE
+are identical to the nMAE metric in evaluate.py.
+
+Input:
+    - results_dir, anno_dir, metadata_dir, tracker: as for evaluate.py (one or more trackers)
+    - filter_dist: (optional) normalized minimum distance between the first and last
+                   center of a track to be counted (default: 0.05)
+    - per_sequence: (optional) also print the counts of every clip
+    - cache_dir, cache_size, no_cache: (optional) cache of parsed files, see mot_cache.py
+
+Example command:
+python nmae.py --results_dir PATH/TO/results --anno_dir PATH/TO/annotations --metadata_dir PATH/TO/metadata --tracker baseline
+'''
+
+import argparse
+import json
+import os
+import numpy as np
+
+import mot_cache
+
+# metadata files of the locations that are evaluated, as in evaluate.get_meta
+LOCATIONS = ['kenai-val', 'kenai-rightbank', 'kenai-channel', 'nushagak', 'elwha']
+
+
+def parse_mot_file(path):
+    '''
+    Parse a MOT text file (comma or space separated) into a (N, C) float64 array,
+    one row per line. Empty files give a (0, 10) array.
+    '''
+    with open(path, "r") as f:
+        lines = [line for line in f.read().replace(',', ' ').splitlines() if line.strip()]
+    if not lines:
+        return np.empty((0, 10))
+    num_cols = len(lines[0].split())
+    values = np.array(" ".join(lines).split(), dtype=np.float64)
+    if len(values) != len(lines) * num_cols:
+        raise ValueError(f"{path} does not have {num_cols} columns on every line")
+    return values.reshape(len(lines), num_cols)
+
+def load_mot_file(path, cache=None):
+    '''
+    parse_mot_file, through a mot_cache.ParseCache if cache is given
+    '''
+    if cache is None:
+        return parse_mot_file(path)
+    return cache.get(path, "rows", lambda p: { 'rows': parse_mot_file(p) })['rows']
+
+def get_track_ends(ids, frames=None):
+    '''
+    Indices of the first and last detection of every track, in track id order.
+    Detections are assumed to be in time order unless their frames are given.
+    Stable sorts keep file order within a frame, like the per-frame lists TrackEval builds.
+    '''
+    order = np.argsort(ids, kind='stable') if frames is None else np.lexsort((frames, ids))
+    sorted_ids = ids[order]
+    is_first = np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]
+    is_last = np.r_[is_first[1:], True]
+    return order[is_first], order[is_last]
+
+def norm_boxes(boxes, w, h):
+    '''
+    Vectorized evaluate.norm: (N, 4) [x,y,w,h] 1-indexed boxes to normalized, 0-indexed.
+    '''
+    return np.stack([(boxes[:, 0] - 1) / w, (boxes[:, 1] - 1) / h, boxes[:, 2] / w, boxes[:, 3] / h], axis=1)
+
+def get_displacements(start, end):
+    '''
+    First and last center x of each of K tracks, and the distance between their centers.
+    Args:
+        start, end: (K, 4) arrays, the first and last normalized [x,y,w,h] box of each track
+    Return:
+        tuple of (K,) arrays, (x0, x1, dist)
+    '''
+    # get centers (boxes are [x,y,w,h])
+    x0 = start[:, 0] + (start[:, 2] / 2.0)
+    x1 = end[:, 0] + (end[:, 2] / 2.0)
+    y0 = start[:, 1] + (start[:, 3] / 2.0)
+    y1 = end[:, 1] + (end[:, 3] / 2.0)
+    return x0, x1, np.sqrt((x1 - x0)**2 + (y1 - y0)**2)
+
+def count_displacements(x0, x1, dist, filter_dist=0.05):
+    '''
+    Count the tracks that cross the middle of the frame. Displacements can be
+    computed once and counted for any number of filter_dist values.
+    Args:
+        x0, x1, dist: (K,) arrays from get_displacements
+        filter_dist: float, normalized minimum distance to be considered a valid track.
+    Return:
+        tuple, (right_count, left_count)
+    '''
+    # filter out stationary fish
+    valid = ~(dist < filter_dist) if filter_dist > 0 else np.ones(len(dist), dtype=bool)
+    right = np.count_nonzero(valid & (x0 < 0.5) & (x1 >= 0.5))
+    left = np.count_nonzero(valid & (x0 >= 0.5) & (x1 < 0.5))
+    return (int(right), int(left))
+
+def count_normalized(start, end, filter_dist=0.05):
+    '''
+    Count the tracks that cross the middle of the frame, from their first and last
+    normalized [x,y,w,h] boxes, (K, 4) arrays start and end.
+    Return:
+        tuple, (right_count, left_count)
+    '''
+    return count_displacements(*get_displacements(start, end), filter_dist)
+
+def get_track_displacements(ids, boxes, w, h, frames=None):
+    '''
+    get_displacements of the tracks of N detections.
+    Args:
+        ids: (N,) track ids
+        boxes: (N, 4) [x,y,w,h] 1-indexed boxes
+        w, h: image width and height
+        frames: (optional) (N,) frame of every detection, if they are not in time order
+    '''
+    if not len(ids):
+        return np.empty(0), np.empty(0), np.empty(0)
+    first, last = get_track_ends(ids, frames)
+    return get_displacements(norm_boxes(boxes[first], w, h), norm_boxes(boxes[last], w, h))
+
+def count_detections(ids, boxes, w, h, filter_dist=0.05, frames=None):
+    '''
+    Count the tracks of N detections (see get_track_displacements).
+    Return:
+        tuple, (right_count, left_count)
+    '''
+    return count_displacements(*get_track_displacements(ids, boxes, w, h, frames), filter_dist)
+
+def count_tracks(rows, w, h, filter_dist=0.05):
+    '''
+    Count the tracks of the (N, C) rows of a MOT file, [frame, id, x, y, w, h, ...]
+    '''
+    return count_detections(rows[:, 1].astype(np.int64), rows[:, 2:6], w, h, filter_dist, frames=rows[:, 0])
+
+def load_sequence(gt_fp, pred_fp, num_frames, cache=None):
+    '''
+    The ground truth and predicted rows of a clip. Ground truth rows whose confidence
+    column is 0 as an integer are ignored, like TrackEval's zero_marked preprocessing.
+    '''
+    gt_rows = load_mot_file(gt_fp, cache)
+    gt_rows = gt_rows[gt_rows[:, 6].astype(int) != 0]
+    pred_rows = load_mot_file(pred_fp, cache)
+    for fp, rows in ((gt_fp, gt_rows), (pred_fp, pred_rows)):
+        if len(rows) and (rows[:, 0].min() < 1 or rows[:, 0].max() > num_frames):
+            raise ValueError(f"{fp} has frames outside 1-{num_frames}")
+    return gt_rows, pred_rows
+
+def eval_sequence_counts(gt_rows, pred_rows, w, h, filter_dist=0.05):
+    '''
+    Counts and nMAE fields of one clip, as nMAE.eval_sequence returns them
+    '''
+    gt_right, gt_left = count_tracks(gt_rows, w, h, filter_dist)
+    pred_right, pred_left = count_tracks(pred_rows, w, h, filter_dist)
+    return {
+        'gt_right': gt_right, 'gt_left': gt_left,
+        'pred_right': pred_right, 'pred_left': pred_left,
+        'nMAE_numer': abs(pred_right - gt_right) + abs(pred_left - gt_left),
+        'nMAE_denom': gt_right + gt_left,
+        'nMAE': -1 # no per-sequence nMAE
+    }
+
+def evaluate_counts(results_dir, anno_dir, metadata_dir, tracker_name, filter_dist=0.05, quiet=False, per_sequence=False, cache=None):
+    '''
+    Count-only evaluation of a tracker on every location.
+    Parsed files are kept in cache, a mot_cache.ParseCache, if given.
+    Returns:
+        dict, { location -> { 'sequences': { clip -> counts }, 'nMAE_numer', 'nMAE_denom', 'nMAE' } }
+    '''
+    results = {}
+    for location in LOCATIONS:
+        with open(os.path.join(metadata_dir, location + ".json"), "r") as f:
+            clips = { c['clip_name'] : c for c in json.load(f) }
+
+        sequences = {}
+        for seq in sorted(clips):
+            gt_fp = os.path.join(anno_dir, location, seq, "gt.txt")
+            pred_fp = os.path.join(results_dir, location, tracker_name, "data", seq + ".txt")
+            gt_rows, pred_rows = load_sequence(gt_fp, pred_fp, clips[seq]['num_frames'], cache)
+            sequences[seq] = eval_sequence_counts(gt_rows, pred_rows, clips[seq]['width'], clips[seq]['height'], filter_dist)
+
+        nmae_top = sum([res['nMAE_numer'] for res in sequences.values()])
+        nmae_bot = sum([res['nMAE_denom'] for res in sequences.values()])
+        results[location] = {
+            'sequences': sequences,
+            'nMAE_numer': nmae_top,
+            'nMAE_denom': nmae_bot,
+            'nMAE': nmae_top / nmae_bot
+        }
+        if not quiet:
+            print_counts(location, tracker_name, results[location], per_sequence)
+    return results
+
+def print_counts(location, tracker_name, loc_res, per_sequence=False):
+    print(f"\n{location}: {tracker_name}")
+    print(f"{'':<60}{'GT right':>10}{'GT left':>10}{'right':>10}{'left':>10}{'numer':>10}{'denom':>10}")
+    if per_sequence:
+        for seq, res in loc_res['sequences'].items():
+            print(f"{seq:<60}{res['gt_right']:>10}{res['gt_left']:>10}{res['pred_right']:>10}{res['pred_left']:>10}"
+                  f"{res['nMAE_numer']:>10}{res['nMAE_denom']:>10}")
+    totals = {key: sum(res[key] for res in loc_res['sequences'].values()) for key in ['gt_right', 'gt_left', 'pred_right', 'pred_left']}
+    print(f"{'COMBINED':<60}{totals['gt_right']:>10}{totals['gt_left']:>10}{totals['pred_right']:>10}{totals['pred_left']:>10}"
+          f"{loc_res['nMAE_numer']:>10}{loc_res['nMAE_denom']:>10}")
+    print(f"nMAE: {loc_res['nMAE']:.4f}")
+
+def argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results_dir", default="results", help="Location of results directory. Should contain subdirectories kenai-val, kenai-rightbank, etc.")
+    parser.add_argument("--anno_dir", default="annotations", help="Location of ground truth annotations in MOTChallenge format.")
+    parser.add_argument("--metadata_dir", default="metadata", help="Location of the metadata JSON file of every location.")
+    parser.add_argument("--tracker", default=["baseline"], nargs="+", help="Name of tracker(s) to evaluate. MOT results for each location should be in {results_dir}/{location_name}/{tracker}/data")
+    parser.add_argument("--filter_dist", type=float, default=0.05, help="Normalized minimum distance a track must move to be counted.")
+    parser.add_argument("--per_sequence", action="store_true", help="Print the counts of every clip.")
+    parser.add_argument("--quiet", action="store_true")
+    mot_cache.add_cache_arguments(parser)
+    return parser
+
+def main(argv=None):
+    '''
+    Count every --tracker of the command line argv (default: sys.argv), also used by evaluate.py --count_only
+    '''
+    args = argument_parser().parse_args(argv)
+    cache = mot_cache.get_cache(args)
+    for tracker in args.tracker:
+        evaluate_counts(args.results_dir, args.anno_dir, args.metadata_dir, tracker, args.filter_dist, args.quiet, args.per_sequence, cache)
+
+if __name__ == "__main__":
+    main()
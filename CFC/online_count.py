@@ -0,0 +1,259 @@
+'''
+online_count.py
+
+Streaming left/right fish counts from tracker output, for counting while the sonar
+is running instead of after a clip ends. OnlineCounter consumes the detections of
+each frame as they arrive and keeps state only for active tracks: the first and
+latest center of each track ID. A track is finished when its ID has not been seen
+for more than max_age frames, or when the stream ends (flush). It is then counted
+with the same rule as the nMAE metric (nMAE.count in evaluate.py): it moved right
+if its first center is left of the middle of the frame and its last center is not,
+and vice versa, and it is only counted if its first and last centers are at least
+filter_dist apart (normalized). Each count is emitted as a CountEvent.
+
+On a complete clip, the counts are identical to nMAE.count's as long as no track ID
+has a gap of more than max_age frames between two of its detections. An ID seen
+again after it expired is counted as a new track.
+
+Input:
+    - mot_file: MOT file of tracker output, in frame order (as a tracker writes it)
+    - width, height: frame size of the clip
+    - filter_dist: (optional) normalized minimum distance between the first and last
+                   center of a track to be counted (default: 0.05)
+    - max_age: (optional) frames after which a track that has not been seen is counted (default: 30)
+    - follow: (optional) keep reading lines appended to mot_file, like tail -f, until interrupted;
+              the rows read until then are counted
+
+Example command:
+python online_count.py --mot_file PATH/TO/results/elwha/baseline/data/CLIP_NAME.txt --width 600 --height 1000
+'''
+
+import argparse
+from collections import OrderedDict, namedtuple
+import math
+import time
+import numpy as np
+
+DEFAULT_MAX_AGE = 30
+
+# a counted track: direction is 'right' or 'left', frame is the frame it was counted at
+CountEvent = namedtuple('CountEvent', ['frame', 'track_id', 'direction', 'first_frame', 'last_frame'])
+
+
+class ActiveTrack:
+    '''
+    First and latest normalized center of a track, and the frames they were seen in
+    '''
+    __slots__ = ('track_id', 'x0', 'y0', 'x1', 'y1', 'first_frame', 'last_frame')
+
+    def __init__(self, track_id, x, y, frame):
+        self.track_id = track_id
+        self.x0 = self.x1 = x
+        self.y0 = self.y1 = y
+        self.first_frame = self.last_frame = frame
+
+    def direction(self, filter_dist):
+        '''
+        'right', 'left' or None, as nmae.count_displacements counts the track
+        '''
+        dx = self.x1 - self.x0
+        dy = self.y1 - self.y0
+        if filter_dist > 0 and math.sqrt(dx * dx + dy * dy) < filter_dist:
+            return None
+        if self.x0 < 0.5 and self.x1 >= 0.5:
+            return 'right'
+        if self.x0 >= 0.5 and self.x1 < 0.5:
+            return 'left'
+        return None
+
+class OnlineCounter:
+    '''
+    Incremental left/right counts of the tracks of one clip (see the module docstring).
+    Frames must be given in non-decreasing order.
+    '''
+
+    def __init__(self, width, height, filter_dist=0.05, max_age=DEFAULT_MAX_AGE):
+        self.width = width
+        self.height = height
+        self.filter_dist = filter_dist
+        self.max_age = max_age
+        self.right = 0
+        self.left = 0
+        self.frame = None
+        # { track id -> ActiveTrack }, least recently seen first
+        self.tracks = OrderedDict()
+
+    @property
+    def counts(self):
+        '''
+        (right_count, left_count) of the tracks finished so far
+        '''
+        return (self.right, self.left)
+
+    def live_counts(self):
+        '''
+        (right_count, left_count) if the stream ended now: the finished tracks, and the
+        active tracks that have crossed so far
+        '''
+        right, left = self.right, self.left
+        for track in self.tracks.values():
+            direction = track.direction(self.filter_dist)
+            right += direction == 'right'
+            left += direction == 'left'
+        return (right, left)
+
+    def _finish(self, track, frame, events):
+        direction = track.direction(self.filter_dist)
+        if direction == 'right':
+            self.right += 1
+        elif direction == 'left':
+            self.left += 1
+        if direction is not None:
+            events.append(CountEvent(frame, track.track_id, direction, track.first_frame, track.last_frame))
+
+    def advance(self, frame):
+        '''
+        Move the stream to frame, counting the tracks that have not been seen for more than max_age frames.
+        Returns:
+            list of CountEvent
+        '''
+        if self.frame is not None and frame < self.frame:
+            raise ValueError(f"Frame {frame} is before frame {self.frame}")
+        self.frame = frame
+        events = []
+        if self.max_age is not None:
+            while self.tracks:
+                track = next(iter(self.tracks.values()))
+                if frame - track.last_frame <= self.max_age:
+                    break
+                del self.tracks[track.track_id]
+                self._finish(track, frame, events)
+        return events
+
+    def update(self, frame, ids, boxes):
+        '''
+        Add the detections of a frame.
+        Args:
+            frame: frame number
+            ids: (N,) track ids
+            boxes: (N, 4) [x,y,w,h] 1-indexed boxes, in pixels
+        Returns:
+            list of CountEvent of the tracks finished by this frame
+        '''
+        events = self.advance(frame)
+        if not len(ids):
+            return events
+        boxes = np.asarray(boxes, dtype=float)
+        # centers of the boxes, normalized as nmae.norm_boxes
+        xs = ((boxes[:, 0] - 1) / self.width + (boxes[:, 2] / self.width) / 2.0).tolist()
+        ys = ((boxes[:, 1] - 1) / self.height + (boxes[:, 3] / self.height) / 2.0).tolist()
+        tracks = self.tracks
+        for track_id, x, y in zip(np.asarray(ids).tolist(), xs, ys):
+            track = tracks.get(track_id)
+            if track is None:
+                tracks[track_id] = ActiveTrack(track_id, x, y, frame)
+            else:
+                track.x1 = x
+                track.y1 = y
+                track.last_frame = frame
+                tracks.move_to_end(track_id)
+        return events
+
+    def flush(self):
+        '''
+        End the stream, counting every active track.
+        Returns:
+            list of CountEvent
+        '''
+        events = []
+        for track in self.tracks.values():
+            self._finish(track, self.frame, events)
+        self.tracks.clear()
+        return events
+
+def count_rows_online(rows, w, h, filter_dist=0.05, max_age=DEFAULT_MAX_AGE):
+    '''
+    Stream the (N, C) rows of a MOT file, [frame, id, x, y, w, h, ...], through an
+    OnlineCounter frame by frame, as nmae.count_tracks counts them offline.
+    Rows are put in frame order, keeping file order within a frame.
+    Returns:
+        tuple, ((right_count, left_count), list of CountEvent)
+    '''
+    counter = OnlineCounter(w, h, filter_dist, max_age)
+    rows = rows[np.argsort(rows[:, 0], kind='stable')]
+    frames = rows[:, 0].astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, frames[1:] != frames[:-1]]) if len(rows) else []
+    ends = np.r_[starts[1:], len(rows)] if len(rows) else []
+    events = []
+    for start, end in zip(starts, ends):
+        events += counter.update(int(frames[start]), rows[start:end, 1].astype(np.int64), rows[start:end, 2:6])
+    events += counter.flush()
+    return counter.counts, events
+
+def follow_lines(f, poll_interval=0.5):
+    '''
+    The lines of file f, waiting for new lines to be appended at its end
+    '''
+    buffer = ""
+    while True:
+        line = f.readline()
+        if not line:
+            time.sleep(poll_interval)
+            continue
+        buffer += line
+        if buffer.endswith("\n"):
+            yield buffer
+            buffer = ""
+
+def stream_mot_file(path, counter, follow=False, on_event=print):
+    '''
+    Feed the rows of a MOT file in frame order to counter, one frame at a time, calling
+    on_event with every CountEvent. With follow, keep waiting for appended lines.
+    An interrupt (Ctrl-C) ends the stream as if the file ended there: the rows read
+    so far, including those of the last frame, are counted.
+    '''
+    frame, ids, boxes = None, [], []
+    try:
+        with open(path, "r") as f:
+            lines = follow_lines(f) if follow else f
+            for line in lines:
+                values = line.replace(',', ' ').split()
+                if not values:
+                    continue
+                row_frame = int(float(values[0]))
+                if row_frame != frame and frame is not None:
+                    for event in counter.update(frame, ids, np.array(boxes).reshape(-1, 4)):
+                        on_event(event)
+                    ids, boxes = [], []
+                frame = row_frame
+                box = [float(value) for value in values[2:6]]
+                ids.append(int(float(values[1])))
+                boxes.append(box)
+    except KeyboardInterrupt:
+        pass
+    if frame is not None:
+        # an interrupt can land between the two appends
+        num_rows = min(len(ids), len(boxes))
+        for event in counter.update(frame, ids[:num_rows], np.array(boxes[:num_rows]).reshape(-1, 4)):
+            on_event(event)
+    for event in counter.flush():
+        on_event(event)
+
+def argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mot_file", required=True, help="MOT file of tracker output, in frame order.")
+    parser.add_argument("--width", type=int, required=True, help="Frame width of the clip, in pixels.")
+    parser.add_argument("--height", type=int, required=True, help="Frame height of the clip, in pixels.")
+    parser.add_argument("--filter_dist", type=float, default=0.05, help="Normalized minimum distance a track must move to be counted.")
+    parser.add_argument("--max_age", type=int, default=DEFAULT_MAX_AGE, help="Number of frames after which a track that has not been seen is counted.")
+    parser.add_argument("--follow", action="store_true", help="Keep reading lines appended to --mot_file until interrupted.")
+    parser.add_argument("--quiet", action="store_true", help="Only print the final counts, not every count event.")
+    return parser
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
+    counter = OnlineCounter(args.width, args.height, args.filter_dist, args.max_age)
+    on_event = (lambda event: None) if args.quiet else \
+        (lambda event: print(f"frame {event.frame}: track {event.track_id} {event.direction} (frames {event.first_frame}-{event.last_frame})", flush=True))
+    stream_mot_file(args.mot_file, counter, args.follow, on_event)
+    print(f"right: {counter.right}, left: {counter.left}")
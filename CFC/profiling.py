@@ -0,0 +1,203 @@
+'''
+profiling.py
+
+Opt-in instrumentation of evaluate.py: the wall time and peak memory of every stage
+of the evaluation (loading files, computing similarities, preprocessing, each metric's
+eval_sequence and combine_sequences, writing outputs), for every location, tracker and
+clip. Like trackeval._timing, it is enabled for the whole process, and every span is
+a no-op when it is not.
+
+Spans nest: each span inherits the location, tracker, seq and metric of the span it is
+in, and records its duration and its self time (without the spans nested in it). Self
+times add up without double counting, so they are what the report sums by stage,
+location, clip and metric. With trace_memory, spans also record the peak memory allocated
+during them above the memory in use when they started. This uses tracemalloc, which
+slows the evaluation down many times over, and not evenly across stages, so memory
+and times are best measured in separate runs.
+
+The report is written as JSON, and optionally in the Chrome trace event format, which
+can be opened in chrome://tracing or https://ui.perfetto.dev.
+
+Example command:
+python evaluate.py --results_dir PATH/TO/results --anno_dir PATH/TO/annotations --metadata_dir PATH/TO/metadata --tracker baseline --profile profile.json --profile_trace trace.json
+python evaluate.py --results_dir PATH/TO/results --anno_dir PATH/TO/annotations --metadata_dir PATH/TO/metadata --tracker baseline --profile memory.json --profile_memory
+'''
+
+from contextlib import contextmanager
+import json
+import os
+import time
+import tracemalloc
+
+# the active Profiler, set by enable()
+_profiler = None
+
+
+class Profiler:
+    '''
+    Spans recorded in this process, timed from origin (a time.perf_counter_ns(), which
+    is shared by the processes of a pool on the same machine).
+    '''
+
+    def __init__(self, trace_memory=False, origin=None):
+        self.trace_memory = trace_memory
+        self.origin = time.perf_counter_ns() if origin is None else origin
+        self.events = []
+        self.stack = []
+
+    def fork(self):
+        '''
+        An empty Profiler with the same settings and origin, for a worker process
+        '''
+        return Profiler(self.trace_memory, self.origin)
+
+    @contextmanager
+    def span(self, name, **args):
+        parent = self.stack[-1] if self.stack else None
+        frame = { 'args': dict(parent['args']) if parent else {}, 'child_time': 0, 'memory': 0, 'peak': 0 }
+        frame['args'].update(args)
+        if self.trace_memory:
+            memory, peak = tracemalloc.get_traced_memory()
+            # the parent's peak so far, before this span starts measuring its own
+            if parent:
+                parent['peak'] = max(parent['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['memory'] = frame['peak'] = memory
+        self.stack.append(frame)
+        start = time.perf_counter_ns()
+        try:
+            # the caller can add arguments known at the end of the span, e.g. whether results were cached
+            yield frame['args']
+        finally:
+            duration = time.perf_counter_ns() - start
+            self.stack.pop()
+            if self.trace_memory:
+                frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            if parent:
+                parent['child_time'] += duration
+                parent['peak'] = max(parent['peak'], frame['peak'])
+            self.events.append({
+                'name': name,
+                'start': (start - self.origin) / 1e9,
+                'duration': duration / 1e9,
+                'self_time': (duration - frame['child_time']) / 1e9,
+                'peak_memory': frame['peak'] - frame['memory'] if self.trace_memory else None,
+                'pid': os.getpid(),
+                'depth': len(self.stack),
+                **frame['args'],
+            })
+
+    def pop_events(self):
+        events, self.events = self.events, []
+        return events
+
+def enable(profiler=None, trace_memory=False):
+    '''
+    Record spans from now on, in profiler or a new Profiler(trace_memory).
+    '''
+    global _profiler
+    _profiler = profiler if profiler is not None else Profiler(trace_memory)
+    if _profiler.trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _profiler
+
+def disable():
+    global _profiler
+    if _profiler is not None and _profiler.trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _profiler = None
+
+def get_profiler():
+    '''
+    The active Profiler, or None
+    '''
+    return _profiler
+
+@contextmanager
+def span(name, **args):
+    '''
+    Record a span of the active Profiler around the block, if profiling is enabled.
+    Args:
+        name: stage, e.g. "preprocess" or "HOTA.eval_sequence"
+        args: location, tracker, seq, metric and anything else to record with it
+    '''
+    if _profiler is None:
+        yield args
+    else:
+        with _profiler.span(name, **args) as span_args:
+            yield span_args
+
+def summarize(events):
+    '''
+    Self time of the events by stage, location, clip and metric, slowest first.
+    '''
+    def add(totals, key, event):
+        total = totals.setdefault(key, { 'count': 0, 'self_time': 0.0, 'total_time': 0.0, 'max_time': 0.0, 'peak_memory': None })
+        total['count'] += 1
+        total['self_time'] += event['self_time']
+        total['total_time'] += event['duration']
+        total['max_time'] = max(total['max_time'], event['duration'])
+        if event['peak_memory'] is not None:
+            total['peak_memory'] = max(total['peak_memory'] or 0, event['peak_memory'])
+
+    summary = { 'by_stage': {}, 'by_location': {}, 'by_sequence': {}, 'by_metric': {} }
+    for event in events:
+        add(summary['by_stage'], event['name'], event)
+        if 'location' in event:
+            add(summary['by_location'], event['location'], event)
+            if 'seq' in event:
+                add(summary['by_sequence'], event['seq'], event)
+        if 'metric' in event:
+            add(summary['by_metric'], event['metric'], event)
+    return { key: dict(sorted(totals.items(), key=lambda item: -item[1]['self_time'])) for key, totals in summary.items() }
+
+def to_chrome_trace(events):
+    '''
+    The events as complete ("X") events of the Chrome trace event format, in microseconds
+    '''
+    trace_events = []
+    for event in events:
+        args = { key: value for key, value in event.items() if key not in ['name', 'start', 'duration', 'pid', 'depth'] }
+        trace_events.append({
+            'name': event['name'], 'cat': event['name'].split(".")[-1], 'ph': 'X',
+            'ts': event['start'] * 1e6, 'dur': event['duration'] * 1e6,
+            'pid': event['pid'], 'tid': event['pid'], 'args': args,
+        })
+    return { 'traceEvents': trace_events, 'displayTimeUnit': 'ms' }
+
+def print_summary(summary, num_rows=10):
+    print(f"\n{'Stage':<40}{'count':>8}{'self (s)':>12}{'total (s)':>12}{'peak (MB)':>12}")
+    for name, total in list(summary['by_stage'].items())[:num_rows]:
+        peak = f"{total['peak_memory'] / 2**20:>12.1f}" if total['peak_memory'] is not None else f"{'-':>12}"
+        print(f"{name:<40}{total['count']:>8}{total['self_time']:>12.3f}{total['total_time']:>12.3f}" + peak)
+    for key, title in [('by_location', 'Location'), ('by_sequence', 'Clip'), ('by_metric', 'Metric')]:
+        if summary[key]:
+            name, total = next(iter(summary[key].items()))
+            print(f"Slowest {title.lower()}: {name} ({total['self_time']:.3f} s)")
+
+def write_report(path=None, trace_path=None, quiet=False):
+    '''
+    Write the events recorded so far and their summary to path as JSON, and in the Chrome
+    trace event format to trace_path, if given.
+    Returns:
+        dict, { 'wall_time', 'trace_memory', 'summary', 'events' }
+    '''
+    events = sorted(_profiler.events, key=lambda event: (event['pid'], event['start']))
+    report = {
+        'wall_time': (time.perf_counter_ns() - _profiler.origin) / 1e9,
+        'trace_memory': _profiler.trace_memory,
+        'summary': summarize(events),
+        'events': events,
+    }
+    if path:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
+    if trace_path:
+        with open(trace_path, "w") as f:
+            json.dump(to_chrome_trace(events), f)
+    if not quiet:
+        print_summary(report['summary'])
+        for out in [path, trace_path]:
+            if out:
+                print("Wrote profile to", out)
+    return report
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the CFC modules and tools are scripts, imported from their directories
+cfc_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, cfc_dir)
+sys.path.insert(1, os.path.join(cfc_dir, "tools"))
@@ -0,0 +1,170 @@
+'''
+anno_store.py: the stored rows of every clip against nmae.parse_mot_file, range queries,
+and detection of stores that are out of date
+'''
+
+import json
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import anno_store
+import get_tiny_dataset
+import mot2yolo
+from nmae import parse_mot_file
+
+# clip -> lines of its gt.txt
+CLIPS = {
+    # CFC annotations: 10 columns, in frame order
+    'c10': ["1, 3, 794.27, 247.59, 71.245, 174.88, -1, -1, -1, -1",
+            "1, 6, 1648.1, 119.61, 66.504, 163.24, -1, -1, -1, -1",
+            "2, 3, 796.5, 248, 71.245, 174.88, -1, -1, -1, -1",
+            "4, 6, 1650.125, 120.0001, 66.5, 163.24, -1, -1, -1, -1"],
+    # tracker outputs: 7 columns, space separated
+    'c7': ["1 1 10 20 30 40 0.9", "3 1 12 21 30 40 0.85", "3 2 100 200 30 40 0.3"],
+    'c6': ["2,5,1.5,2.5,3.5,4.5", "2,7,10,20,30,40", "5,5,2,3,4,5"],
+    'empty': [],
+}
+
+
+def write_tree(anno_dir, clips, location="loc"):
+    for clip, lines in clips.items():
+        clip_dir = os.path.join(anno_dir, location, clip)
+        os.makedirs(clip_dir, exist_ok=True)
+        with open(os.path.join(clip_dir, anno_store.GT_FILE), "w") as f:
+            f.write("".join(line + "\n" for line in lines))
+
+def gt_path(anno_dir, clip, location="loc"):
+    return os.path.join(anno_dir, location, clip, anno_store.GT_FILE)
+
+def parse_mot_file_lines(tmp_path, lines):
+    path = tmp_path / "gt.txt"
+    path.write_text("".join(line + "\n" for line in lines))
+    return parse_mot_file(str(path))
+
+@pytest.fixture
+def tree(tmp_path):
+    anno_dir, store_dir = str(tmp_path / "annotations"), str(tmp_path / "store")
+    write_tree(anno_dir, CLIPS)
+    assert anno_store.build_store(anno_dir, store_dir, quiet=True) == ["loc"]
+    return anno_dir, store_dir
+
+def test_rows_match_parsing(tree):
+    anno_dir, store_dir = tree
+    store = anno_store.open_store(store_dir, "loc")
+    assert store.clips() == sorted(CLIPS)
+    for clip in CLIPS:
+        expected = parse_mot_file(gt_path(anno_dir, clip))
+        rows = store.rows(clip)
+        assert rows.dtype == expected.dtype and rows.shape == expected.shape, clip
+        assert np.array_equal(rows, expected), clip
+    assert store.rows('c10').shape[1] == 10 and store.rows('c7').shape[1] == 7 and store.rows('c6').shape[1] == 6
+
+def test_records_round_trip():
+    rng = np.random.default_rng(0)
+    for num_cols in range(anno_store.MIN_COLUMNS, anno_store.MAX_COLUMNS + 1):
+        rows = rng.normal(size=(50, num_cols)) * 100
+        rows[:, :2] = rng.integers(1, 20, size=(50, 2))
+        records = anno_store.rows_to_records(rows)
+        # sorted by frame, in file order within a frame
+        order = np.argsort(rows[:, 0], kind='stable')
+        assert np.array_equal(anno_store.records_to_rows(records, num_cols), rows[order])
+        assert np.all(np.diff(records['frame']) >= 0)
+
+def test_format_mot_rows_reads_back(tmp_path):
+    rows = parse_mot_file_lines(tmp_path, CLIPS['c10'])
+    path = tmp_path / "formatted.txt"
+    path.write_text("".join(anno_store.format_mot_rows(rows)))
+    assert np.array_equal(parse_mot_file(str(path)), rows)
+
+def test_unsupported_rows():
+    with pytest.raises(ValueError):
+        anno_store.rows_to_records(np.ones((2, anno_store.MAX_COLUMNS + 1)))
+    with pytest.raises(ValueError):
+        anno_store.rows_to_records(np.ones((2, anno_store.MIN_COLUMNS - 1)))
+    with pytest.raises(ValueError):
+        anno_store.rows_to_records(np.array([[1.5, 1, 0, 0, 1, 1]]))
+
+def test_frames_and_tracks(tmp_path):
+    rng = np.random.default_rng(1)
+    frames = rng.integers(1, 30, size=200)
+    lines = [f"{frame}, {rng.integers(1, 8)}, {rng.uniform(0, 100):.2f}, 1, 2, 3, -1, -1, -1, -1" for frame in frames]
+    anno_dir, store_dir = str(tmp_path / "annotations"), str(tmp_path / "store")
+    write_tree(anno_dir, { 'clip': lines })
+    anno_store.build_store(anno_dir, store_dir, quiet=True)
+    store = anno_store.open_store(store_dir, "loc")
+    records = store.clip('clip')
+    assert not records.flags.writeable
+    for start, stop in [(0, 100), (1, 2), (5, 5), (10, 3), (29, None), (30, None), (-5, 1), (12, 18)]:
+        expected = records[(records['frame'] >= start) & (stop is None or records['frame'] < stop)]
+        assert np.array_equal(store.frames('clip', start, stop), expected), (start, stop)
+    for track_id in range(0, 9):
+        track = store.track('clip', track_id)
+        assert np.all(track['id'] == track_id) and len(track) == np.count_nonzero(records['id'] == track_id)
+        assert np.all(np.diff(track['frame']) >= 0)
+
+def test_staleness(tree):
+    anno_dir, store_dir = tree
+    store = anno_store.open_store(store_dir, "loc")
+    assert all(store.is_current(clip, gt_path(anno_dir, clip)) for clip in CLIPS)
+    assert not store.is_current('missing', gt_path(anno_dir, 'missing'))
+    assert anno_store.is_location_current(os.path.join(anno_dir, "loc"), store_dir, "loc")
+    assert anno_store.build_store(anno_dir, store_dir, quiet=True) == []
+
+    with open(gt_path(anno_dir, 'c7'), "a") as f:
+        f.write("4 2 101 201 30 40 0.4\n")
+    assert not store.is_current('c7', gt_path(anno_dir, 'c7'))
+    assert store.is_current('c6', gt_path(anno_dir, 'c6'))
+    assert not anno_store.is_location_current(os.path.join(anno_dir, "loc"), store_dir, "loc")
+    assert anno_store.build_store(anno_dir, store_dir, quiet=True) == ["loc"]
+    store = anno_store.open_store(store_dir, "loc")
+    assert np.array_equal(store.rows('c7'), parse_mot_file(gt_path(anno_dir, 'c7')))
+
+    # a new clip makes the location out of date
+    write_tree(anno_dir, { 'new': CLIPS['c6'] })
+    assert not anno_store.is_location_current(os.path.join(anno_dir, "loc"), store_dir, "loc")
+
+def test_version_and_incomplete_store(tree):
+    _, store_dir = tree
+    index_path = os.path.join(store_dir, "loc.json")
+    with open(index_path) as f:
+        index = json.load(f)
+    with open(index_path, "w") as f:
+        json.dump({**index, 'num_rows': index['num_rows'] + 1}, f)
+    with pytest.raises(ValueError, match="incomplete"):
+        anno_store.AnnotationStore(store_dir, "loc")
+    with open(index_path, "w") as f:
+        json.dump({**index, 'version': anno_store.STORE_VERSION + 1}, f)
+    with pytest.raises(ValueError, match="another version"):
+        anno_store.open_store(store_dir, "loc")
+    assert anno_store.open_store(store_dir, "missing") is None
+    assert anno_store.open_store(None, "loc") is None
+
+def test_tools_parse_changed_files(tree, tmp_path):
+    anno_dir, store_dir = tree
+    store = anno_store.open_store(store_dir, "loc")
+    image_dir = str(tmp_path / "images")
+    os.makedirs(image_dir)
+    cv2.imwrite(os.path.join(image_dir, "0.jpg"), np.zeros((2000, 2000, 3), dtype=np.uint8))
+    clip_dir = os.path.join(anno_dir, "loc", "c10")
+
+    def yolo_labels(store):
+        out_dir = tmp_path / ("out" if store is None else "out_store")
+        out_dir.mkdir(exist_ok=True)
+        for path in out_dir.iterdir():
+            path.unlink()
+        mot2yolo.do_split(clip_dir, str(out_dir), image_dir, store)
+        return { path.name: path.read_text() for path in out_dir.iterdir() }
+
+    assert yolo_labels(store) == yolo_labels(None)
+    assert len(get_tiny_dataset.read_annotation_lines(clip_dir, store)) == len(CLIPS['c10'])
+
+    # an edited gt.txt, not in frame order, is parsed instead of read from the store
+    with open(gt_path(anno_dir, 'c10'), "a") as f:
+        f.write("3, 9, 5, 5, 10, 10, -1, -1, -1, -1\n")
+    labels = yolo_labels(store)
+    assert labels == yolo_labels(None)
+    assert len(labels) == 4 and labels["2.txt"] == "0 0.0025 0.0025 0.005 0.005"
+    assert len(get_tiny_dataset.read_annotation_lines(clip_dir, store)) == len(CLIPS['c10']) + 1
@@ -0,0 +1,206 @@
+'''
+build_3channel_frames against the per-frame np.dstack builder it replaced, and the
+streaming and ROI conversions against converting the whole clip in memory
+'''
+
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import convert
+from reference import reference_3channel_frames
+
+
+def make_clip(num_frames, height=37, width=23, seed=0):
+    '''
+    Random frames, with every uint8 value present, and their normalized blurred frames
+    '''
+    rng = np.random.default_rng(seed)
+    frames = rng.integers(0, 256, size=(num_frames, height, width), dtype=np.uint8)
+    frames.reshape(-1)[:256] = np.arange(256, dtype=np.uint8)
+    blurred_frames = convert.blur_frames(frames)
+    blurred_frames -= blurred_frames.mean(axis=0)
+    convert.scale_blurred_frames(blurred_frames, np.max(np.abs(blurred_frames)))
+    return frames, blurred_frames
+
+@pytest.mark.parametrize("num_frames", [2, 3, 40])
+def test_build_matches_reference(num_frames):
+    frames, blurred_frames = make_clip(num_frames)
+    expected = reference_3channel_frames(frames, blurred_frames)
+    result = convert.build_3channel_frames(frames, blurred_frames)
+    assert result.dtype == np.uint8
+    assert result.shape == expected.shape
+    assert result.tobytes() == expected.tobytes()
+
+def test_build_matches_reference_at_the_range_limits():
+    frames, blurred_frames = make_clip(6)
+    # 0 and 1 are the ends of the scaled range, 0.5 is a background pixel
+    blurred_frames[:, 0, :3] = [0, 1, 0.5]
+    blurred_frames[::2, 1, :3] = 1
+    blurred_frames[1::2, 1, :3] = 0
+    expected = reference_3channel_frames(frames, blurred_frames)
+    assert convert.build_3channel_frames(frames, blurred_frames).tobytes() == expected.tobytes()
+
+@pytest.mark.parametrize("batch_size", [1, 7, 39, 64])
+def test_chunked_build_into_out_matches_reference(batch_size):
+    frames, blurred_frames = make_clip(40)
+    expected = reference_3channel_frames(frames, blurred_frames)
+    n = len(frames) - 1
+
+    # batches written into slices of one output array, reusing one scratch buffer
+    out = np.full((n,) + frames.shape[1:] + (3,), 17, dtype=np.uint8)
+    scratch = np.empty((batch_size,) + frames.shape[1:], dtype=np.float32)
+    for batch_start in range(0, n, batch_size):
+        batch_end = min(batch_start + batch_size, n)
+        result = convert.build_3channel_frames(
+            frames[batch_start:batch_end + 1],
+            blurred_frames[batch_start:batch_end + 1],
+            out=out[batch_start:batch_end],
+            scratch=scratch[:batch_end - batch_start]
+        )
+        assert np.shares_memory(result, out)
+    assert out.tobytes() == expected.tobytes()
+
+@pytest.mark.parametrize("batch_size", [1, 7, 64])
+def test_iter_3channel_batches_matches_reference(batch_size):
+    frames, blurred_frames = make_clip(40)
+    expected = reference_3channel_frames(frames, blurred_frames)
+    offsets = []
+    for offset, frame_images in convert.iter_3channel_batches(frames, blurred_frames, convert.FrameIO(), batch_size):
+        offsets.append(offset)
+        assert frame_images.tobytes() == expected[offset:offset + len(frame_images)].tobytes()
+    assert offsets == list(range(0, len(expected), batch_size))
+
+def write_jpeg_clip(clip_dir, num_frames, height=37, width=23, seed=0):
+    rng = np.random.default_rng(seed)
+    clip_dir.mkdir()
+    for i in range(num_frames):
+        cv2.imwrite(str(clip_dir / f"{i}.jpg"), rng.integers(0, 256, size=(height, width), dtype=np.uint8))
+    return str(clip_dir)
+
+def test_baseline_pp_clip_looks_up_statistics_once(tmp_path, monkeypatch):
+    clip_dir = write_jpeg_clip(tmp_path / "clip", 6)
+    calls = []
+    get_clip_statistics = convert.get_clip_statistics
+    monkeypatch.setattr(convert, "get_clip_statistics", lambda *args: calls.append(args) or get_clip_statistics(*args))
+
+    clip = convert.BaselinePPClip(clip_dir, chunk_size=4)
+    images = [clip[i] for i in range(len(clip))] + [clip[-1]]
+    assert len(calls) == 1
+    expected = list(convert.iter_baseline_pp(clip_dir, 4))
+    assert len(images) == len(expected) + 1
+    for image, expected_image in zip(images, expected + expected[-1:]):
+        assert image.tobytes() == expected_image.tobytes()
+
+def write_fan_clip(clip_dir, num_frames, height=150, width=120, seed=0):
+    '''
+    PNG frames (lossless, unlike JPEG) of random pixels inside a sonar-like fan, 0 outside it.
+    Returns the frame paths and the fan mask.
+    '''
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[:height, :width]
+    radius = np.hypot(rows, cols - width / 2)
+    angle = np.arctan2(cols - width / 2, rows)
+    fan = (radius > height * 0.3) & (radius < height * 0.95) & (np.abs(angle) < 0.35)
+    clip_dir.mkdir()
+    paths = []
+    for i in range(num_frames):
+        frame = np.where(fan, rng.integers(1, 256, size=(height, width)), 0).astype(np.uint8)
+        paths.append(str(clip_dir / f"{i}.png"))
+        cv2.imwrite(paths[-1], frame)
+    return paths, fan
+
+RECIPES = ["baseline++", "blur9=raw,bgsub:9,diff:9"]
+
+def convert_clip(frames, out_dir, recipes, **kwargs):
+    '''
+    The (T - 1, H, W, 3) images of every recipe of preprocess_frames with kwargs, written as .npy
+    '''
+    seq_out_dirs = { name: str(out_dir / name) for name in recipes }
+    convert.preprocess_frames(frames, seq_out_dirs, recipes, out_format='npy', **kwargs)
+    return { name: np.load(seq_out_dir + '.npy') for name, seq_out_dir in seq_out_dirs.items() }
+
+def assert_same_outputs(outputs, expected):
+    assert list(outputs) == list(expected)
+    for name in expected:
+        assert outputs[name].shape == expected[name].shape and outputs[name].tobytes() == expected[name].tobytes(), name
+
+@pytest.fixture
+def fan_clip(tmp_path):
+    frames, fan = write_fan_clip(tmp_path / "clip", 12)
+    recipes = convert.parse_recipes(RECIPES)
+    # the clip is small enough for the ROI path to restrict the math to bands
+    assert not convert.get_roi_layout(fan, recipes).is_full
+    expected = convert_clip(frames, tmp_path / "in_memory", recipes)
+    assert expected['baseline++'].shape == (11, 150, 120, 3)
+    return frames, fan, recipes, expected
+
+@pytest.mark.parametrize("chunk_size", [2, 3, 5, 11, 12, 50])
+def test_streaming_matches_in_memory(fan_clip, tmp_path, chunk_size):
+    frames, _, recipes, expected = fan_clip
+    assert_same_outputs(convert_clip(frames, tmp_path / "streamed", recipes, chunk_size=chunk_size), expected)
+
+@pytest.mark.parametrize("chunk_size", [None, 3, 12])
+def test_roi_matches_whole_frames(fan_clip, tmp_path, chunk_size):
+    frames, fan, recipes, expected = fan_clip
+    assert_same_outputs(convert_clip(frames, tmp_path / "auto", recipes, chunk_size=chunk_size, roi='auto'), expected)
+    assert_same_outputs(convert_clip(frames, tmp_path / "mask", recipes, chunk_size=chunk_size, roi=fan), expected)
+
+@pytest.mark.parametrize("chunk_size", [None, 3])
+def test_roi_falls_back_to_whole_frames(fan_clip, tmp_path, chunk_size):
+    frames, fan, recipes, _ = fan_clip
+    # a pixel outside the fan in a late frame, past the mask derived from the first chunk
+    frame = cv2.imread(frames[-2], cv2.IMREAD_GRAYSCALE)
+    frame[0, 0] = 200
+    cv2.imwrite(frames[-2], frame)
+    expected = convert_clip(frames, tmp_path / "in_memory", recipes)
+    assert_same_outputs(convert_clip(frames, tmp_path / "mask", recipes, chunk_size=chunk_size, roi=fan), expected)
+    if chunk_size:
+        assert_same_outputs(convert_clip(frames, tmp_path / "auto", recipes, chunk_size=chunk_size, roi='auto'), expected)
+
+def test_packed_clips(tmp_path):
+    in_dir = tmp_path / "in" / "loc"
+    in_dir.mkdir(parents=True)
+    write_jpeg_clip(in_dir / "clip", 6)
+    for out_format in ['jpg', 'npy', 'jpack']:
+        convert.convert(str(tmp_path / "in"), str(tmp_path / out_format), out_format=out_format)
+    jpeg_dir = tmp_path / "jpg" / "loc" / "clip"
+    npy = convert.PackedClip(str(tmp_path / "npy" / "loc" / "clip.npy"))
+    jpack = convert.PackedClip(str(tmp_path / "jpack" / "loc" / "clip.jpack"))
+    expected = np.stack(list(convert.iter_baseline_pp(str(in_dir / "clip"))))
+    assert len(npy) == len(jpack) == len(expected) == 5
+
+    for i in list(range(5)) + [-1, -5]:
+        # .npy frames are exact, .jpack frames are the JPEG frames
+        assert npy[i].tobytes() == expected[i].tobytes()
+        jpeg = (jpeg_dir / f"{i % 5}.jpg").read_bytes()
+        assert bytes(jpack.encoded(i)) == jpeg
+        assert bytes(npy.encoded(i)) == jpeg
+        decoded = cv2.cvtColor(cv2.imread(str(jpeg_dir / f"{i % 5}.jpg"), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+        assert jpack[i].tobytes() == decoded.tobytes()
+    for clip in (npy, jpack):
+        with pytest.raises(IndexError):
+            clip.encoded(5)
+
+@pytest.mark.parametrize("out_format", ['jpg', 'npy', 'jpack', 'mp4'])
+def test_clips_without_outputs(tmp_path, capsys, out_format):
+    in_dir = tmp_path / "in" / "loc"
+    in_dir.mkdir(parents=True)
+    write_jpeg_clip(in_dir / "one", 1)
+    write_jpeg_clip(in_dir / "zero", 0)
+    out_dir = str(tmp_path / "out")
+    convert.convert(str(tmp_path / "in"), out_dir, out_format=out_format)
+    assert "Converting 2 clip(s), 0 already up to date" in capsys.readouterr().out
+    # both are up to date on the next run
+    convert.convert(str(tmp_path / "in"), out_dir, out_format=out_format)
+    assert "Converting 0 clip(s), 2 already up to date" in capsys.readouterr().out
+    for clip in ["one", "zero"]:
+        path = convert.get_output_path(os.path.join(out_dir, "loc", clip), out_format)
+        if out_format in ['npy', 'jpack']:
+            assert len(convert.PackedClip(path)) == 0
+        elif out_format == 'jpg':
+            assert os.listdir(path) == []
+        else:
+            assert not os.path.exists(path)
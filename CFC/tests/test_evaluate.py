@@ -0,0 +1,101 @@
+'''
+evaluate.py on synthetic_mot trees: against nmae.py's count-only evaluation, and
+sharded evaluations merged against a single run
+'''
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import evaluate
+import nmae
+from synthetic_mot import make_tree
+
+CFC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRACKERS = ["baseline", "other"]
+PARAMS = { 'num_clips': 2, 'num_frames': 120, 'width': 300, 'height': 500, 'density': 6.0, 'track_length': 40.0 }
+
+
+@pytest.fixture(scope="module")
+def tree(tmp_path_factory):
+    out_dir = tmp_path_factory.mktemp("synthetic")
+    make_tree(str(out_dir), PARAMS, TRACKERS, seed=3)
+    return str(out_dir / "results"), str(out_dir / "annotations"), str(out_dir / "metadata")
+
+def read_outputs(output_fol):
+    return { name: open(os.path.join(output_fol, name)).read() for name in os.listdir(output_fol)
+             if name.endswith(".txt") or name.endswith(".csv") }
+
+@pytest.fixture(scope="module")
+def evaluation(tree):
+    '''
+    The results of evaluate() on the tree, and the files it wrote for every location and tracker
+    '''
+    results = evaluate.evaluate(*tree, TRACKERS, quiet=True)
+    outputs = { (location, tracker): read_outputs(os.path.join(tree[0], location, tracker))
+                for location in results for tracker in TRACKERS }
+    return results, outputs
+
+def test_counts_match_evaluate(tree, evaluation):
+    results = evaluation[0]
+    for tracker in TRACKERS:
+        counts = nmae.evaluate_counts(*tree, tracker, quiet=True)
+        assert list(counts) == list(results)
+        for location, loc_counts in counts.items():
+            res = results[location][tracker]
+            for seq, seq_counts in loc_counts['sequences'].items():
+                expected = res[seq]['pedestrian']['nMAE']
+                assert (seq_counts['nMAE_numer'], seq_counts['nMAE_denom']) == (expected['nMAE_numer'], expected['nMAE_denom'])
+            combined = res['COMBINED_SEQ']['pedestrian']['nMAE']
+            assert (loc_counts['nMAE_numer'], loc_counts['nMAE_denom'], loc_counts['nMAE']) == \
+                (combined['nMAE_numer'], combined['nMAE_denom'], combined['nMAE'])
+
+def test_count_only_does_not_import_trackeval(tree, tmp_path):
+    # a trackeval package that cannot be imported, ahead of the real one
+    blocker = tmp_path / "blocker" / "trackeval"
+    blocker.mkdir(parents=True)
+    (blocker / "__init__.py").write_text("raise ImportError('trackeval imported')\n")
+    env = {**os.environ, "PYTHONPATH": str(blocker.parent)}
+    results_dir, anno_dir, metadata_dir = tree
+    args = ["--results_dir", results_dir, "--anno_dir", anno_dir, "--metadata_dir", metadata_dir, "--tracker", *TRACKERS, "--no_cache"]
+
+    count_only = subprocess.run([sys.executable, "evaluate.py", "--count_only", *args], cwd=CFC_DIR, env=env,
+                                capture_output=True, text=True)
+    assert count_only.returncode == 0, count_only.stderr
+    counts = subprocess.run([sys.executable, "nmae.py", *args], cwd=CFC_DIR, env=env, capture_output=True, text=True)
+    assert counts.returncode == 0, counts.stderr
+    assert count_only.stdout == counts.stdout
+    assert count_only.stdout.count("nMAE:") == len(nmae.LOCATIONS) * len(TRACKERS)
+
+    # and the full evaluation does need it
+    full = subprocess.run([sys.executable, "evaluate.py", *args], cwd=CFC_DIR, env=env, capture_output=True, text=True)
+    assert full.returncode != 0 and "trackeval imported" in full.stderr
+
+@pytest.mark.parametrize("num_shards", [1, 2, 7])
+def test_merged_shards_match_evaluate(tree, evaluation, tmp_path, num_shards):
+    expected, expected_outputs = evaluation
+
+    shard_files = [str(tmp_path / f"shard_{i}_of_{num_shards}.pkl") for i in range(num_shards)]
+    for i, shard_file in enumerate(shard_files):
+        evaluate.evaluate_shard(*tree, TRACKERS, (i, num_shards), shard_file)
+    merged_dir = tmp_path / "merged"
+    # the order of the shard files does not matter
+    merged = evaluate.merge(shard_files[::-1], str(merged_dir), True)
+    np.testing.assert_equal(merged, expected)
+    for (location, tracker), outputs in expected_outputs.items():
+        assert outputs and read_outputs(str(merged_dir / location / tracker)) == outputs
+
+def test_merge_needs_every_shard_once(tree, tmp_path):
+    shard_files = [str(tmp_path / f"shard_{i}_of_3.pkl") for i in range(3)]
+    for i, shard_file in enumerate(shard_files):
+        evaluate.evaluate_shard(*tree, TRACKERS, (i, 3), shard_file)
+    with pytest.raises(ValueError, match="each of the 3 shards once"):
+        evaluate.merge(shard_files[:2], str(tmp_path / "merged"), True)
+    with pytest.raises(ValueError, match="each of the 3 shards once"):
+        evaluate.merge(shard_files + shard_files[:1], str(tmp_path / "merged"), True)
+    evaluate.evaluate_shard(*tree, TRACKERS[:1], (0, 3), shard_files[0])
+    with pytest.raises(ValueError, match="same trackers"):
+        evaluate.merge(shard_files, str(tmp_path / "merged"), True)
@@ -0,0 +1,202 @@
+'''
+evaluate.py's FastHOTA, FastCLEAR and FastIdentity against TrackEval's HOTA, CLEAR and
+Identity: every field must be identical, with the same types.
+
+test_cfc_annotations runs the same comparison on the CFC annotations when they are
+present: CFC_ANNO_DIR and CFC_METADATA_DIR (default: annotations/ and metadata/ next
+to evaluate.py), with the tracker CFC_TRACKER (default: baseline) in CFC_RESULTS_DIR,
+or, without CFC_RESULTS_DIR, tracker outputs derived from the annotations by
+synthetic_mot.make_tracker_output. It is skipped otherwise.
+'''
+
+import os
+
+import numpy as np
+import pytest
+
+import evaluate
+import nmae
+from synthetic_mot import DEFAULT_PARAMS, make_tracker_output, make_tree, write_mot
+
+CFC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METRICS = ['HOTA', 'CLEAR', 'Identity']
+# HOTA integrates over IoU thresholds
+IOU_THRESHOLDS = { 'HOTA': [None], 'CLEAR': [0.5, 0.3, 0.8], 'Identity': [0.5, 0.3, 0.8] }
+
+
+def assert_identical(a, b, where):
+    '''
+    Scalars must also have the same type, and NaNs are equal
+    '''
+    if isinstance(a, dict):
+        assert a.keys() == b.keys(), f"{where}: {sorted(a.keys())} != {sorted(b.keys())}"
+        for key in a:
+            assert_identical(a[key], b[key], f"{where}.{key}")
+    elif isinstance(a, list):
+        assert len(a) == len(b), f"{where}: {len(a)} != {len(b)} items"
+        for i, (x, y) in enumerate(zip(a, b)):
+            assert_identical(x, y, f"{where}[{i}]")
+    elif isinstance(a, np.ndarray):
+        assert isinstance(b, np.ndarray) and a.dtype == b.dtype and a.shape == b.shape, f"{where}: {b!r} != {a!r}"
+        assert np.array_equal(a, b, equal_nan=a.dtype.kind == 'f'), f"{where}: {b} != {a}"
+    else:
+        assert type(a) == type(b) and (a == b or (a != a and b != b)), f"{where}: {b!r} != {a!r}"
+
+def get_metric_pairs():
+    '''
+    (label, TrackEval metric, Fast metric) for every metric and IoU threshold
+    '''
+    pairs = []
+    for name in METRICS:
+        for iou_thresh in IOU_THRESHOLDS[name]:
+            config = {'PRINT_CONFIG': False} if iou_thresh is None else {'THRESHOLD': iou_thresh, 'PRINT_CONFIG': False}
+            pairs.append((name if iou_thresh is None else f"{name}@{iou_thresh}",
+                          evaluate.METRIC_ENGINES['trackeval'][name](config), evaluate.METRIC_ENGINES['fast'][name](config)))
+    return pairs
+
+def assert_engines_identical(data, where):
+    for label, ref_metric, fast_metric in get_metric_pairs():
+        assert_identical(ref_metric.eval_sequence(data), fast_metric.eval_sequence(data), f"{where} {label}")
+
+def make_timesteps(tracks, num_timesteps):
+    '''
+    Per-timestep ids, 0-indexed in order of appearance as after TrackEval's preprocessing,
+    and (n, 4) dets, from { track_id -> { timestep -> box } }
+    '''
+    index = { track_id: i for i, track_id in enumerate(tracks) }
+    ids = [[] for _ in range(num_timesteps)]
+    dets = [[] for _ in range(num_timesteps)]
+    for track_id, boxes in tracks.items():
+        for t, b in boxes.items():
+            ids[t].append(index[track_id])
+            dets[t].append(b)
+    return ([np.array(i, dtype=int) for i in ids],
+            [np.array(d, dtype=float).reshape(-1, 4) for d in dets])
+
+def make_data(gt_tracks, tracker_tracks, num_timesteps=10):
+    '''
+    A preprocessed sequence, as MotChallenge2DBox.get_preprocessed_seq_data returns it
+    '''
+    gt_ids, gt_dets = make_timesteps(gt_tracks, num_timesteps)
+    tracker_ids, tracker_dets = make_timesteps(tracker_tracks, num_timesteps)
+    return {
+        'seq': 'seq',
+        'num_timesteps': num_timesteps,
+        'gt_ids': gt_ids,
+        'tracker_ids': tracker_ids,
+        'gt_dets': gt_dets,
+        'tracker_dets': tracker_dets,
+        'similarity_scores': evaluate.batch_box_ious(gt_dets, tracker_dets),
+        'num_gt_ids': len(gt_tracks),
+        'num_tracker_ids': len(tracker_tracks),
+        'num_gt_dets': sum(len(ids) for ids in gt_ids),
+        'num_tracker_dets': sum(len(ids) for ids in tracker_ids),
+    }
+
+def moving_track(x, y, timesteps, dx=5, w=20, h=10):
+    return { t: [x + dx * i, y, w, h] for i, t in enumerate(timesteps) }
+
+CASES = {
+    'empty': ({}, {}),
+    'empty gt': ({}, { 1: moving_track(10, 10, range(10)) }),
+    'empty tracker': ({ 1: moving_track(10, 10, range(10)) }, {}),
+    'no overlap': ({ 1: moving_track(10, 10, range(10)), 2: moving_track(10, 50, range(3, 8)) },
+                   { 1: moving_track(200, 10, range(10)), 2: moving_track(10, 100, range(5)) }),
+    'no common timesteps': ({ 1: moving_track(10, 10, range(5)) }, { 1: moving_track(10, 10, range(5, 10)) }),
+    'perfect': ({ 1: moving_track(10, 10, range(10)), 2: moving_track(60, 30, range(2, 9), dx=-3) },
+                { 7: moving_track(10, 10, range(10)), 3: moving_track(60, 30, range(2, 9), dx=-3) }),
+    'id switch': ({ 1: moving_track(10, 10, range(10)) },
+                  { 1: moving_track(11, 10, range(5)), 2: { t: [11 + 5 * t, 10, 20, 10] for t in range(5, 10) } }),
+    'single detections': ({ 1: { 4: [10, 10, 20, 10] }, 2: { 4: [12, 11, 20, 10] } },
+                          { 1: { 4: [11, 10, 20, 10] } }),
+    'crossing tracks': ({ 1: moving_track(10, 10, range(10)), 2: moving_track(55, 10, range(10), dx=-5) },
+                        { 1: { t: [10 + 5 * t, 11, 20, 10] if t < 5 else [55 - 5 * t, 11, 20, 10] for t in range(10) },
+                          2: { t: [55 - 5 * t, 11, 20, 10] if t < 5 else [10 + 5 * t, 11, 20, 10] for t in range(10) } }),
+}
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_cases(case):
+    assert_engines_identical(make_data(*CASES[case]), case)
+
+def random_tracks(rng, num_tracks, num_timesteps, gt_tracks=None):
+    '''
+    Random tracks, or, with gt_tracks, a tracker's output for them: jittered boxes, missed
+    detections, ID switches and false positive tracks
+    '''
+    tracks = {}
+    for track_boxes in (gt_tracks or {}).values():
+        track_id = len(tracks)
+        for t, b in track_boxes.items():
+            if rng.random() < 0.1:
+                continue
+            if track_id in tracks and rng.random() < 0.05:
+                track_id = len(tracks)
+            tracks.setdefault(track_id, {})[t] = list(np.asarray(b) + rng.normal(0, 3, 4))
+    for _ in range(num_tracks):
+        start = int(rng.integers(num_timesteps))
+        stop = int(rng.integers(start, num_timesteps)) + 1
+        x, y = rng.uniform(0, 200, 2)
+        dx, dy = rng.normal(0, 5, 2)
+        w, h = rng.uniform(5, 40, 2)
+        tracks[len(tracks)] = { t: [x + dx * t, y + dy * t, w, h] for t in range(start, stop) }
+    return tracks
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_sequences(seed):
+    rng = np.random.default_rng(seed)
+    num_timesteps = int(rng.integers(1, 60))
+    gt_tracks = random_tracks(rng, int(rng.integers(1, 15)), num_timesteps)
+    tracker_tracks = random_tracks(rng, int(rng.integers(0, 5)), num_timesteps, gt_tracks)
+    assert_engines_identical(make_data(gt_tracks, tracker_tracks, num_timesteps), f"seed {seed}")
+
+def assert_tree_identical(results_dir, anno_dir, metadata_dir, tracker):
+    num_clips = 0
+    for location in nmae.LOCATIONS:
+        meta_f = os.path.join(metadata_dir, location + ".json")
+        if not os.path.isfile(meta_f) or not os.path.isdir(os.path.join(anno_dir, location)):
+            continue
+        dataset = evaluate.get_location_evaluation(location, anno_dir, results_dir, meta_f, [tracker])['dataset']
+        for seq in sorted(dataset.seq_list):
+            data = dataset.get_preprocessed_seq_data(dataset.get_raw_seq_data(tracker, seq), 'pedestrian')
+            assert_engines_identical(data, f"{location}/{seq}")
+            num_clips += 1
+    return num_clips
+
+def test_synthetic_tree(tmp_path):
+    params = { 'num_clips': 2, 'num_frames': 150, 'width': 300, 'height': 500, 'density': 6.0, 'track_length': 40.0 }
+    make_tree(str(tmp_path), params, ["baseline"], seed=1)
+    num_clips = assert_tree_identical(str(tmp_path / "results"), str(tmp_path / "annotations"), str(tmp_path / "metadata"), "baseline")
+    assert num_clips == 2 * len(nmae.LOCATIONS)
+
+def write_derived_results(anno_dir, metadata_dir, results_dir, tracker, seed=0):
+    '''
+    Write a tracker output for every annotated clip with synthetic_mot.make_tracker_output
+    '''
+    rng = np.random.default_rng(seed)
+    for location in nmae.LOCATIONS:
+        meta_f = os.path.join(metadata_dir, location + ".json")
+        if not os.path.isfile(meta_f) or not os.path.isdir(os.path.join(anno_dir, location)):
+            continue
+        data_dir = os.path.join(results_dir, location, tracker, "data")
+        os.makedirs(data_dir, exist_ok=True)
+        seq_info, seq_dims = evaluate.read_meta(meta_f)
+        for clip, num_frames in seq_info.items():
+            w, h = seq_dims[clip]
+            rows = nmae.parse_mot_file(os.path.join(anno_dir, location, clip, "gt.txt"))
+            # synthetic_mot's ground truth layout: [frame, track index, x, y, w, h], sorted by track and frame
+            gt = rows[np.lexsort((rows[:, 0], rows[:, 1]))][:, :6].reshape(-1, 6)
+            gt[:, 1] -= 1
+            params = {**DEFAULT_PARAMS, 'num_frames': num_frames, 'width': w, 'height': h}
+            write_mot(os.path.join(data_dir, clip + ".txt"), make_tracker_output(rng, gt, params), gt=False)
+
+def test_cfc_annotations(tmp_path):
+    anno_dir = os.environ.get("CFC_ANNO_DIR", os.path.join(CFC_DIR, "annotations"))
+    metadata_dir = os.environ.get("CFC_METADATA_DIR", os.path.join(CFC_DIR, "metadata"))
+    tracker = os.environ.get("CFC_TRACKER", "baseline")
+    if not os.path.isdir(anno_dir) or not os.path.isdir(metadata_dir):
+        pytest.skip(f"no CFC annotations and metadata in {anno_dir} and {metadata_dir} (set CFC_ANNO_DIR and CFC_METADATA_DIR)")
+    results_dir = os.environ.get("CFC_RESULTS_DIR")
+    if results_dir is None:
+        results_dir = str(tmp_path / "results")
+        write_derived_results(anno_dir, metadata_dir, results_dir, tracker)
+    assert assert_tree_identical(results_dir, anno_dir, metadata_dir, tracker) > 0
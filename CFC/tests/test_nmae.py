@@ -0,0 +1,138 @@
+'''
+nmae's vectorized track counting and evaluate.nMAE against the original
+per-detection implementation, which built a list of boxes for every track id
+'''
+
+import math
+
+import numpy as np
+import pytest
+
+import evaluate
+import nmae
+from reference import reference_count, reference_eval_sequence, reference_tracks
+
+W, H = 100, 80
+FILTER_DISTS = [0, 0.05, 0.2]
+
+
+def box(cx, cy, bw=10, bh=8):
+    '''
+    A 1-indexed MOT box of normalized center (cx, cy)
+    '''
+    return [cx * W - bw / 2 + 1, cy * H - bh / 2 + 1, bw, bh]
+
+def make_timesteps(tracks, num_timesteps):
+    '''
+    Per-timestep ids and (n, 4) dets from { track_id -> { timestep -> box } }
+    '''
+    ids = [[] for _ in range(num_timesteps)]
+    dets = [[] for _ in range(num_timesteps)]
+    for track_id, boxes in tracks.items():
+        for t, b in boxes.items():
+            ids[t].append(track_id)
+            dets[t].append(b)
+    return ([np.array(i, dtype=int) for i in ids],
+            [np.array(d, dtype=float).reshape(-1, 4) for d in dets])
+
+def make_data(gt_tracks, tracker_tracks, num_timesteps=10):
+    gt_ids, gt_dets = make_timesteps(gt_tracks, num_timesteps)
+    tracker_ids, tracker_dets = make_timesteps(tracker_tracks, num_timesteps)
+    return { 'seq': 'seq', 'gt_ids': gt_ids, 'gt_dets': gt_dets, 'tracker_ids': tracker_ids, 'tracker_dets': tracker_dets }
+
+def random_tracks(rng, num_tracks, num_timesteps):
+    tracks = {}
+    for track_id in rng.choice(1000, size=num_tracks, replace=False):
+        start = rng.integers(num_timesteps)
+        stop = rng.integers(start, num_timesteps) + 1
+        x = np.linspace(*rng.uniform(0.05, 0.95, size=2), stop - start)
+        y = np.linspace(*rng.uniform(0.05, 0.95, size=2), stop - start)
+        tracks[int(track_id)] = { int(t): box(cx, cy, *rng.integers(2, 30, size=2)) for t, cx, cy in zip(range(start, stop), x, y) }
+    return tracks
+
+CASES = {
+    'empty': ({}, {}),
+    'empty gt': ({}, { 1: { 0: box(0.2, 0.5), 9: box(0.8, 0.5) } }),
+    'empty tracker': ({ 1: { 0: box(0.2, 0.5), 9: box(0.8, 0.5) } }, {}),
+    'single detections': ({ 1: { 3: box(0.2, 0.5) }, 2: { 3: box(0.5, 0.5) }, 3: { 7: box(0.8, 0.5) } },
+                          { 4: { 0: box(0.5, 0.5) } }),
+    'crossing right': ({ 1: { t: box(0.3 + 0.04 * t, 0.5) for t in range(10) } },
+                       { 7: { 0: box(0.45, 0.5), 5: box(0.5, 0.5) } }),
+    'crossing left': ({ 1: { t: box(0.7 - 0.04 * t, 0.5) for t in range(10) } },
+                      { 7: { 0: box(0.5, 0.5), 5: box(0.45, 0.5) } }),
+    'both directions': ({ 1: { 0: box(0.1, 0.2), 9: box(0.9, 0.2) }, 2: { 2: box(0.9, 0.6), 8: box(0.1, 0.6) },
+                          3: { 1: box(0.4, 0.5), 6: box(0.6, 0.9) }, 4: { 0: box(0.6, 0.3), 4: box(0.4, 0.3) } },
+                        { 5: { 0: box(0.9, 0.2), 9: box(0.1, 0.2) }, 6: { 2: box(0.49, 0.6), 3: box(0.51, 0.6) },
+                          8: { 4: box(0.1, 0.5), 5: box(0.3, 0.5), 6: box(0.7, 0.5) } }),
+    'back and forth': ({ 1: { 0: box(0.2, 0.5), 4: box(0.8, 0.5), 9: box(0.3, 0.5) } },
+                       { 2: { 0: box(0.8, 0.5), 4: box(0.2, 0.5), 9: box(0.9, 0.5) } }),
+    'no crossing': ({ 1: { 0: box(0.1, 0.5), 9: box(0.45, 0.5) }, 2: { 0: box(0.55, 0.1), 9: box(0.95, 0.9) } },
+                    { 3: { 0: box(0.5, 0.1), 9: box(0.9, 0.9) } }),
+}
+
+def get_metric():
+    return evaluate.nMAE({ 'SEQ_DIMS': { 'seq': (W, H) } })
+
+def assert_displacements(ids, dets, expected_tracks):
+    x0, x1, dist = nmae.get_track_displacements(np.concatenate(ids), np.concatenate(dets), W, H)
+    expected = [expected_tracks[i] for i in sorted(expected_tracks)]
+    assert len(x0) == len(x1) == len(dist) == len(expected)
+    for k, track in enumerate(expected):
+        start, end = track[0], track[-1]
+        assert x0[k] == start[0] + start[2] / 2.0
+        assert x1[k] == end[0] + end[2] / 2.0
+        y0, y1 = start[1] + start[3] / 2.0, end[1] + end[3] / 2.0
+        assert dist[k] == math.sqrt((x1[k] - x0[k])**2 + (y1 - y0)**2)
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_track_displacements(case):
+    data = make_data(*CASES[case])
+    for ids, dets in [(data['gt_ids'], data['gt_dets']), (data['tracker_ids'], data['tracker_dets'])]:
+        tracks = reference_tracks(ids, dets, W, H)
+        assert_displacements(ids, dets, tracks)
+        displacements = nmae.get_track_displacements(np.concatenate(ids), np.concatenate(dets), W, H)
+        for filter_dist in FILTER_DISTS:
+            assert nmae.count_displacements(*displacements, filter_dist) == reference_count(tracks, filter_dist)
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_eval_sequence(case):
+    data = make_data(*CASES[case])
+    metric = get_metric()
+    assert metric.eval_sequence(data) == reference_eval_sequence(data, W, H)
+    sweep = metric.eval_sequence_sweep(data, FILTER_DISTS)
+    for filter_dist in FILTER_DISTS:
+        assert sweep[filter_dist] == reference_eval_sequence(data, W, H, filter_dist)
+
+def test_crossings_are_counted_in_both_directions():
+    gt_tracks, _ = CASES['both directions']
+    tracks = reference_tracks(*make_timesteps(gt_tracks, 10), W, H)
+    # one track left to right over the whole frame, one right to left, and two short crossings
+    assert reference_count(tracks, 0.05) == (2, 2)
+    data = make_data(*CASES['both directions'])
+    ids, dets = np.concatenate(data['gt_ids']), np.concatenate(data['gt_dets'])
+    assert nmae.count_detections(ids, dets, W, H, 0.05) == (2, 2)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_sequences(seed):
+    rng = np.random.default_rng(seed)
+    num_timesteps = int(rng.integers(1, 50))
+    data = make_data(random_tracks(rng, int(rng.integers(0, 20)), num_timesteps),
+                     random_tracks(rng, int(rng.integers(0, 20)), num_timesteps), num_timesteps)
+    metric = get_metric()
+    assert metric.eval_sequence(data) == reference_eval_sequence(data, W, H)
+    sweep = metric.eval_sequence_sweep(data, FILTER_DISTS)
+    for filter_dist in FILTER_DISTS:
+        assert sweep[filter_dist] == reference_eval_sequence(data, W, H, filter_dist)
+    tracks = reference_tracks(data['gt_ids'], data['gt_dets'], W, H)
+    assert_displacements(data['gt_ids'], data['gt_dets'], tracks)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_count_tracks_of_unsorted_rows(seed):
+    rng = np.random.default_rng(seed)
+    ids, dets = make_timesteps(random_tracks(rng, 15, 30), 30)
+    tracks = reference_tracks(ids, dets, W, H)
+    rows = np.concatenate([np.column_stack([np.full(len(i), t + 1), i, d]) for t, (i, d) in enumerate(zip(ids, dets))])
+    # MOT files do not have to be in frame order
+    rows = rows[rng.permutation(len(rows))]
+    for filter_dist in FILTER_DISTS:
+        assert nmae.count_tracks(rows, W, H, filter_dist) == reference_count(tracks, filter_dist)
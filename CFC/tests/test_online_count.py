@@ -0,0 +1,67 @@
+'''
+OnlineCounter's counts on finished track files against nmae.count_tracks, and the
+counts of a --follow stream that is interrupted
+'''
+
+import numpy as np
+import pytest
+
+import nmae
+import online_count
+from synthetic_mot import DEFAULT_PARAMS, make_gt, make_tracker_output, write_mot
+
+PARAMS = dict(DEFAULT_PARAMS, num_frames=300, density=8.0, track_length=40.0, fp_rate=0.05)
+
+
+def write_track_file(path, seed):
+    rng = np.random.default_rng(seed)
+    write_mot(path, make_tracker_output(rng, make_gt(rng, PARAMS), PARAMS), gt=False)
+    return path
+
+def stream(path, follow=False):
+    counter = online_count.OnlineCounter(PARAMS['width'], PARAMS['height'], max_age=PARAMS['num_frames'])
+    events = []
+    online_count.stream_mot_file(str(path), counter, follow, events.append)
+    return counter.counts, events
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("filter_dist", [0, 0.05, 0.2])
+def test_counts_match_nmae(tmp_path, seed, filter_dist):
+    rows = nmae.parse_mot_file(write_track_file(tmp_path / "clip.txt", seed))
+    expected = nmae.count_tracks(rows, PARAMS['width'], PARAMS['height'], filter_dist)
+    assert sum(expected) > 0
+    # no gap is longer than the clip, so every max_age that large counts the same
+    for max_age in [None, PARAMS['num_frames']]:
+        counts, events = online_count.count_rows_online(rows, PARAMS['width'], PARAMS['height'], filter_dist, max_age)
+        assert counts == expected
+        assert (sum(e.direction == 'right' for e in events), sum(e.direction == 'left' for e in events)) == expected
+    # in reverse file order within each frame
+    counts, _ = online_count.count_rows_online(rows[::-1], PARAMS['width'], PARAMS['height'], filter_dist)
+    assert counts == expected
+
+@pytest.mark.parametrize("seed", range(3))
+def test_stream_mot_file_matches_nmae(tmp_path, seed):
+    path = write_track_file(tmp_path / "clip.txt", seed)
+    expected = nmae.count_tracks(nmae.parse_mot_file(path), PARAMS['width'], PARAMS['height'])
+    counts, events = stream(path)
+    assert counts == expected
+    assert len(events) == sum(expected)
+
+def test_interrupted_follow_counts_last_frame(tmp_path, monkeypatch):
+    path = write_track_file(tmp_path / "clip.txt", 0)
+    lines = path.read_text().splitlines(keepends=True)
+    last_frame = int(lines[-1].split(",")[0])
+    # a track that only crosses in the last frame read before the interrupt
+    lines += ["%d,9999,100,500,20,20,0.9,-1,-1,-1\n" % (last_frame + 1),
+              "%d,9999,500,500,20,20,0.9,-1,-1,-1\n" % (last_frame + 2)]
+    path.write_text("".join(lines))
+    expected = nmae.count_tracks(nmae.parse_mot_file(path), PARAMS['width'], PARAMS['height'])
+
+    def follow_lines(f, poll_interval=0.5):
+        yield from f
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(online_count, "follow_lines", follow_lines)
+    counts, events = stream(path, follow=True)
+    assert counts == expected
+    assert any(e.track_id == 9999 and e.direction == 'right' for e in events)
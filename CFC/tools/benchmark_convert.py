@@ -0,0 +1,329 @@
+'''
+benchmark_convert.py
+
+Microbenchmarks for the Baseline++ conversion in convert.py. Each benchmark also
+checks that the optimized code path produces exactly the same output as the
+reference implementation it replaces.
+
+Benchmarks:
+    - build: the 3-channel frame builder (per-frame np.dstack vs. build_3channel_frames)
+    - online: per-frame latency of OnlineBackgroundSubtractor, and how far its output is from
+              the offline conversion of the same clip, for every --alpha and --window: mean absolute
+              difference per channel, fraction of pixels within 4, 8 and 16 grey levels, and warm-up length
+    - read: converts one clip to each output format (--format jpg / npy / jpack) in a temporary
+            directory, then compares disk usage and read throughput, sequential and in random order
+    - video: converts one clip with JPEG-directory and video (--video_format) input, each to JPEG-directory
+             and video output, and compares conversion throughput and disk usage
+    - recipes: converts one clip to several channel recipes (--recipe), once per recipe and then all
+               in a single pass, and checks that both produce the same images
+    - roi: converts the first clip of every location under --in_dir on whole frames and with --roi auto,
+           checks that the outputs are identical, and reports the speedup per location
+
+Frames are random unless --clip_dir points to a directory of raw frames.
+
+Example command:
+python benchmark_convert.py build --num_frames 200 --height 1000 --width 600
+python benchmark_convert.py online --num_frames 1000 --alpha 0.05 0.01 0.005 --window 100 300 --clip_dir ../frames/raw/elwha/Elwha_2018_OM_ARIS_2018_07_19_2018-07-19_080000_14_214/
+python benchmark_convert.py read --num_frames 500 --clip_dir ../frames/raw/kenai/CLIP_NAME/
+python benchmark_convert.py video --num_frames 500 --video_format mp4 --clip_dir ../frames/raw/kenai/CLIP_NAME/
+python benchmark_convert.py recipes --num_frames 300 --recipe baseline++ --recipe baseline --recipe blur9=raw,bgsub:9,diff:9 --recipe diff3=raw,bgsub,diff3
+python benchmark_convert.py roi --num_frames 300 --in_dir ../frames/raw/
+python benchmark_convert.py build --clip_dir ../frames/raw/elwha/Elwha_2018_OM_ARIS_2018_07_19_2018-07-19_080000_14_214/
+'''
+
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import cv2
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_dir, ".."))
+import convert
+from reference import reference_3channel_frames
+
+
+def load_frames(args):
+    '''
+    (T, H, W) uint8 frames, either read from args.clip_dir or random
+    '''
+    if args.clip_dir:
+        frames = convert.get_frames(args.clip_dir)[:args.num_frames]
+        return convert.read_frames(frames)
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (args.num_frames, args.height, args.width), dtype=np.uint8)
+
+def normalized_blurred_frames(frames):
+    blurred_frames = convert.blur_frames(frames)
+    blurred_frames -= blurred_frames.mean(axis=0)
+    convert.scale_blurred_frames(blurred_frames, np.max(np.abs(blurred_frames)))
+    return blurred_frames
+
+def best_time(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def benchmark_build(args):
+    frames = load_frames(args)
+    blurred_frames = normalized_blurred_frames(frames)
+    n = len(frames) - 1
+    print(f"{n} frames of {frames.shape[1]}x{frames.shape[2]}")
+
+    out = np.empty((n,) + frames.shape[1:] + (3,), dtype=np.uint8)
+    scratch = np.empty((n,) + frames.shape[1:], dtype=np.float32)
+    ref_time, expected = best_time(lambda: reference_3channel_frames(frames, blurred_frames), args.repeats)
+    new_time, result = best_time(lambda: convert.build_3channel_frames(frames, blurred_frames, out, scratch), args.repeats)
+
+    assert np.array_equal(expected, result), "build_3channel_frames does not match the reference builder"
+    print(f"np.dstack per frame:   {n / ref_time:10.1f} frames/sec")
+    print(f"build_3channel_frames: {n / new_time:10.1f} frames/sec ({ref_time / new_time:.1f}x)")
+
+# grey levels within which an online pixel counts as matching the offline output
+ONLINE_LEVELS = [4, 8, 16]
+
+def get_warmup(alpha=None, window=None):
+    '''
+    Number of frames before the running background has settled: a full window, or until
+    the first frame's weight in the exponential background is below 5%
+    '''
+    if window:
+        return window
+    return int(np.ceil(np.log(0.05) / np.log(1 - alpha)))
+
+def compare_online(online, offline, mask, warmup=0):
+    '''
+    Per channel: (mean absolute difference, [fraction of pixels within each of ONLINE_LEVELS]),
+    over the pixels of mask in the frames after warmup
+    '''
+    diff = np.abs(online[warmup:].astype(np.int16) - offline[warmup:].astype(np.int16))[:, mask]
+    return [(diff[..., c].mean(), [(diff[..., c] <= level).mean() for level in ONLINE_LEVELS]) for c in range(3)]
+
+def benchmark_online(args):
+    frames = load_frames(args)
+    n = len(frames) - 1
+    print(f"{n} frames of {frames.shape[1]}x{frames.shape[2]}, norm_decay {args.norm_decay}")
+    offline = convert.build_3channel_frames(frames, normalized_blurred_frames(frames))
+    # pixels outside the sonar fan are black in every frame, and identical online and offline
+    mask = frames.max(axis=0) > 0
+    print(f"compared on the {mask.mean():.1%} of pixels that are not black in every frame")
+
+    settings = [(f"alpha={alpha}", {'alpha': alpha}) for alpha in args.alpha]
+    settings += [(f"window={window}", {'window': window}) for window in args.window or []]
+    print(f"{'setting':<14}{'channel':>12}{'MAE':>8}" + "".join(f"{'<=' + str(level):>8}" for level in ONLINE_LEVELS) +
+          f"{'warm-up':>9}{'MAE after':>11}" + "".join(f"{'<=' + str(level):>8}" for level in ONLINE_LEVELS))
+    for name, params in settings:
+        subtractor = convert.OnlineBackgroundSubtractor(norm_decay=args.norm_decay, **params)
+        latencies = []
+        online = []
+        for frame in frames:
+            start = time.perf_counter()
+            frame_image = subtractor.push(frame)
+            latencies.append(time.perf_counter() - start)
+            if frame_image is not None:
+                online.append(frame_image)
+        online = np.stack(online)
+
+        warmup = get_warmup(**params)
+        for c, all_frames in enumerate(compare_online(online, offline, mask)):
+            line = f"{name if c == 0 else '':<14}{['raw', 'bgsub', 'diff'][c]:>12}{all_frames[0]:>8.2f}" + \
+                "".join(f"{within:>8.1%}" for within in all_frames[1]) + f"{warmup if c == 0 else '':>9}"
+            if warmup < len(online):
+                after = compare_online(online, offline, mask, warmup)[c]
+                line += f"{after[0]:>11.2f}" + "".join(f"{within:>8.1%}" for within in after[1])
+            print(line)
+        latencies = np.array(latencies) * 1000
+        print(f"{'':<14}latency per frame: median {np.median(latencies):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms")
+    print("MAE: mean absolute difference from the offline output, in grey levels; <=N: pixels within N grey levels of it.")
+    print("warm-up: frames before the running background settles (window, or first frame weight < 5%); 'after' columns exclude them.")
+
+def jpeg_dir_reader(seq_out_dir):
+    '''
+    Opens a directory of converted JPEG frames the way a dataloader would:
+    list it, then decode frames by index.
+    '''
+    frames = sorted(glob.glob(seq_out_dir + "/*.jpg"), key=convert.get_frame_idx)
+    return len(frames), lambda i: cv2.imread(frames[i], cv2.IMREAD_COLOR)
+
+def packed_reader(path):
+    clip = convert.PackedClip(path)
+    return len(clip), clip.__getitem__
+
+def disk_usage(path):
+    if os.path.isfile(path):
+        return 1, os.path.getsize(path)
+    files = [os.path.join(path, f) for f in os.listdir(path)]
+    return len(files), sum(os.path.getsize(f) for f in files)
+
+def benchmark_read(args):
+    frames = load_frames(args)
+    print(f"{len(frames) - 1} frames of {frames.shape[1]}x{frames.shape[2]}")
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        frame_dir = os.path.join(tmp_dir, "raw")
+        os.makedirs(frame_dir)
+        for i, frame in enumerate(frames):
+            cv2.imwrite(os.path.join(frame_dir, f"{i}.jpg"), frame)
+        frame_paths = convert.get_frames(frame_dir)
+
+        seq_out_dir = os.path.join(tmp_dir, "clip")
+        rng = np.random.default_rng(0)
+        for out_format in ['jpg', 'npy', 'jpack']:
+            convert.background_subtract_frames(frame_paths, seq_out_dir, out_format=out_format)
+            path = convert.get_output_path(seq_out_dir, out_format)
+            num_files, num_bytes = disk_usage(path)
+
+            open_time, (n, read) = best_time(
+                lambda: jpeg_dir_reader(path) if out_format == 'jpg' else packed_reader(path), args.repeats)
+            # copy every frame out so lazily mapped pixels are actually read
+            buffer = np.empty(frames.shape[1:] + (3,), dtype=np.uint8)
+            def read_all(order):
+                for i in order:
+                    np.copyto(buffer, read(i))
+            seq_time, _ = best_time(lambda: read_all(range(n)), args.repeats)
+            rand_time, _ = best_time(lambda: read_all(rng.permutation(n)), args.repeats)
+            print(f"{out_format:>5}: {num_files:6d} file(s), {num_bytes / 2**20:8.1f} MB, open {open_time * 1000:7.2f} ms, "
+                  f"sequential {n / seq_time:8.1f} frames/sec, random {n / rand_time:8.1f} frames/sec")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def write_video(frames, path, out_format):
+    height, width = frames.shape[1:]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*convert.VIDEO_FOURCC[out_format]),
+                             convert.DEFAULT_VIDEO_FPS, (width, height))
+    for frame in frames:
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    writer.release()
+
+def benchmark_video(args):
+    frames = load_frames(args)
+    n = len(frames) - 1
+    print(f"{n} frames of {frames.shape[1]}x{frames.shape[2]}")
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        frame_dir = os.path.join(tmp_dir, "raw")
+        os.makedirs(frame_dir)
+        for i, frame in enumerate(frames):
+            cv2.imwrite(os.path.join(frame_dir, f"{i}.jpg"), frame)
+        video_path = os.path.join(tmp_dir, "raw." + args.video_format)
+        write_video(frames, video_path, args.video_format)
+
+        for in_path in (frame_dir, video_path):
+            in_files, in_bytes = disk_usage(in_path)
+            for out_format in ('jpg', args.video_format):
+                seq_out_dir = os.path.join(tmp_dir, "clip")
+                convert_time, _ = best_time(
+                    lambda: convert.background_subtract_frames(convert.get_frames(in_path), seq_out_dir, out_format=out_format),
+                    args.repeats)
+                out_files, out_bytes = disk_usage(convert.get_output_path(seq_out_dir, out_format))
+                in_name = "jpg" if in_path == frame_dir else args.video_format
+                print(f"{in_name:>4} -> {out_format:<4}: input {in_files:6d} file(s) {in_bytes / 2**20:8.1f} MB, "
+                      f"output {out_files:6d} file(s) {out_bytes / 2**20:8.1f} MB, {n / convert_time:8.1f} frames/sec")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def benchmark_recipes(args):
+    frames = load_frames(args)
+    recipes = convert.parse_recipes(args.recipe)
+    print(f"{len(frames) - 1} frames of {frames.shape[1]}x{frames.shape[2]}, recipes: {', '.join(recipes)}")
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        frame_dir = os.path.join(tmp_dir, "raw")
+        os.makedirs(frame_dir)
+        for i, frame in enumerate(frames):
+            cv2.imwrite(os.path.join(frame_dir, f"{i}.jpg"), frame)
+        frame_paths = convert.get_frames(frame_dir)
+
+        separate_dirs = {name: os.path.join(tmp_dir, "separate", name) for name in recipes}
+        def convert_separately():
+            for name, channels in recipes.items():
+                convert.preprocess_frames(frame_paths, separate_dirs, {name: channels}, args.chunk_size, out_format='npy')
+        single_dirs = {name: os.path.join(tmp_dir, "single", name) for name in recipes}
+        separate_time, _ = best_time(convert_separately, args.repeats)
+        single_time, _ = best_time(
+            lambda: convert.preprocess_frames(frame_paths, single_dirs, recipes, args.chunk_size, out_format='npy'), args.repeats)
+
+        for name in recipes:
+            separate = np.load(convert.get_output_path(separate_dirs[name], 'npy'))
+            single = np.load(convert.get_output_path(single_dirs[name], 'npy'))
+            assert np.array_equal(separate, single), f"single-pass output of recipe {name} differs"
+        print(f"one pass per recipe: {separate_time:8.2f} s")
+        print(f"single pass:         {single_time:8.2f} s ({separate_time / single_time:.1f}x)")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def benchmark_roi(args):
+    if not args.in_dir:
+        raise ValueError("The roi benchmark needs --in_dir")
+    recipes = convert.parse_recipes(args.recipe)
+    first_clips = {}
+    for seq_dir, seq_out_dir in convert.get_clips(args.in_dir, ""):
+        first_clips.setdefault(os.path.dirname(seq_out_dir) or ".", seq_dir)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for location, seq_dir in first_clips.items():
+            frame_paths = convert.get_frames(seq_dir)[:args.num_frames]
+            mask = convert.derive_roi_mask(convert.read_frames(frame_paths))
+            layout = convert.get_roi_layout(mask, recipes)
+
+            results = {}
+            for roi in (None, 'auto'):
+                out_dirs = {name: os.path.join(tmp_dir, str(roi), name) for name in recipes}
+                def run():
+                    io = convert.FrameIO()
+                    convert.preprocess_frames(frame_paths, out_dirs, recipes, args.chunk_size, io, 'npy', roi)
+                    return io.times['compute']
+                wall_time, compute_time = best_time(run, args.repeats)
+                results[roi] = wall_time, compute_time, out_dirs
+
+            for name in recipes:
+                full = np.load(convert.get_output_path(results[None][2][name], 'npy'))
+                masked = np.load(convert.get_output_path(results['auto'][2][name], 'npy'))
+                assert np.array_equal(full, masked), f"ROI output of recipe {name} differs for {location}"
+            (full_wall, full_compute, _), (roi_wall, roi_compute, _) = results[None], results['auto']
+            print(f"{location:>12}: fan {mask.mean():6.1%} of pixels, {len(layout.bands):3d} band(s) covering {layout.area:6.1%}, "
+                  f"compute {full_compute:6.2f} s -> {roi_compute:6.2f} s ({full_compute / roi_compute:.2f}x), "
+                  f"total {full_wall:6.2f} s -> {roi_wall:6.2f} s ({full_wall / roi_wall:.2f}x)")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=["build", "online", "read", "video", "recipes", "roi"], help="Which benchmark to run.")
+    parser.add_argument("--clip_dir", default=None, help="Directory of raw frames to benchmark on. By default frames are random.")
+    parser.add_argument("--num_frames", type=int, default=100, help="Number of frames to use.")
+    parser.add_argument("--height", type=int, default=1000, help="Height of random frames.")
+    parser.add_argument("--width", type=int, default=600, help="Width of random frames.")
+    parser.add_argument("--repeats", type=int, default=3, help="Report the best of this many runs.")
+    parser.add_argument("--alpha", type=float, nargs="+", default=[0.01], help="online: exponential background weight(s) of each new frame.")
+    parser.add_argument("--window", type=int, nargs="+", default=None, help="online: also compare windowed mean backgrounds of these many frames.")
+    parser.add_argument("--norm_decay", type=float, default=1.0, help="online: per-frame decay of the running normalizer.")
+    parser.add_argument("--video_format", default="mp4", choices=list(convert.VIDEO_FOURCC), help="video: container to compare the JPEG path against.")
+    parser.add_argument("--recipe", action="append", default=None, help="recipes, roi: channel recipe to convert to, repeatable (see convert.py).")
+    parser.add_argument("--chunk_size", type=int, default=None, help="recipes, roi: stream clips in chunks of this many frames.")
+    parser.add_argument("--in_dir", default=None, help="roi: tree of {location}/{clip} raw frame directories.")
+    return parser
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
+    if args.benchmark == "build":
+        benchmark_build(args)
+    elif args.benchmark == "online":
+        benchmark_online(args)
+    elif args.benchmark == "read":
+        benchmark_read(args)
+    elif args.benchmark == "video":
+        benchmark_video(args)
+    elif args.benchmark == "recipes":
+        benchmark_recipes(args)
+    elif args.benchmark == "roi":
+        benchmark_roi(args)
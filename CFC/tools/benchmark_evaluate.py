@@ -0,0 +1,586 @@
+'''
+benchmark_evaluate.py
+
+Benchmarks for the MOT evaluation in evaluate.py and nmae.py. Each benchmark also
+checks that the fast path produces exactly the same results as the TrackEval-based
+evaluation it replaces.
+
+Benchmarks:
+    - count: count-only nMAE with nmae.evaluate_counts vs. the full evaluate.evaluate,
+             checking that the counts and nMAE of every clip and location are identical.
+             The time to import TrackEval is reported separately.
+    - metric: nMAE.eval_sequence on the TrackEval data of every clip vs. the original implementation
+              (per-detection lists of normalized boxes, counted track by track), comparing time and
+              peak memory, and checking that the results of every clip are identical
+    - cache: parses every gt and tracker file of the tree (the TrackEval loader and nmae.py) without
+             mot_cache.ParseCache, with an empty cache, and with a full cache; then rewrites one tracker's
+             files and parses again. Checks that cached data is identical to parsed data
+    - store: evaluates every (location, tracker, clip) work item without a cache, with an empty cache
+             and with a full one, then again after one clip's predictions change, checking that reused
+             and recomputed sequence results are identical
+    - sweep: evaluate.sweep over --sweep_iou and --sweep_filter_dist vs. one evaluate.evaluate per IoU
+             threshold (which cannot vary filter_dist), checking that the combined results are identical
+    - shard: evaluate.py --shard i/N for every i, as concurrent processes, then evaluate.merge, vs. a single
+             evaluate.evaluate, checking that the combined results and the files they are written to are identical
+    - server: python evaluate.py vs. python eval_client.py (with and without --no_output) with eval_server.py
+              running, as a hyperparameter search would run them, checking that the results are identical
+    - engine: the IoUs and the HOTA, CLEAR and Identity eval_sequence of evaluate.py's 'fast' engine vs. TrackEval's,
+              on every clip and at every --sweep_iou threshold, checking that every field of every clip is
+              identical (values, types and dtypes), and comparing the time of each metric
+    - online: streams the ground truth and tracker rows of every clip frame by frame through online_count.OnlineCounter,
+              checking that its counts are identical to nmae.count_tracks (with max_age at least the longest gap of
+              any track), and reports its throughput in frames and detections per second
+    - anno_store: builds an anno_store.py store of the ground truth, and loads the ground truth of every clip
+                  from it vs. parsing the gt files (TrackEval's loader and nmae.parse_mot_file), checking that
+                  the stored rows and TrackEval data are identical to the parsed ones (sorted by frame)
+
+Results are synthetic (written to a temporary directory by synthetic_mot.make_tree, with
+its workload parameters, e.g. --num_clips, --num_frames and --density) unless --results_dir,
+--anno_dir and --metadata_dir point to a real evaluation tree.
+
+Example command:
+python benchmark_evaluate.py count --num_clips 20 --density 10
+python benchmark_evaluate.py metric --num_clips 20 --num_frames 1000
+python benchmark_evaluate.py cache --num_clips 20 --num_frames 1000 --density 20
+python benchmark_evaluate.py store --num_clips 20 --num_frames 500
+python benchmark_evaluate.py sweep --sweep_iou 0.3 0.4 0.5 0.6 0.7 --sweep_filter_dist 0 0.025 0.05 0.1
+python benchmark_evaluate.py shard --num_shards 4
+python benchmark_evaluate.py server --num_clips 5 --repeats 5
+python benchmark_evaluate.py engine --num_clips 5 --num_frames 500 --density 15
+python benchmark_evaluate.py online --num_clips 5 --num_frames 2000 --density 30
+python benchmark_evaluate.py anno_store --num_clips 20 --num_frames 1000 --density 20
+python benchmark_evaluate.py count --results_dir ../results --anno_dir ../annotations --metadata_dir ../metadata --tracker baseline
+'''
+
+import argparse
+import glob
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_dir, ".."))
+import nmae
+from reference import reference_count, reference_eval_sequence, reference_tracks
+from synthetic_mot import DEFAULT_PARAMS, add_param_arguments, make_tree
+
+
+def get_eval_tree(args):
+    '''
+    (results_dir, anno_dir, metadata_dir, tmp_dir), where tmp_dir holds a synthetic tree unless args points to a real one
+    '''
+    if args.results_dir:
+        return args.results_dir, args.anno_dir, args.metadata_dir, None
+    tmp_dir = tempfile.mkdtemp()
+    make_tree(tmp_dir, { name: getattr(args, name) for name in DEFAULT_PARAMS }, [args.tracker], seed=args.seed)
+    return tuple(os.path.join(tmp_dir, d) for d in ["results", "annotations", "metadata"]) + (tmp_dir,)
+
+def benchmark_count(args):
+    results_dir, anno_dir, metadata_dir, tmp_dir = get_eval_tree(args)
+    try:
+        start = time.perf_counter()
+        counts = nmae.evaluate_counts(results_dir, anno_dir, metadata_dir, args.tracker, quiet=True)
+        count_time = time.perf_counter() - start
+        assert 'trackeval' not in sys.modules, "nmae.py imported TrackEval"
+
+        start = time.perf_counter()
+        import evaluate
+        import_time = time.perf_counter() - start
+        start = time.perf_counter()
+        results = evaluate.evaluate(results_dir, anno_dir, metadata_dir, args.tracker, True)
+        eval_time = time.perf_counter() - start
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    num_seqs = 0
+    for location, loc_counts in counts.items():
+        res = results[location][args.tracker]
+        for seq, seq_counts in loc_counts['sequences'].items():
+            expected = res[seq]['pedestrian']['nMAE']
+            assert all(expected[k] == seq_counts[k] for k in expected), f"{location}/{seq}: {seq_counts} != {expected}"
+            num_seqs += 1
+        expected = res['COMBINED_SEQ']['pedestrian']['nMAE']
+        assert all(expected[k] == loc_counts[k] for k in expected), f"{location}: {loc_counts} != {expected}"
+        print(f"{location:<20} nMAE {loc_counts['nMAE']:.4f}")
+
+    print(f"{num_seqs} clips, counts and nMAE identical")
+    print(f"evaluate.evaluate:     {eval_time:8.3f} s (+{import_time:.3f} s to import TrackEval)")
+    print(f"nmae.evaluate_counts:  {count_time:8.3f} s ({(eval_time + import_time) / count_time:.1f}x)")
+
+def peak_memory(fn):
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def benchmark_metric(args):
+    import evaluate
+    results_dir, anno_dir, metadata_dir, tmp_dir = get_eval_tree(args)
+    try:
+        sequences = []
+        for location in nmae.LOCATIONS:
+            evaluation = evaluate.get_location_evaluation(location, anno_dir, results_dir,
+                            os.path.join(metadata_dir, location + ".json"), [args.tracker])
+            dataset = evaluation['dataset']
+            metric = [m for m in evaluation['metrics_list'] if m.get_name() == 'nMAE'][0]
+            for seq in sorted(dataset.seq_list):
+                data = dataset.get_preprocessed_seq_data(dataset.get_raw_seq_data(args.tracker, seq), 'pedestrian')
+                sequences.append((metric, data, metric.seq_dims[seq]))
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    num_dets = sum(data['num_gt_dets'] + data['num_tracker_dets'] for _, data, _ in sequences)
+    print(f"{len(sequences)} clips, {num_dets} detections")
+    for metric, data, (w, h) in sequences:
+        expected = reference_eval_sequence(data, w, h, metric.filter_dist)
+        result = metric.eval_sequence(data)
+        assert expected == result, f"{data['seq']}: {result} != {expected}"
+        for ids, dets in [(data['gt_ids'], data['gt_dets']), (data['tracker_ids'], data['tracker_dets'])]:
+            tracks = reference_tracks(ids, dets, w, h)
+            assert metric.count(tracks, metric.filter_dist) == reference_count(tracks, metric.filter_dist), f"{data['seq']}: nMAE.count does not match the reference"
+    print("nMAE.eval_sequence and nMAE.count identical to the reference on every clip")
+
+    reference = lambda: [reference_eval_sequence(data, w, h, metric.filter_dist) for metric, data, (w, h) in sequences]
+    vectorized = lambda: [metric.eval_sequence(data) for metric, data, _ in sequences]
+    ref_time, _ = best_time(reference, args.repeats)
+    new_time, _ = best_time(vectorized, args.repeats)
+    ref_peak, new_peak = peak_memory(reference), peak_memory(vectorized)
+    print(f"reference eval_sequence:  {ref_time * 1000:8.1f} ms, peak {ref_peak / 1024:8.1f} KB")
+    print(f"vectorized eval_sequence: {new_time * 1000:8.1f} ms, peak {new_peak / 1024:8.1f} KB ({ref_time / new_time:.1f}x)")
+
+def parse_tree(evaluations, trackers, cache):
+    '''
+    Load every gt and tracker file of evaluations, with the TrackEval loader and with nmae.load_mot_file
+    '''
+    import evaluate
+    parsed = []
+    for evaluation in evaluations.values():
+        dataset = evaluate.SharedGTDataset(evaluation['dataset'].config, cache)
+        for seq in sorted(dataset.seq_list):
+            parsed.append(dataset._load_raw_file(None, seq, True))
+            parsed.append(nmae.load_mot_file(dataset.config["GT_LOC_FORMAT"].format(gt_folder=dataset.gt_fol, seq=seq), cache))
+            for tracker in trackers:
+                parsed.append(dataset._load_raw_file(tracker, seq, False))
+                parsed.append(nmae.load_mot_file(os.path.join(dataset.tracker_fol, tracker, dataset.tracker_sub_fol, seq + ".txt"), cache))
+    return parsed
+
+def assert_same(a, b):
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for key in a:
+            assert_same(a[key], b[key])
+    elif isinstance(a, list):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_same(x, y)
+    elif isinstance(a, np.ndarray):
+        assert a.dtype == b.dtype and np.array_equal(a, b), "cached arrays differ from parsed arrays"
+    else:
+        assert a == b
+
+def benchmark_cache(args):
+    import evaluate
+    import mot_cache
+    results_dir, anno_dir, metadata_dir, tmp_dir = get_eval_tree(args)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        evaluations, _ = evaluate.load_evaluations(results_dir, anno_dir, metadata_dir, [args.tracker])
+        cache = mot_cache.ParseCache(cache_dir)
+
+        start = time.perf_counter()
+        expected = parse_tree(evaluations, [args.tracker], None)
+        parse_time = time.perf_counter() - start
+        start = time.perf_counter()
+        assert_same(expected, parse_tree(evaluations, [args.tracker], cache))
+        cold_time = time.perf_counter() - start
+        warm_time, result = best_time(lambda: parse_tree(evaluations, [args.tracker], cache), args.repeats)
+        assert_same(expected, result)
+
+        # a new version of one tracker: same files with different contents
+        tracker_files = glob.glob(os.path.join(results_dir, "*", args.tracker, "data", "*.txt"))
+        for path in tracker_files:
+            with open(path, "r") as f:
+                text = f.read()
+            with open(path, "w") as f:
+                f.write(text.replace(",-1\n", ",0\n"))
+            os.utime(path, (time.time() - 10, time.time() - 10))
+        start = time.perf_counter()
+        parse_tree(evaluations, [args.tracker], cache)
+        changed_time = time.perf_counter() - start
+        cache_bytes = sum(entry.stat().st_size for entry in os.scandir(cache.entry_dir))
+    finally:
+        shutil.rmtree(cache_dir)
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    print(f"{len(expected) // 2} files parsed twice (TrackEval and nmae.py), {cache_bytes / 2**20:.1f} MB cached, identical to parsing")
+    print(f"no cache:            {parse_time:8.3f} s")
+    print(f"empty cache:         {cold_time:8.3f} s")
+    print(f"full cache:          {warm_time:8.3f} s ({parse_time / warm_time:.1f}x)")
+    print(f"{len(tracker_files):3d} tracker files changed: {changed_time:8.3f} s ({parse_time / changed_time:.1f}x)")
+
+def benchmark_store(args):
+    import evaluate
+    import mot_cache
+    results_dir, anno_dir, metadata_dir, tmp_dir = get_eval_tree(args)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = mot_cache.ParseCache(cache_dir)
+        times = {}
+        seq_results = {}
+        for run, run_cache in [("no cache", None), ("empty cache", cache), ("full cache", cache), ("one clip changed", cache)]:
+            if run == "one clip changed":
+                path = sorted(glob.glob(os.path.join(results_dir, "*", args.tracker, "data", "*.txt")))[0]
+                with open(path, "r") as f:
+                    lines = f.readlines()
+                with open(path, "w") as f:
+                    f.writelines(lines[:len(lines) // 2])
+                os.utime(path, (time.time() - 10, time.time() - 10))
+            evaluations, work_items = evaluate.load_evaluations(results_dir, anno_dir, metadata_dir, [args.tracker], cache=run_cache)
+            start = time.perf_counter()
+            seq_results[run] = evaluate.run_work_items(evaluate._eval_work_item, work_items, evaluations)
+            times[run] = time.perf_counter() - start
+        # the changed clip must match a fresh evaluation without the cache
+        evaluations, work_items = evaluate.load_evaluations(results_dir, anno_dir, metadata_dir, [args.tracker])
+        expected_changed = evaluate.run_work_items(evaluate._eval_work_item, work_items, evaluations)
+    finally:
+        shutil.rmtree(cache_dir)
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    assert_same(seq_results["no cache"], seq_results["empty cache"])
+    assert_same(seq_results["no cache"], seq_results["full cache"])
+    assert_same(expected_changed, seq_results["one clip changed"])
+    print(f"{len(work_items)} work items, results with and without the cache identical")
+    for run, run_time in times.items():
+        print(f"{run + ':':<20} {run_time:8.3f} s ({times['no cache'] / run_time:.1f}x)")
+
+def benchmark_sweep(args):
+    import evaluate
+    results_dir, anno_dir, metadata_dir, tmp_dir = get_eval_tree(args)
+    try:
+        start = time.perf_counter()
+        rows = evaluate.sweep(results_dir, anno_dir, metadata_dir, args.tracker, args.sweep_iou, args.sweep_filter_dist, quiet=True)
+        sweep_time = time.perf_counter() - start
+        start = time.perf_counter()
+        results = {iou_thresh: evaluate.evaluate(results_dir, anno_dir, metadata_dir, args.tracker, True, iou_thresh=iou_thresh)
+                   for iou_thresh in args.sweep_iou}
+        eval_time = time.perf_counter() - start
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    num_checked = 0
+    for row in rows:
+        if row['metric'] == 'nMAE':
+            continue
+        # HOTA does not depend on the IoU threshold
+        res = results[row['iou_thresh'] if row['iou_thresh'] is not None else args.sweep_iou[0]]
+        expected = res[row['location']][args.tracker]['COMBINED_SEQ']['pedestrian'][row['metric']][row['field']]
+        assert np.mean(expected) == row['value'], f"{row} != {expected}"
+        num_checked += 1
+    print(f"{len(rows)} rows, {num_checked} HOTA, CLEAR and Identity rows identical to evaluate.evaluate")
+    print(f"evaluate.evaluate x {len(args.sweep_iou)}:  {eval_time:8.3f} s")
+    print(f"evaluate.sweep:          {sweep_time:8.3f} s ({eval_time / sweep_time:.1f}x), "
+          f"{len(args.sweep_iou)} IoU thresholds x {len(args.sweep_filter_dist)} filter_dist values")
+
+def benchmark_shard(args):
+    import evaluate
+    results_dir, anno_dir, metadata_dir, tmp_dir = get_eval_tree(args)
+    shard_dir = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        expected = evaluate.evaluate(results_dir, anno_dir, metadata_dir, args.tracker, True)
+        eval_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        shard_files = [os.path.join(shard_dir, f"shard_{i}_of_{args.num_shards}.pkl") for i in range(args.num_shards)]
+        processes = [subprocess.Popen([sys.executable, os.path.join(current_dir, "..", "evaluate.py"),
+                                       "--results_dir", results_dir, "--anno_dir", anno_dir, "--metadata_dir", metadata_dir,
+                                       "--tracker", args.tracker, "--shard", f"{i}/{args.num_shards}", "--shard_out", shard_file,
+                                       "--no_cache", "--quiet"], stdout=subprocess.DEVNULL)
+                     for i, shard_file in enumerate(shard_files)]
+        for process in processes:
+            if process.wait():
+                raise RuntimeError(f"{process.args} failed")
+        shard_time = time.perf_counter() - start
+        start = time.perf_counter()
+        merged = evaluate.merge(shard_files, os.path.join(shard_dir, "merged"), True)
+        merge_time = time.perf_counter() - start
+
+        assert_same(expected, merged)
+        for location in expected:
+            output_fol = os.path.join(results_dir, location, args.tracker)
+            for name in os.listdir(output_fol):
+                if name.endswith(".txt") or name.endswith(".csv"):
+                    with open(os.path.join(output_fol, name), "r") as f, open(os.path.join(shard_dir, "merged", location, args.tracker, name), "r") as g:
+                        assert f.read() == g.read(), f"{location}/{args.tracker}/{name} differs"
+    finally:
+        shutil.rmtree(shard_dir)
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    print(f"{args.num_shards} shards merged into results and files identical to evaluate.evaluate")
+    print(f"evaluate.evaluate:   {eval_time:8.3f} s")
+    print(f"{f'{args.num_shards} shards:':<21}{shard_time:8.3f} s (concurrent processes, including imports)")
+    print(f"evaluate.merge:      {merge_time:8.3f} s")
+
+def benchmark_server(args):
+    import eval_client
+    import eval_server
+    import evaluate
+    results_dir, anno_dir, metadata_dir, tmp_dir = get_eval_tree(args)
+    socket_path = os.path.join(tempfile.mkdtemp(), "eval.sock")
+    server = None
+    try:
+        command = [sys.executable, os.path.join(current_dir, "..", "evaluate.py"), "--results_dir", results_dir,
+                   "--anno_dir", anno_dir, "--metadata_dir", metadata_dir, "--tracker", args.tracker, "--no_cache", "--quiet"]
+        eval_time, _ = best_time(lambda: subprocess.run(command, stdout=subprocess.DEVNULL, check=True), args.repeats)
+
+        start = time.perf_counter()
+        server = subprocess.Popen([sys.executable, os.path.join(current_dir, "..", "eval_server.py"), "--anno_dir", anno_dir,
+                                   "--metadata_dir", metadata_dir, "--socket", socket_path, "--no_cache", "--quiet"], stdout=subprocess.DEVNULL)
+        while True:
+            try:
+                eval_client.send_request({'command': 'status'}, socket_path)
+                break
+            except OSError:
+                if server.poll() is not None:
+                    raise RuntimeError("eval_server.py failed to start")
+                time.sleep(0.05)
+        startup_time = time.perf_counter() - start
+
+        json_out = os.path.join(os.path.dirname(socket_path), "results.json")
+        command = [sys.executable, os.path.join(current_dir, "..", "eval_client.py"), "--results_dir", results_dir,
+                   "--tracker", args.tracker, "--socket", socket_path, "--json_out", json_out, "--quiet"]
+        client_time, _ = best_time(lambda: subprocess.run(command, stdout=subprocess.DEVNULL, check=True), args.repeats)
+        no_output_time, _ = best_time(lambda: subprocess.run(command + ["--no_output"], stdout=subprocess.DEVNULL, check=True), args.repeats)
+        with open(json_out, "r") as f:
+            results = json.load(f)
+        eval_client.send_request({'command': 'shutdown'}, socket_path)
+        server.wait()
+
+        expected = evaluate.evaluate(results_dir, anno_dir, metadata_dir, args.tracker, True)
+        expected = { location: { tracker: { 'COMBINED_SEQ': res['COMBINED_SEQ'] } for tracker, res in loc_res.items() }
+                     for location, loc_res in expected.items() }
+        # compare through JSON, as the client gets them
+        assert json.dumps(results, sort_keys=True) == json.dumps(eval_server.to_json(expected), sort_keys=True)
+    finally:
+        if server is not None and server.poll() is None:
+            server.kill()
+        shutil.rmtree(os.path.dirname(socket_path))
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    print("Results of eval_client.py identical to evaluate.evaluate")
+    print(f"python evaluate.py:     {eval_time:8.3f} s per run")
+    print(f"eval_server.py startup: {startup_time:8.3f} s, once")
+    print(f"python eval_client.py:  {client_time:8.3f} s per run ({eval_time / client_time:.1f}x)")
+    print(f"  with --no_output:     {no_output_time:8.3f} s per run ({eval_time / no_output_time:.1f}x), without the summary files and plots")
+
+def assert_identical(a, b, where):
+    '''
+    Stricter than assert_same: scalars must also have the same type, and NaNs are equal
+    '''
+    if isinstance(a, dict):
+        assert a.keys() == b.keys(), f"{where}: {sorted(a.keys())} != {sorted(b.keys())}"
+        for key in a:
+            assert_identical(a[key], b[key], f"{where}.{key}")
+    elif isinstance(a, list):
+        assert len(a) == len(b), f"{where}: {len(a)} != {len(b)} items"
+        for i, (x, y) in enumerate(zip(a, b)):
+            assert_identical(x, y, f"{where}[{i}]")
+    elif isinstance(a, np.ndarray):
+        assert isinstance(b, np.ndarray) and a.dtype == b.dtype and a.shape == b.shape, f"{where}: {b!r} != {a!r}"
+        assert np.array_equal(a, b, equal_nan=a.dtype.kind == 'f'), f"{where}: {b} != {a}"
+    else:
+        assert type(a) == type(b) and (a == b or (a != a and b != b)), f"{where}: {b!r} != {a!r}"
+
+def benchmark_engine(args):
+    import evaluate
+    import trackeval
+    results_dir, anno_dir, metadata_dir, tmp_dir = get_eval_tree(args)
+    try:
+        sequences = []
+        for location in nmae.LOCATIONS:
+            evaluation = evaluate.get_location_evaluation(location, anno_dir, results_dir,
+                            os.path.join(metadata_dir, location + ".json"), [args.tracker])
+            dataset = evaluation['dataset']
+            for seq in sorted(dataset.seq_list):
+                # TrackEval's per-timestep IoUs vs. batch_box_ious
+                expected = trackeval.datasets.MotChallenge2DBox.get_raw_seq_data(dataset, args.tracker, seq)
+                raw_data = dataset.get_raw_seq_data(args.tracker, seq)
+                assert_identical(expected, raw_data, f"{location}/{seq} raw data")
+                sequences.append((dataset, raw_data, dataset.get_preprocessed_seq_data(raw_data, 'pedestrian')))
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    num_dets = sum(data['num_gt_dets'] + data['num_tracker_dets'] for _, _, data in sequences)
+    num_pairs = sum(similarity.size for _, _, data in sequences for similarity in data['similarity_scores'])
+    print(f"{len(sequences)} clips, {num_dets} detections, {num_pairs} (gt, tracker) pairs")
+    print(f"{'':<24}{'trackeval':>15}{'fast':>15}")
+    reference = lambda: [[dataset._calculate_similarities(gt_dets_t, tracker_dets_t) for gt_dets_t, tracker_dets_t
+                          in zip(raw_data['gt_dets'], raw_data['tracker_dets'])] for dataset, raw_data, _ in sequences]
+    batched = lambda: [evaluate.batch_box_ious(raw_data['gt_dets'], raw_data['tracker_dets']) for _, raw_data, _ in sequences]
+    ref_time, _ = best_time(reference, args.repeats)
+    new_time, _ = best_time(batched, args.repeats)
+    print(f"{'IoUs':<24}{ref_time * 1000:>12.1f} ms{new_time * 1000:>12.1f} ms{ref_time / new_time:>8.1f}x")
+
+    total_ref = total_new = 0
+    for name in ['HOTA', 'CLEAR', 'Identity']:
+        # HOTA integrates over IoU thresholds
+        for iou_thresh in args.sweep_iou if name != 'HOTA' else [None]:
+            config = {'THRESHOLD': iou_thresh, 'PRINT_CONFIG': False} if iou_thresh is not None else {'PRINT_CONFIG': False}
+            ref_metric = evaluate.METRIC_ENGINES['trackeval'][name](config)
+            new_metric = evaluate.METRIC_ENGINES['fast'][name](config)
+            for _, _, data in sequences:
+                assert_identical(ref_metric.eval_sequence(data), new_metric.eval_sequence(data), f"{data['seq']} {name}@{iou_thresh}")
+            ref_time, _ = best_time(lambda: [ref_metric.eval_sequence(data) for _, _, data in sequences], args.repeats)
+            new_time, _ = best_time(lambda: [new_metric.eval_sequence(data) for _, _, data in sequences], args.repeats)
+            total_ref += ref_time
+            total_new += new_time
+            label = name if iou_thresh is None else f"{name}@{iou_thresh}"
+            print(f"{label:<24}{ref_time * 1000:>12.1f} ms{new_time * 1000:>12.1f} ms{ref_time / new_time:>8.1f}x")
+    print(f"{'all metrics':<24}{total_ref * 1000:>12.1f} ms{total_new * 1000:>12.1f} ms{total_ref / total_new:>8.1f}x")
+    print("(trackeval, fast) IoUs and every field of HOTA, CLEAR and Identity identical on every clip")
+
+def get_max_gap(rows):
+    '''
+    Largest number of frames between two consecutive detections of a track of the MOT rows
+    '''
+    rows = rows[np.lexsort((rows[:, 0], rows[:, 1]))]
+    same_track = rows[1:, 1] == rows[:-1, 1]
+    return int(np.diff(rows[:, 0])[same_track].max()) if same_track.any() else 0
+
+def benchmark_online(args):
+    import online_count
+    results_dir, anno_dir, metadata_dir, tmp_dir = get_eval_tree(args)
+    try:
+        clips = []
+        for location in nmae.LOCATIONS:
+            with open(os.path.join(metadata_dir, location + ".json")) as f:
+                for clip in json.load(f):
+                    gt_fp = os.path.join(anno_dir, location, clip['clip_name'], "gt.txt")
+                    pred_fp = os.path.join(results_dir, location, args.tracker, "data", clip['clip_name'] + ".txt")
+                    gt_rows, pred_rows = nmae.load_sequence(gt_fp, pred_fp, clip['num_frames'])
+                    clips += [(rows, clip) for rows in (gt_rows, pred_rows)]
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    for rows, clip in clips:
+        for filter_dist in args.sweep_filter_dist:
+            expected = nmae.count_tracks(rows, clip['width'], clip['height'], filter_dist)
+            for max_age in [None, get_max_gap(rows)]:
+                counts, events = online_count.count_rows_online(rows, clip['width'], clip['height'], filter_dist, max_age)
+                assert counts == expected, f"{clip['clip_name']}: {counts} != {expected} (filter_dist {filter_dist}, max_age {max_age})"
+                assert len(events) == sum(counts)
+    print(f"{len(clips)} ground truth and tracker files, online counts identical to nmae.count_tracks at every --sweep_filter_dist")
+
+    num_frames = sum(clip['num_frames'] for _, clip in clips)
+    num_dets = sum(len(rows) for rows, _ in clips)
+    offline_time, _ = best_time(lambda: [nmae.count_tracks(rows, clip['width'], clip['height']) for rows, clip in clips], args.repeats)
+    online_time, _ = best_time(lambda: [online_count.count_rows_online(rows, clip['width'], clip['height']) for rows, clip in clips], args.repeats)
+    print(f"nmae.count_tracks (whole clips): {offline_time:8.3f} s")
+    print(f"OnlineCounter (frame by frame):  {online_time:8.3f} s, {num_frames / online_time:10.0f} frames/s, {num_dets / online_time:10.0f} detections/s")
+
+def benchmark_anno_store(args):
+    import anno_store
+    import evaluate
+    results_dir, anno_dir, metadata_dir, tmp_dir = get_eval_tree(args)
+    store_dir = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        anno_store.build_store(anno_dir, store_dir, quiet=True)
+        build_time = time.perf_counter() - start
+        store_bytes = sum(entry.stat().st_size for entry in os.scandir(store_dir))
+        evaluations, _ = evaluate.load_evaluations(results_dir, anno_dir, metadata_dir, [args.tracker])
+        datasets = { location: evaluation['dataset'] for location, evaluation in evaluations.items() }
+        stored = { location: evaluate.SharedGTDataset(dataset.config, store=anno_store.open_store(store_dir, location))
+                   for location, dataset in datasets.items() }
+        gt_files = [(location, seq, dataset.get_file(None, seq, True)) for location, dataset in datasets.items() for seq in sorted(dataset.seq_list)]
+
+        for location, seq, gt_fp in gt_files:
+            rows = nmae.parse_mot_file(gt_fp)
+            assert_identical(rows[np.argsort(rows[:, 0], kind='stable')], stored[location].store.rows(seq), gt_fp)
+            assert_identical(datasets[location]._load_raw_file(None, seq, True), stored[location]._load_stored_raw_file(seq), gt_fp)
+
+        # _load_parsed_raw_file parses again, where _load_raw_file would return the dataset's loaded gt data
+        trackeval_time, _ = best_time(lambda: [datasets[location]._load_parsed_raw_file(None, seq, True) for location, seq, _ in gt_files], args.repeats)
+        parse_time, _ = best_time(lambda: [nmae.parse_mot_file(gt_fp) for _, _, gt_fp in gt_files], args.repeats)
+        open_time, _ = best_time(lambda: [anno_store.AnnotationStore(store_dir, location) for location in datasets], args.repeats)
+        stored_time, _ = best_time(lambda: [stored[location]._load_stored_raw_file(seq) for location, seq, _ in gt_files], args.repeats)
+        rows_time, _ = best_time(lambda: [stored[location].store.rows(seq) for location, seq, _ in gt_files], args.repeats)
+        query_time, _ = best_time(lambda: [stored[location].store.frames(seq, 1, 51) for location, seq, _ in gt_files], args.repeats)
+    finally:
+        shutil.rmtree(store_dir)
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+    print(f"{len(gt_files)} gt files stored in {build_time:.3f} s ({store_bytes / 2**20:.1f} MB), rows and TrackEval data identical to parsing")
+    print(f"{'TrackEval data, parsed:':<32}{trackeval_time:8.3f} s")
+    print(f"{'TrackEval data, from the store:':<32}{stored_time:8.3f} s ({trackeval_time / stored_time:.1f}x)")
+    print(f"{'rows, nmae.parse_mot_file:':<32}{parse_time:8.3f} s")
+    print(f"{'rows, from the store:':<32}{rows_time:8.3f} s ({parse_time / rows_time:.1f}x)")
+    print(f"{'open every location:':<32}{open_time:8.3f} s")
+    print(f"{'frames 1-50 of every clip:':<32}{query_time:8.3f} s")
+
+def best_time(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=["count", "metric", "cache", "store", "sweep", "shard", "server", "engine", "online", "anno_store"], help="Which benchmark to run.")
+    parser.add_argument("--results_dir", default=None, help="Results directory to benchmark on. By default results are synthetic.")
+    parser.add_argument("--anno_dir", default=None, help="Ground truth annotations matching --results_dir.")
+    parser.add_argument("--metadata_dir", default=None, help="Metadata matching --results_dir.")
+    parser.add_argument("--tracker", default="baseline", help="Name of the tracker to evaluate.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic tree.")
+    parser.add_argument("--repeats", type=int, default=3, help="metric, cache, server, engine, online, anno_store: report the best of this many runs.")
+    parser.add_argument("--sweep_iou", type=float, nargs="+", default=[0.3, 0.5, 0.7], help="sweep, engine: IoU thresholds.")
+    parser.add_argument("--sweep_filter_dist", type=float, nargs="+", default=[0, 0.05, 0.1], help="sweep, online: nMAE filter_dist values.")
+    parser.add_argument("--num_shards", type=int, default=2, help="shard: number of shards.")
+    add_param_arguments(parser)
+    return parser
+
+if __name__ == "__main__":
+    parser = argument_parser()
+    args = parser.parse_args()
+    if args.results_dir and not (args.anno_dir and args.metadata_dir):
+        parser.error("--results_dir needs --anno_dir and --metadata_dir")
+    if args.benchmark == "count":
+        benchmark_count(args)
+    elif args.benchmark == "metric":
+        benchmark_metric(args)
+    elif args.benchmark == "cache":
+        benchmark_cache(args)
+    elif args.benchmark == "store":
+        benchmark_store(args)
+    elif args.benchmark == "sweep":
+        benchmark_sweep(args)
+    elif args.benchmark == "shard":
+        benchmark_shard(args)
+    elif args.benchmark == "server":
+        benchmark_server(args)
+    elif args.benchmark == "engine":
+        benchmark_engine(args)
+    elif args.benchmark == "online":
+        benchmark_online(args)
+    elif args.benchmark == "anno_store":
+        benchmark_anno_store(args)
@@ -0,0 +1,184 @@
+'''
+benchmark_scaling.py
+
+How evaluate.evaluate scales with the workload: generates synthetic CFC-style ground truth
+and tracker outputs (see synthetic_mot.py) for a series of workloads, evaluates each one in
+a fresh process, and records its wall time, throughput (frames and detections per second),
+peak memory (maximum resident set size of the process) and the time of every stage and
+metric (recorded with profiling.py), to a JSON baseline.
+
+Workloads vary one parameter at a time: every workload parameter takes one or more
+values, the first of which is the base workload. E.g. --num_frames 500 1000 2000
+--density 5 20 runs the base workload (500 frames, density 5), then 1000 and 2000 frames
+at density 5, then density 20 at 500 frames.
+
+With --baseline, the results are compared to a previous run's JSON, workload by workload,
+and the script exits with an error if any workload is slower, or uses more memory, than
+--tolerance times the baseline. Baselines are only comparable on the same machine.
+
+Example command:
+python benchmark_scaling.py --num_frames 500 1000 2000 4000 --density 5 10 20 --out scaling.json
+python benchmark_scaling.py --num_frames 500 1000 2000 4000 --density 5 10 20 --out scaling_new.json --baseline scaling.json
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_dir, ".."))
+from synthetic_mot import DEFAULT_PARAMS, add_param_arguments, make_tree
+
+# stages of the profile reported in the printed table; every stage is in the JSON
+PRINT_STAGES = ['HOTA.eval_sequence', 'CLEAR.eval_sequence', 'Identity.eval_sequence', 'nMAE.eval_sequence', 'raw_data', 'preprocess', 'output']
+
+
+def get_workloads(args):
+    '''
+    (name, params) of the base workload, then of every other value of every parameter
+    '''
+    base = { name: getattr(args, name)[0] for name in DEFAULT_PARAMS }
+    workloads = [("base", base)]
+    for name in DEFAULT_PARAMS:
+        for value in getattr(args, name)[1:]:
+            workloads.append((f"{name}={value}", { **base, name: value }))
+    return workloads
+
+def max_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (2**20 if sys.platform == "darwin" else 2**10)
+
+def run_evaluation(root, tracker, engine, workers):
+    '''
+    Evaluate the workload in root, in a fresh process (see measure).
+    Returns:
+        dict, { 'wall_time', 'import_rss_mb', 'peak_rss_mb', 'stages': { stage -> self time } }
+    '''
+    import evaluate
+    import profiling
+    import_rss = max_rss_mb()
+    profiling.enable()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        evaluate.evaluate(os.path.join(root, "results"), os.path.join(root, "annotations"), os.path.join(root, "metadata"),
+                          tracker, True, workers=workers, cache=None, engine=engine)
+    wall_time = time.perf_counter() - start
+    summary = profiling.summarize(profiling.get_profiler().events)
+    return {
+        'wall_time': wall_time,
+        'import_rss_mb': import_rss,
+        'peak_rss_mb': max_rss_mb(),
+        'stages': { stage: total['self_time'] for stage, total in summary['by_stage'].items() },
+    }
+
+def measure(root, args):
+    '''
+    The best of args.repeats runs of run_evaluation, each in a new process, so that
+    imports are not shared between workloads and the peak memory is the workload's own
+    '''
+    runs = []
+    ctx = multiprocessing.get_context("spawn")
+    for _ in range(args.repeats):
+        with ctx.Pool(1) as pool:
+            runs.append(pool.apply(run_evaluation, (root, args.tracker, args.engine, args.workers)))
+    best = min(runs, key=lambda run: run['wall_time'])
+    best['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+    return best
+
+def run_workload(name, params, args):
+    root = tempfile.mkdtemp()
+    try:
+        stats = make_tree(root, params, [args.tracker], seed=args.seed)
+        result = measure(root, args)
+    finally:
+        shutil.rmtree(root)
+    num_dets = stats['num_gt_dets'] + stats['num_tracker_dets']
+    return {
+        'name': name,
+        'params': params,
+        **stats,
+        **result,
+        'frames_per_sec': stats['num_frames'] / result['wall_time'],
+        'dets_per_sec': num_dets / result['wall_time'],
+    }
+
+def print_workload(workload):
+    stages = "".join(f"{workload['stages'].get(stage, 0):>12.3f}" for stage in PRINT_STAGES)
+    print(f"{workload['name']:<24}{workload['num_gt_dets'] + workload['num_tracker_dets']:>10}{workload['wall_time']:>10.3f}"
+          f"{workload['frames_per_sec']:>10.0f}{workload['dets_per_sec']:>10.0f}{workload['peak_rss_mb']:>10.1f}" + stages)
+
+def compare(workloads, baseline, tolerance):
+    '''
+    Print the ratio of every workload's wall time and peak memory to the baseline's.
+    Returns:
+        list of the names of workloads that regressed by more than tolerance
+    '''
+    previous = { workload['name']: workload for workload in baseline['workloads'] }
+    regressions = []
+    print(f"\n{'Workload':<24}{'time':>10}{'baseline':>10}{'ratio':>8}{'MB':>10}{'baseline':>10}{'ratio':>8}")
+    for workload in workloads:
+        old = previous.get(workload['name'])
+        if old is None or old['params'] != workload['params']:
+            print(f"{workload['name']:<24} not in the baseline")
+            continue
+        time_ratio = workload['wall_time'] / old['wall_time']
+        memory_ratio = workload['peak_rss_mb'] / old['peak_rss_mb']
+        regressed = time_ratio > tolerance or memory_ratio > tolerance
+        if regressed:
+            regressions.append(workload['name'])
+        print(f"{workload['name']:<24}{workload['wall_time']:>10.3f}{old['wall_time']:>10.3f}{time_ratio:>8.2f}"
+              f"{workload['peak_rss_mb']:>10.1f}{old['peak_rss_mb']:>10.1f}{memory_ratio:>8.2f}" + ("  REGRESSION" if regressed else ""))
+    return regressions
+
+def argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default="benchmark_scaling.json", help="JSON file to write the results to.")
+    parser.add_argument("--baseline", default=None, help="JSON file of a previous run to compare to.")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Ratio of time or memory to the baseline above which a workload has regressed.")
+    parser.add_argument("--tracker", default="baseline", help="Name of the synthetic tracker.")
+    parser.add_argument("--engine", default="trackeval", help="Metric engine of evaluate.evaluate ('trackeval' or 'fast').")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes evaluate.evaluate runs work items on.")
+    parser.add_argument("--repeats", type=int, default=1, help="Report the best of this many runs of every workload.")
+    parser.add_argument("--seed", type=int, default=0)
+    add_param_arguments(parser, nargs="+")
+    return parser
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(f"{'Workload':<24}{'dets':>10}{'time (s)':>10}{'frames/s':>10}{'dets/s':>10}{'peak MB':>10}" +
+          "".join(f"{stage.replace('.eval_sequence', ''):>12}" for stage in PRINT_STAGES))
+    workloads = []
+    for name, params in get_workloads(args):
+        workloads.append(run_workload(name, params, args))
+        print_workload(workloads[-1])
+
+    report = {
+        'machine': { 'platform': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__,
+                     'cpu_count': os.cpu_count() },
+        'settings': { 'tracker': args.tracker, 'engine': args.engine, 'workers': args.workers, 'repeats': args.repeats, 'seed': args.seed },
+        'workloads': workloads,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=1)
+    print("Wrote", args.out)
+
+    if baseline is not None:
+        regressions = compare(workloads, baseline, args.tolerance)
+        if regressions:
+            sys.exit(f"{len(regressions)} workload(s) regressed by more than {args.tolerance}x: {', '.join(regressions)}")
@@ -0,0 +1,95 @@
+'''
+benchmark_track.py
+
+Speed and accuracy of the baseline tracker in track.py on synthetic data. Writes
+synthetic ground truth (see synthetic_mot.py) and YOLOv5-style detections derived
+from it (jittered boxes, missed detections, false positives, random confidences,
+no IDs), tracks every clip with track.track_all, once on one process and once on
+--workers processes, and evaluates the results with evaluate.evaluate.
+
+Reports the tracking throughput in frames per second (tracking only, and including
+reading detections and writing results), and the HOTA, MOTA, IDF1 and nMAE of every location.
+
+Example command:
+python benchmark_track.py --num_clips 4 --num_frames 1000 --density 10 --workers 4
+'''
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_dir, ".."))
+import nmae
+import track
+from synthetic_mot import DEFAULT_PARAMS, add_param_arguments, make_tracker_output, make_tree
+
+
+def write_yolo_detections(root, params, seed=0):
+    '''
+    Write {root}/detections/{location}/{clip}/{i}.txt YOLO detection files for every
+    clip of the synthetic ground truth in {root}/annotations
+    '''
+    rng = np.random.default_rng(seed)
+    for location in nmae.LOCATIONS:
+        for clip in sorted(os.listdir(os.path.join(root, "annotations", location))):
+            gt = nmae.parse_mot_file(os.path.join(root, "annotations", location, clip, "gt.txt"))
+            # make_tracker_output takes [frame, track, x, y, w, h] rows sorted by track and frame
+            gt = gt[np.lexsort((gt[:, 0], gt[:, 1]))][:, :6]
+            dets = make_tracker_output(rng, gt, { **params, 'idsw_rate': 0 })
+            clip_dir = os.path.join(root, "detections", location, clip)
+            os.makedirs(clip_dir)
+            w, h = params['width'], params['height']
+            for frame in range(1, params['num_frames'] + 1):
+                frame_dets = dets[dets[:, 0] == frame]
+                if not len(frame_dets):
+                    continue
+                with open(os.path.join(clip_dir, f"{frame - 1}.txt"), "w") as f:
+                    for _, _, x, y, bw, bh, conf in frame_dets:
+                        f.write(f"0 {(x - 1 + bw / 2) / w:.6f} {(y - 1 + bh / 2) / h:.6f} {bw / w:.6f} {bh / h:.6f} {conf:.4f}\n")
+
+def argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of processes of the parallel run.")
+    parser.add_argument("--seed", type=int, default=0)
+    add_param_arguments(parser)
+    return parser
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
+    params = { name: getattr(args, name) for name in DEFAULT_PARAMS }
+    root = tempfile.mkdtemp()
+    try:
+        stats = make_tree(root, params, trackers=[], seed=args.seed)
+        write_yolo_detections(root, params, args.seed)
+        metadata_dir, results_dir = os.path.join(root, "metadata"), os.path.join(root, "results")
+        print(f"{stats['num_clips']} clips, {stats['num_frames']} frames, {stats['num_gt_dets']} ground truth detections")
+
+        start = time.perf_counter()
+        clip_stats = track.track_all(os.path.join(root, "detections"), metadata_dir, results_dir, "bytetrack", quiet=True)
+        wall_time = time.perf_counter() - start
+        track_time = sum(stat[4] for stat in clip_stats)
+        print(f"1 process:   {stats['num_frames'] / track_time:8.0f} frames/s tracking, {stats['num_frames'] / wall_time:8.0f} frames/s with I/O")
+        if args.workers > 1:
+            start = time.perf_counter()
+            track.track_all(os.path.join(root, "detections"), metadata_dir, results_dir, "bytetrack", workers=args.workers, quiet=True)
+            parallel_time = time.perf_counter() - start
+            print(f"{args.workers} processes: {stats['num_frames'] / parallel_time:8.0f} frames/s with I/O ({wall_time / parallel_time:.1f}x)")
+
+        import evaluate
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = evaluate.evaluate(results_dir, os.path.join(root, "annotations"), metadata_dir, "bytetrack", True)
+    finally:
+        shutil.rmtree(root)
+
+    print(f"\n{'':<20}{'HOTA':>8}{'MOTA':>8}{'IDF1':>8}{'nMAE':>8}")
+    for location, loc_res in results.items():
+        res = loc_res['bytetrack']['COMBINED_SEQ']['pedestrian']
+        print(f"{location:<20}{100 * np.mean(res['HOTA']['HOTA']):>8.1f}{100 * res['CLEAR']['MOTA']:>8.1f}"
+              f"{100 * res['Identity']['IDF1']:>8.1f}{res['nMAE']['nMAE']:>8.3f}")
@@ -16,14 +16,23 @@ python get_tiny_dataset.py --frames_file_path /home/sstathat/Fish/frames/raw \
                            --metadata_file_path /home/sstathat/Fish/metadata \
                            --metadata_tiny_file_path /home/sstathat/Fish/metadata-tiny \
                            --tiny_dataset_file_path /home/sstathat/Fish/tiny_dataset (OPTIONAL)
+                           --annotation_store_path /home/sstathat/Fish/annotations-store (OPTIONAL)
+
+With --annotation_store_path (an annotation store of --annotation_file_path built by
+anno_store.py), ground truth is read from the store instead of the gt.txt files.
 '''
 import os
+import sys
 import shutil
 import numpy as np
 import json
 import argparse
 import shutil 
 
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_dir, ".."))
+from anno_store import format_mot_rows, open_store
+
 kGTFile = 'gt.txt'
 kKenaiChannelName = 'kenai-channel'
 kKenaiRightBankName = 'kenai-rightbank'
@@ -165,10 +174,28 @@ def get_frames_in_directory ( directory, all_copied_annotation_files, max_frames
 
     return frames
 
-def get_annotations_in_directory ( directory, frame_number, clip_number ):
+def read_annotation_lines ( annotation_dir, store ):
+    '''
+    Returns the lines of the ground truth file of a clip, formatted from the annotation store
+    if it has the clip and the file has not changed since (sorted by frame), or read from
+    its gt.txt file otherwise
+    '''
+    clip_name = os.path.basename ( annotation_dir )
+    gt_file = os.path.join ( annotation_dir, kGTFile )
+    if store is not None and store.is_current ( clip_name, gt_file ):
+        return format_mot_rows ( store.rows ( clip_name ) )
+    if store is not None and clip_name in store:
+        print ( "The annotation store is out of date for", clip_name, "- parsing its gt file" )
+    annotation_file_gt = open ( gt_file, 'r' );
+    lines = annotation_file_gt.readlines()
+    annotation_file_gt.close()
+    return lines
+
+def get_annotations_in_directory ( directory, frame_number, clip_number, store=None ):
     '''
     Returns a list of tiny ground truth files. 
     Used to read from tiny ground truth files to select corresponding frames next.
+    store: (optional) anno_store.AnnotationStore of the river to read the ground truth from
     '''
     tiny_gts = []
     
@@ -182,13 +209,11 @@ def get_annotations_in_directory ( directory, frame_number, clip_number ):
     
     for annotation_dir in annotations_dirs:
         copied_annotation_file = os.path.join ( annotation_dir, 'gt_tiny.txt' );
-        annotation_file_name = os.path.join ( annotation_dir, kGTFile );
 
-        annotation_file_gt = open ( annotation_file_name, 'r' );
         copy_annot_file_write = open ( copied_annotation_file, 'w' );
 
         # read lines from gt file
-        lines = annotation_file_gt.readlines()
+        lines = read_annotation_lines ( annotation_dir, store )
         seen_lines = set({})
         count = 0;
 
@@ -205,7 +230,6 @@ def get_annotations_in_directory ( directory, frame_number, clip_number ):
             count += 1;
         
         # close files
-        annotation_file_gt.close()
         copy_annot_file_write.close()
         tiny_gts.append ( copied_annotation_file )
 
@@ -329,6 +353,7 @@ def parse_args ():
 
     parser.add_argument ( '-n', '--frame_number', help='the maximum number of consecutive frames to get from one clip', default=50)
     parser.add_argument ( '-d', '--clip_number', help='the number of unique camera recordings to extract frames from on every river', default=20)
+    parser.add_argument ( '-s', '--annotation_store_path', help='the complete path to an annotation store of the annotations directory built by anno_store.py, i.e. /path/to/annotations-store', default=None)
 
     return parser.parse_args()
 
@@ -380,7 +405,8 @@ if __name__ == '__main__':
         for river in rivers:
             print ( f'River: {os.path.basename(river)}')
             # get subdirectories in annotations that match the subdirectories of the frames we have annotated
-            all_copied_annotation_files = get_annotations_in_directory ( river, args.frame_number, args.clip_number )
+            store = open_store ( args.annotation_store_path, os.path.basename ( river ) )
+            all_copied_annotation_files = get_annotations_in_directory ( river, args.frame_number, args.clip_number, store )
 
             # move copies of smaller ground-truth files to tiny directories
             all_moved_annotation_files = move_copied_ground_truth_files ( all_copied_annotation_files, args.annotation_tiny_file_path );
@@ -399,7 +425,8 @@ if __name__ == '__main__':
     else:
         print ( f'DEBUG: getting frames and annotations from {kElwhaName} river')
         # Useful to debug just one river and a small number of frames
-        all_copied_annotation_files = get_annotations_in_directory ( os.path.join ( args.annotation_file_path, kElwhaName ), args.frame_number, args.clip_number );
+        store = open_store ( args.annotation_store_path, kElwhaName )
+        all_copied_annotation_files = get_annotations_in_directory ( os.path.join ( args.annotation_file_path, kElwhaName ), args.frame_number, args.clip_number, store );
         all_moved_annotation_files = move_copied_ground_truth_files ( all_copied_annotation_files, args.annotation_tiny_file_path );
 
         all_frames_to_copy = get_frames_in_directory ( os.path.join ( args.frames_file_path, kElwhaName ), all_moved_annotation_files, args.frame_number );
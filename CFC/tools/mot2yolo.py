@@ -5,6 +5,7 @@ file_split.py
 Splits the joint annotation file into frame-matching labels for Yolov5
 Input: 
     - label_dir: input directory of where the labels are (default: current_working_directory/frames/annotation/ )
+    - anno_store: (optional) annotation store of label_dir built by anno_store.py, to read the labels from instead of the gt files
 
 
 Example command: 
@@ -14,25 +15,38 @@ python mot2yolo.py --dir ../dataset/annotation
 import argparse
 import glob
 import os
+import sys
 import cv2
 from tqdm import tqdm
 
-def do_split(in_dir, out_dir, image_dir):
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_dir, ".."))
+from anno_store import GT_FILE, open_store
 
-    # Get MOT file    
-    file = glob.glob(in_dir + "/gt*.txt")
-    if (len(file) == 0): return
+def read_mot_rows(file):
+    # [frame, id, x, y, w, h, ...] of every line of a MOT file, as strings
+    with open(file) as f:
+        return [line.split(",") for line in f.readlines()]
+
+def do_split(in_dir, out_dir, image_dir, store=None):
+
+    # Get MOT rows, from the annotation store if it has the sequence and its gt file has not changed since
+    seq = os.path.basename(os.path.normpath(in_dir))
+    if store is not None and store.is_current(seq, os.path.join(in_dir, GT_FILE)):
+        rows = store.rows(seq).tolist()
+    else:
+        if store is not None and seq in store:
+            print("The annotation store is out of date for", seq, "- parsing its gt file")
+        file = glob.glob(in_dir + "/gt*.txt")
+        if (len(file) == 0): return
+        rows = read_mot_rows(file[0])
 
     # Get image size to convert to normalized coordinates
     (h, w, c) = cv2.imread(image_dir + '/0.jpg', cv2.IMREAD_COLOR).shape
 
-    # Read MOT file
-    f = open(file[0])
-    lines = f.readlines()
     label_dict = {}
     min_frame = float("inf")
-    for line in lines:
-        args = line.split(",")
+    for args in rows:
         frame = int(args[0])
         if (frame < min_frame): min_frame = frame
         if (not frame in label_dict): label_dict[frame] = []
@@ -64,7 +78,7 @@ def do_split(in_dir, out_dir, image_dir):
     label_list = []
     for frame in label_dict:
         label_list.append((frame, label_dict[frame]))
-    sorted(label_list, key=lambda x : x[0])
+    label_list = sorted(label_list, key=lambda x : x[0])
 
     # Write Yolo file
     for i in range(len(label_list)):
@@ -76,7 +90,7 @@ def do_split(in_dir, out_dir, image_dir):
 
 
 
-def file_split(in_dir, out_dir, image_dir):
+def file_split(in_dir, out_dir, image_dir, store_dir=None):
     for location in os.listdir(in_dir):
 
         # Define location folders
@@ -88,6 +102,7 @@ def file_split(in_dir, out_dir, image_dir):
         if location.startswith(".") or not os.path.isdir(in_loc_dir): continue
         if location.startswith(".") or not os.path.isdir(image_loc_dir): continue
         print("Converting frames for", location)
+        store = open_store(store_dir, location)
         
         for seq in tqdm(os.listdir(in_loc_dir)):
 
@@ -105,7 +120,7 @@ def file_split(in_dir, out_dir, image_dir):
                 os.makedirs(out_seq_dir, exist_ok=True)
 
             # Generate Yolo files
-            do_split(label_seq_dir, out_seq_dir, image_seq_dir)
+            do_split(label_seq_dir, out_seq_dir, image_seq_dir, store)
 
 
 def argument_parser():
@@ -113,8 +128,9 @@ def argument_parser():
     parser.add_argument("--in_dir", default="../frames/annotation/", help="Location of frames base directory.")
     parser.add_argument("--out_dir", default="../frames/labels/", help="Location of frames base directory.")
     parser.add_argument("--image_dir", default="../frames/raw/", help="Location of frames base directory.")
+    parser.add_argument("--anno_store", default=None, help="Annotation store of --in_dir built by anno_store.py, to read the labels from.")
     return parser
 
 if __name__ == "__main__":
     args = argument_parser().parse_args()
-    file_split(args.in_dir, args.out_dir, args.image_dir)
\ No newline at end of file
+    file_split(args.in_dir, args.out_dir, args.image_dir, args.anno_store)
\ No newline at end of file
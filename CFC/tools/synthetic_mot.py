@@ -0,0 +1,177 @@
+'''
+synthetic_mot.py
+
+Synthetic CFC-style MOT workloads, to measure how evaluation scales with clip length,
+fish density and tracker quality. Writes ground truth and tracker outputs in the same
+layout as the dataset:
+    {out_dir}/metadata/{location}.json
+    {out_dir}/annotations/{location}/{clip}/gt.txt
+    {out_dir}/results/{location}/{tracker}/data/{clip}.txt
+
+Fish swim across the frame, roughly horizontally, as in the sonar clips. Each tracker's
+output is derived from the ground truth: boxes are jittered, detections are missed,
+tracks switch to a new ID, and short false positive tracks are added.
+
+Workload parameters (see DEFAULT_PARAMS):
+    - num_clips: clips per location
+    - num_frames: frames per clip
+    - width, height: frame size of every clip
+    - density: mean number of fish in a frame
+    - track_length: mean number of frames a fish is visible for
+    - idsw_rate: probability, for each tracked detection, that the tracker switches to a new ID
+    - miss_rate: probability that the tracker misses a ground truth detection
+    - fp_rate: mean number of false positive tracks starting in each frame
+    - box_noise: standard deviation of the tracker's box coordinates around the ground truth, in pixels
+
+Output is deterministic for a given seed.
+
+Example command:
+python synthetic_mot.py --out_dir PATH/TO/synthetic --num_clips 5 --num_frames 2000 --density 20 --tracker baseline baseline++
+'''
+
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_dir, ".."))
+from nmae import LOCATIONS
+
+DEFAULT_PARAMS = {
+    'num_clips': 4,
+    'num_frames': 500,
+    'width': 600,
+    'height': 1000,
+    'density': 5.0,
+    'track_length': 100.0,
+    'idsw_rate': 0.005,
+    'miss_rate': 0.1,
+    'fp_rate': 0.02,
+    'box_noise': 2.0,
+}
+# mean length of a false positive track, in frames
+FP_TRACK_LENGTH = 10
+
+
+def make_tracks(rng, num_tracks, mean_length, num_frames, width, height):
+    '''
+    Random tracks of fish swimming across the frame.
+    Returns:
+        (N, 6) array of [frame, track index, x, y, w, h] rows, sorted by track and then frame,
+        with 1-indexed frames and boxes inside the frame
+    '''
+    lengths = np.minimum(rng.geometric(1 / mean_length, num_tracks), num_frames)
+    starts = rng.integers(1, num_frames - lengths + 2)
+    track = np.repeat(np.arange(num_tracks), lengths)
+    # frame offset of every row within its track
+    t = np.arange(len(track)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    w = rng.uniform(40, 80, num_tracks)[track]
+    h = rng.uniform(20, 40, num_tracks)[track]
+    speed = rng.uniform(2, 8, num_tracks) * rng.choice([-1, 1], num_tracks)
+    x = rng.uniform(1, width - 80, num_tracks)[track] + speed[track] * t + rng.normal(0, 1, len(track))
+    y = rng.uniform(1, height - 40, num_tracks)[track] + 0.1 * speed[track] * t + rng.normal(0, 1, len(track))
+    x = np.clip(x, 1, width - w)
+    y = np.clip(y, 1, height - h)
+    return np.stack([starts[track] + t, track, x, y, w, h], axis=1)
+
+def make_gt(rng, params):
+    '''
+    Ground truth tracks of one clip, as make_tracks, with a Poisson number of tracks
+    such that params['density'] fish are visible in a frame on average
+    '''
+    num_tracks = max(1, rng.poisson(params['density'] * params['num_frames'] / params['track_length']))
+    return make_tracks(rng, num_tracks, params['track_length'], params['num_frames'], params['width'], params['height'])
+
+def make_tracker_output(rng, gt, params):
+    '''
+    A tracker's output for the ground truth gt (as make_gt), with missed detections,
+    ID switches, jittered boxes and false positive tracks.
+    Returns:
+        (N, 7) array of [frame, track index, x, y, w, h, confidence] rows
+    '''
+    track_start = np.r_[True, gt[1:, 1] != gt[:-1, 1]]
+    # every track starts with a new ID, and switches to a new one at each ID switch
+    tracker_track = np.cumsum(track_start | (rng.random(len(gt)) < params['idsw_rate'])) - 1
+    rows = np.concatenate([gt[:, :1], tracker_track[:, np.newaxis], gt[:, 2:]], axis=1)
+    rows = rows[rng.random(len(rows)) >= params['miss_rate']]
+    rows[:, 2:] += rng.normal(0, params['box_noise'], (len(rows), 4))
+    rows[:, 4:] = np.maximum(rows[:, 4:], 1)
+
+    num_fp = rng.poisson(params['fp_rate'] * params['num_frames'])
+    fp = make_tracks(rng, num_fp, FP_TRACK_LENGTH, params['num_frames'], params['width'], params['height'])
+    fp[:, 1] += tracker_track[-1] + 1 if len(tracker_track) else 0
+    rows = np.concatenate([rows, fp])
+    confidence = rng.uniform(0.3, 1, len(rows))
+    return np.concatenate([rows, confidence[:, np.newaxis]], axis=1)
+
+def write_mot(path, rows, gt):
+    '''
+    Write rows (as make_gt or make_tracker_output) as a MOTChallenge file, sorted by frame,
+    with 1-indexed track IDs, and conf -1 for ground truth
+    '''
+    rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+    with open(path, "w") as f:
+        for row in rows:
+            if gt:
+                f.write("%d, %d, %.2f, %.2f, %.2f, %.2f, -1, -1, -1, -1\n" % (row[0], row[1] + 1, row[2], row[3], row[4], row[5]))
+            else:
+                f.write("%d,%d,%.2f,%.2f,%.2f,%.2f,%.3f,-1,-1,-1\n" % (row[0], row[1] + 1, row[2], row[3], row[4], row[5], row[6]))
+
+def make_tree(out_dir, params=None, trackers=("baseline",), locations=LOCATIONS, seed=0):
+    '''
+    Write a synthetic workload (see the module docstring) to out_dir.
+    Args:
+        params: dict of workload parameters, DEFAULT_PARAMS for the ones it does not have
+    Returns:
+        dict, the number of clips, frames, and ground truth and tracker detections written
+    '''
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    rng = np.random.default_rng(seed)
+    stats = { 'num_clips': 0, 'num_frames': 0, 'num_gt_dets': 0, 'num_tracker_dets': 0 }
+    os.makedirs(os.path.join(out_dir, "metadata"), exist_ok=True)
+    for location in locations:
+        metadata = []
+        for i in range(params['num_clips']):
+            clip = f"{location}_{i:03d}"
+            metadata.append({'clip_name': clip, 'num_frames': params['num_frames'], 'width': params['width'], 'height': params['height']})
+            gt_dir = os.path.join(out_dir, "annotations", location, clip)
+            os.makedirs(gt_dir, exist_ok=True)
+            gt = make_gt(rng, params)
+            write_mot(os.path.join(gt_dir, "gt.txt"), gt, gt=True)
+            for tracker in trackers:
+                data_dir = os.path.join(out_dir, "results", location, tracker, "data")
+                os.makedirs(data_dir, exist_ok=True)
+                tracker_output = make_tracker_output(rng, gt, params)
+                write_mot(os.path.join(data_dir, clip + ".txt"), tracker_output, gt=False)
+                stats['num_tracker_dets'] += len(tracker_output)
+            stats['num_clips'] += 1
+            stats['num_frames'] += params['num_frames']
+            stats['num_gt_dets'] += len(gt)
+        with open(os.path.join(out_dir, "metadata", location + ".json"), "w") as f:
+            json.dump(metadata, f)
+    return stats
+
+def add_param_arguments(parser, nargs=None):
+    '''
+    Add a --{name} argument for every workload parameter, with nargs (e.g. "+" for a sweep)
+    '''
+    for name, default in DEFAULT_PARAMS.items():
+        parser.add_argument("--" + name, type=type(default), nargs=nargs, default=default if nargs is None else [default],
+                            help=f"Workload parameter (default: {default}).")
+
+def argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out_dir", required=True, help="Directory to write metadata/, annotations/ and results/ to.")
+    parser.add_argument("--tracker", default=["baseline"], nargs="+", help="Name of the tracker(s) to write outputs for.")
+    parser.add_argument("--seed", type=int, default=0)
+    add_param_arguments(parser)
+    return parser
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
+    params = { name: getattr(args, name) for name in DEFAULT_PARAMS }
+    stats = make_tree(args.out_dir, params, args.tracker, seed=args.seed)
+    print(f"Wrote {stats['num_clips']} clips, {stats['num_frames']} frames, {stats['num_gt_dets']} ground truth "
+          f"and {stats['num_tracker_dets']} tracker detections to {args.out_dir}")
@@ -0,0 +1,336 @@
+'''
+track.py
+
+Baseline multi-object tracker: turns per-frame fish detections into MOT results that
+evaluate.py and nmae.py can score. It is a ByteTrack-style tracker (SORT with a second
+association round for low-confidence detections), with the Kalman filters, IoUs and
+assignments of all the tracks of a frame computed at once with NumPy and SciPy.
+
+For every frame:
+    1. the Kalman filter of every track predicts its box (constant velocity, [cx, cy, w, h] state)
+    2. detections with confidence >= track_thresh are matched to the confirmed tracks
+       (tracked or lost) by IoU, with the Hungarian algorithm, if their IoU >= match_iou
+    3. detections with low_thresh <= confidence < track_thresh are matched to the tracks
+       still unmatched that were tracked in the previous frame, if their IoU >= low_match_iou
+    4. the remaining high confidence detections are matched to the tracks started in the
+       previous frame, which are confirmed by the match or removed
+    5. tracks not seen for more than max_age frames are removed, and unmatched detections
+       with confidence >= new_track_thresh start new tracks
+Confirmed tracks that were matched in a frame are written with their filtered box.
+
+Input:
+    - det_dir: detections of every clip, either
+        - yolo: YOLOv5 detect.py --save-txt --save-conf output, {det_dir}/{location}/{clip}/{i}.txt for the
+                0-indexed frame {i}.jpg, one "class cx cy w h conf" line per detection, normalized to the frame
+                size (labels without conf, e.g. ground truth, get confidence 1)
+        - mot: one MOTChallenge file per clip, {det_dir}/{location}/{clip}.txt, with 1-indexed pixel boxes
+               and the confidence in the 7th column
+    - metadata_dir: metadata JSON file of every location, for the number of frames and size of every clip
+    - results_dir, tracker: MOT results are written to {results_dir}/{location}/{tracker}/data/{clip}.txt
+    - workers: (optional) number of processes to track clips on in parallel
+
+Example command:
+python track.py --det_dir PATH/TO/detections --metadata_dir PATH/TO/metadata --results_dir PATH/TO/results --tracker bytetrack --workers 4
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from nmae import LOCATIONS, parse_mot_file
+
+DEFAULT_PARAMS = {
+    'track_thresh': 0.5,
+    'low_thresh': 0.1,
+    'new_track_thresh': 0.6,
+    'match_iou': 0.2,
+    'low_match_iou': 0.5,
+    'unconfirmed_match_iou': 0.3,
+    'max_age': 30,
+}
+
+# Kalman filter noise, relative to the box size, as in ByteTrack
+STD_WEIGHT_POSITION = 1. / 20
+STD_WEIGHT_VELOCITY = 1. / 160
+# constant velocity motion: x' = x + v
+MOTION_MAT = np.eye(8) + np.eye(8, k=4)
+
+
+def box_ious(boxes1, boxes2):
+    '''
+    IoU of every pair of [x0, y0, x1, y1] boxes, (N, 4) and (M, 4) arrays, as an (N, M) array
+    '''
+    min_ = np.minimum(boxes1[:, np.newaxis, :], boxes2[np.newaxis, :, :])
+    max_ = np.maximum(boxes1[:, np.newaxis, :], boxes2[np.newaxis, :, :])
+    intersection = np.maximum(min_[..., 2] - max_[..., 0], 0) * np.maximum(min_[..., 3] - max_[..., 1], 0)
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    union = area1[:, np.newaxis] + area2[np.newaxis, :] - intersection
+    return intersection / np.maximum(union, np.finfo('float').eps)
+
+def match(ious, min_iou):
+    '''
+    Hungarian matching maximizing IoU, keeping the pairs with IoU >= min_iou.
+    Returns:
+        tuple of (K,) arrays, (rows, cols) of the matched pairs
+    '''
+    if ious.size == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    rows, cols = linear_sum_assignment(-ious)
+    keep = ious[rows, cols] >= min_iou
+    return rows[keep], cols[keep]
+
+def xywh_to_xyxy(boxes):
+    return np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:4]], axis=1)
+
+def state_to_xyxy(mean):
+    '''
+    [x0, y0, x1, y1] boxes of (K, 8) Kalman states [cx, cy, w, h, vcx, vcy, vw, vh]
+    '''
+    half = mean[:, 2:4] / 2
+    return np.concatenate([mean[:, :2] - half, mean[:, :2] + half], axis=1)
+
+class ByteTracker:
+    '''
+    Tracks of one clip (see the module docstring), updated one frame at a time.
+    Track state is kept in arrays, one row per track.
+
+    Usage:
+        tracker = ByteTracker()
+        for frame, (boxes, scores) in enumerate(detections, 1):
+            ids, boxes, scores = tracker.update(boxes, scores)
+    '''
+
+    def __init__(self, track_thresh=0.5, low_thresh=0.1, new_track_thresh=0.6, match_iou=0.2,
+                 low_match_iou=0.5, unconfirmed_match_iou=0.3, max_age=30):
+        self.track_thresh = track_thresh
+        self.low_thresh = low_thresh
+        self.new_track_thresh = new_track_thresh
+        self.match_iou = match_iou
+        self.low_match_iou = low_match_iou
+        self.unconfirmed_match_iou = unconfirmed_match_iou
+        self.max_age = max_age
+        self.num_frames = 0
+        self.next_id = 1
+        # Kalman state and covariance of every track
+        self.mean = np.zeros((0, 8))
+        self.covariance = np.zeros((0, 8, 8))
+        # id (0 until confirmed), frames since the last match, and latest detection confidence of every track
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.time_since_update = np.zeros(0, dtype=np.int64)
+        self.scores = np.zeros(0)
+
+    def _initiate(self, boxes):
+        '''
+        Kalman states of new tracks, from (N, 4) [x, y, w, h] boxes
+        '''
+        mean = np.zeros((len(boxes), 8))
+        mean[:, :2] = boxes[:, :2] + boxes[:, 2:4] / 2
+        mean[:, 2:4] = boxes[:, 2:4]
+        size = np.tile(boxes[:, 2:4], 2)
+        std = np.concatenate([2 * STD_WEIGHT_POSITION * size, 10 * STD_WEIGHT_VELOCITY * size], axis=1)
+        covariance = np.zeros((len(boxes), 8, 8))
+        covariance[:, np.arange(8), np.arange(8)] = std ** 2
+        return mean, covariance
+
+    def _predict(self):
+        # lost tracks keep their position, but not their change in size
+        self.mean[self.time_since_update > 0, 6:] = 0
+        size = np.tile(self.mean[:, 2:4], 2)
+        noise = np.concatenate([STD_WEIGHT_POSITION * size, STD_WEIGHT_VELOCITY * size], axis=1) ** 2
+        self.mean = self.mean @ MOTION_MAT.T
+        self.covariance = MOTION_MAT @ self.covariance @ MOTION_MAT.T
+        self.covariance[:, np.arange(8), np.arange(8)] += noise
+
+    def _correct(self, tracks, boxes):
+        '''
+        Kalman update of the tracks with their matched (K, 4) [x, y, w, h] boxes
+        '''
+        mean, covariance = self.mean[tracks], self.covariance[tracks]
+        measurement = np.concatenate([boxes[:, :2] + boxes[:, 2:4] / 2, boxes[:, 2:4]], axis=1)
+        size = np.tile(mean[:, 2:4], 2)
+        projected_cov = covariance[:, :4, :4].copy()
+        projected_cov[:, np.arange(4), np.arange(4)] += (STD_WEIGHT_POSITION * size) ** 2
+        # gain = P H^T S^-1, with S symmetric
+        gain = np.linalg.solve(projected_cov, covariance[:, :4, :]).transpose(0, 2, 1)
+        innovation = measurement - mean[:, :4]
+        self.mean[tracks] = mean + np.einsum('kij,kj->ki', gain, innovation)
+        self.covariance[tracks] = covariance - gain @ projected_cov @ gain.transpose(0, 2, 1)
+
+    def _keep(self, mask):
+        self.mean, self.covariance = self.mean[mask], self.covariance[mask]
+        self.ids, self.time_since_update, self.scores = self.ids[mask], self.time_since_update[mask], self.scores[mask]
+
+    def update(self, boxes, scores):
+        '''
+        Add the detections of the next frame.
+        Args:
+            boxes: (N, 4) [x, y, w, h] boxes
+            scores: (N,) detection confidences
+        Returns:
+            tuple, (ids, boxes, scores) of the confirmed tracks matched in this frame, as
+            (K,) ids, (K, 4) [x, y, w, h] filtered boxes and (K,) detection confidences
+        '''
+        self.num_frames += 1
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=float).reshape(-1)
+        num_tracks = len(self.ids)
+        if num_tracks:
+            self._predict()
+        track_boxes = state_to_xyxy(self.mean)
+        det_boxes = xywh_to_xyxy(boxes)
+        confirmed = self.ids > 0
+        matched_tracks = np.zeros(num_tracks, dtype=bool)
+        matched_dets = np.zeros(len(boxes), dtype=bool)
+        track_match, det_match = [], []
+
+        def associate(tracks, dets, min_iou):
+            rows, cols = match(box_ious(track_boxes[tracks], det_boxes[dets]), min_iou)
+            matched_tracks[tracks[rows]] = True
+            matched_dets[dets[cols]] = True
+            track_match.append(tracks[rows])
+            det_match.append(dets[cols])
+
+        high = np.flatnonzero(scores >= self.track_thresh)
+        associate(np.flatnonzero(confirmed), high, self.match_iou)
+        low = np.flatnonzero((scores >= self.low_thresh) & (scores < self.track_thresh))
+        associate(np.flatnonzero(confirmed & ~matched_tracks & (self.time_since_update == 0)), low, self.low_match_iou)
+        associate(np.flatnonzero(~confirmed), high[~matched_dets[high]], self.unconfirmed_match_iou)
+
+        tracks, dets = np.concatenate(track_match), np.concatenate(det_match)
+        if len(tracks):
+            self._correct(tracks, boxes[dets])
+            self.scores[tracks] = scores[dets]
+        self.time_since_update += 1
+        self.time_since_update[tracks] = 0
+        newly_confirmed = tracks[self.ids[tracks] == 0]
+        self.ids[newly_confirmed] = np.arange(self.next_id, self.next_id + len(newly_confirmed))
+        self.next_id += len(newly_confirmed)
+        # unconfirmed tracks that were not matched are removed, as are lost tracks that are too old
+        self._keep(matched_tracks | (confirmed & (self.time_since_update <= self.max_age)))
+
+        new = np.flatnonzero(~matched_dets & (scores >= self.new_track_thresh))
+        if len(new):
+            mean, covariance = self._initiate(boxes[new])
+            self.mean = np.concatenate([self.mean, mean])
+            self.covariance = np.concatenate([self.covariance, covariance])
+            # tracks of the first frame are confirmed immediately
+            ids = np.arange(self.next_id, self.next_id + len(new)) if self.num_frames == 1 else np.zeros(len(new), dtype=np.int64)
+            self.next_id += np.count_nonzero(ids)
+            self.ids = np.concatenate([self.ids, ids])
+            self.time_since_update = np.concatenate([self.time_since_update, np.zeros(len(new), dtype=np.int64)])
+            self.scores = np.concatenate([self.scores, scores[new]])
+
+        output = (self.time_since_update == 0) & (self.ids > 0)
+        mean = self.mean[output]
+        return self.ids[output], np.concatenate([mean[:, :2] - mean[:, 2:4] / 2, mean[:, 2:4]], axis=1), self.scores[output]
+
+def parse_yolo_file(path, width, height):
+    '''
+    The [x, y, w, h] 1-indexed pixel boxes and confidences of a YOLO label or detection file
+    '''
+    with open(path, "r") as f:
+        lines = [line.split() for line in f.read().splitlines() if line.strip()]
+    if not lines:
+        return np.zeros((0, 4)), np.zeros(0)
+    values = np.array(lines, dtype=float)
+    scores = values[:, 5] if values.shape[1] > 5 else np.ones(len(values))
+    boxes = np.stack([(values[:, 1] - values[:, 3] / 2) * width + 1, (values[:, 2] - values[:, 4] / 2) * height + 1,
+                      values[:, 3] * width, values[:, 4] * height], axis=1)
+    return boxes, scores
+
+def load_detections(det_dir, det_format, location, clip):
+    '''
+    The detections of every frame of a clip (a metadata entry), as a list of (boxes, scores)
+    '''
+    num_frames = clip['num_frames']
+    if det_format == "yolo":
+        clip_dir = os.path.join(det_dir, location, clip['clip_name'])
+        files = set(os.listdir(clip_dir)) if os.path.isdir(clip_dir) else set()
+        return [parse_yolo_file(os.path.join(clip_dir, f"{i}.txt"), clip['width'], clip['height']) if f"{i}.txt" in files
+                else (np.zeros((0, 4)), np.zeros(0)) for i in range(num_frames)]
+    rows = parse_mot_file(os.path.join(det_dir, location, clip['clip_name'] + ".txt"))
+    rows = rows[np.argsort(rows[:, 0], kind='stable')]
+    bounds = np.searchsorted(rows[:, 0], np.arange(1, num_frames + 2))
+    return [(rows[start:end, 2:6], rows[start:end, 6]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+def track_clip(detections, params=None):
+    '''
+    Track the detections of a clip (as load_detections).
+    Returns:
+        (N, 7) array of MOT rows, [frame, id, x, y, w, h, confidence]
+    '''
+    tracker = ByteTracker(**{**DEFAULT_PARAMS, **(params or {})})
+    rows = []
+    for frame, (boxes, scores) in enumerate(detections, 1):
+        ids, boxes, scores = tracker.update(boxes, scores)
+        if len(ids):
+            rows.append(np.concatenate([np.full((len(ids), 1), frame), ids[:, np.newaxis], boxes, scores[:, np.newaxis]], axis=1))
+    return np.concatenate(rows) if rows else np.zeros((0, 7))
+
+def write_mot_results(path, rows):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write("%d,%d,%.2f,%.2f,%.2f,%.2f,%.3f,-1,-1,-1\n" % tuple(row))
+
+def track_job(job):
+    '''
+    Load, track and write one clip. Returns (location, clip name, number of frames, number of rows, tracking time)
+    '''
+    det_dir, det_format, location, clip, out_dir, params = job
+    detections = load_detections(det_dir, det_format, location, clip)
+    start = time.perf_counter()
+    rows = track_clip(detections, params)
+    track_time = time.perf_counter() - start
+    write_mot_results(os.path.join(out_dir, clip['clip_name'] + ".txt"), rows)
+    return location, clip['clip_name'], clip['num_frames'], len(rows), track_time
+
+def track_all(det_dir, metadata_dir, results_dir, tracker_name, params=None, det_format="yolo", workers=1, locations=LOCATIONS, quiet=False):
+    '''
+    Track every clip of every location in metadata_dir, writing the results to
+    {results_dir}/{location}/{tracker_name}/data/{clip}.txt, on a pool of workers processes if workers > 1.
+    Returns:
+        list of (location, clip name, number of frames, number of rows, tracking time), one per clip
+    '''
+    jobs = []
+    for location in locations:
+        with open(os.path.join(metadata_dir, location + ".json"), "r") as f:
+            clips = json.load(f)
+        out_dir = os.path.join(results_dir, location, tracker_name, "data")
+        os.makedirs(out_dir, exist_ok=True)
+        jobs += [(det_dir, det_format, location, clip, out_dir, params) for clip in clips]
+    if workers <= 1:
+        stats = [track_job(job) for job in jobs]
+    else:
+        # longest clips first, so that they do not finish last
+        jobs.sort(key=lambda job: -job[3]['num_frames'])
+        with multiprocessing.Pool(workers) as pool:
+            stats = list(pool.imap_unordered(track_job, jobs))
+    if not quiet:
+        num_frames = sum(stat[2] for stat in stats)
+        track_time = sum(stat[4] for stat in stats)
+        print(f"Tracked {len(stats)} clips, {num_frames} frames, {num_frames / max(track_time, 1e-9):.0f} frames/s per process")
+    return stats
+
+def argument_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--det_dir", required=True, help="Detections of every clip, see --det_format.")
+    parser.add_argument("--det_format", choices=["yolo", "mot"], default="yolo", help="yolo: {det_dir}/{location}/{clip}/{frame}.txt YOLOv5 detect.py outputs; mot: {det_dir}/{location}/{clip}.txt MOT files.")
+    parser.add_argument("--metadata_dir", default="metadata", help="Location of the metadata JSON file of every location.")
+    parser.add_argument("--results_dir", default="results", help="Results are written to {results_dir}/{location}/{tracker}/data/{clip}.txt")
+    parser.add_argument("--tracker", default="bytetrack", help="Name of the tracker's results.")
+    parser.add_argument("--locations", nargs="+", default=LOCATIONS, help="Locations to track.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes to track clips on in parallel.")
+    for name, default in DEFAULT_PARAMS.items():
+        parser.add_argument("--" + name, type=type(default), default=default)
+    parser.add_argument("--quiet", action="store_true")
+    return parser
+
+if __name__ == "__main__":
+    args = argument_parser().parse_args()
+    params = { name: getattr(args, name) for name in DEFAULT_PARAMS }
+    track_all(args.det_dir, args.metadata_dir, args.results_dir, args.tracker, params, args.det_format, args.workers, args.locations, args.quiet)